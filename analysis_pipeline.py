@@ -0,0 +1,325 @@
+import numpy as np
+
+import tracing
+from market_rates import shared_rates_service
+from peer_index import PeerMultipleIndex
+from ttm_engine import TTMEngine
+
+
+# 相对估值方法名称与结构化结果中字段名的对应关系
+RELATIVE_METHOD_KEYS = {'市盈率(P/E)法': 'pe', '市销率(P/S)法': 'ps', '市净率(P/B)法': 'pb'}
+PEER_STATISTIC_LABELS = {'mean': "平均", 'median': "中位数", 'trimmed_mean': "截尾均值", 'percentile': "分位数"}
+# DCF 假设: 5年增长路径由历史自由现金流增长率逐年递减 10% 并限制在 GROWTH_RATE_BOUNDS 内得到,
+# 自由现金流不足两期时使用 DEFAULT_GROWTH_RATES
+DEFAULT_GROWTH_RATES = [0.15, 0.12, 0.10, 0.08, 0.05]
+GROWTH_RATE_BOUNDS = (0.05, 0.3)
+TERMINAL_GROWTH_RATE = 0.025
+COST_OF_DEBT = 0.055
+
+
+class StockAnalysisPipeline:
+    """
+    获取 → 处理 → 估值 流水线。
+    GUI、后台任务和命令行批量筛选共用这里的逻辑; 估值结果以结构化字典返回，
+    由 format_valuation_report 负责生成界面中展示的文本。
+    """
+
+    def __init__(self, fetcher, processor, valuation_model, rates=None, peer_index=None, peer_statistic='mean',
+                 max_auto_peers=20, history_store=None):
+        self.fetcher = fetcher
+        self.processor = processor
+        self.valuation_model = valuation_model
+        # 同一 fetcher 的流水线共享利率服务, 批量估值时每个 TTL 内只下载一次
+        self.rates = rates or shared_rates_service(fetcher)
+        # 所有处理过的股票的估值倍数; 未指定竞争对手时从中按行业自动选择可比公司
+        self.peer_index = peer_index if peer_index is not None else PeerMultipleIndex()
+        self.peer_statistic = peer_statistic
+        self.max_auto_peers = max_auto_peers
+        # 由季度报表计算的 TTM 基本面, 所有处理过的股票共用一个窗口数组
+        self.ttm_engine = TTMEngine()
+        # 可选的 HistoryStore: 提供时行情写入内存映射存储, data['history'] 换成存储上的零拷贝视图
+        self.history_store = history_store
+
+    def fetch_and_process(self, ticker, period="5y"):
+        data = {
+            'info': self.fetcher.get_company_info(ticker),
+            'history': self.fetcher.get_stock_history(ticker, period=period),
+            'financials': self.fetcher.get_financials(ticker)
+        }
+        return self.process(data, ticker)
+
+    @tracing.traced('process', 'process', ticker='ticker')
+    def process(self, data, ticker=None):
+        """在原始数据 (info, history, financials) 上计算指标并提取报表项目"""
+        if data['info']:
+            ticker = ticker or data['info'].get('symbol')
+            if ticker:
+                self.peer_index.update(ticker, data['info'])
+            if ticker and self.history_store is not None:
+                data['history'] = self.store_history(ticker, data['history'])
+            data['annual_cash_flow'] = self.processor.get_yearly_financial_data(data['financials'], 'cash_flow')
+            data['annual_balance'] = self.processor.get_yearly_financial_data(data['financials'], 'balance_sheet')
+            data['annual_income'] = self.processor.get_yearly_financial_data(data['financials'], 'income_stmt')
+            # 一次解析全部报表项目, 各序列均按日期升序排列
+            statements = self.processor.normalize_statements(data['financials'], ticker=ticker)
+            data['statements'] = statements
+            data['fcf'] = statements.series('free_cash_flow')
+            data['total_debt'] = statements.series('total_liabilities')
+            data['cash_equivalents'] = statements.series('cash_and_equivalents')
+            data['total_equity'] = statements.series('stockholder_equity')
+            # (新增) 获取EPS历史数据用于计算增长率
+            data['eps_history'] = statements.series('diluted_eps')
+            # 季度报表可用时, 估值优先使用最近4个季度的 TTM 数据, 而不是可能已过时近一年的年报
+            data['ttm'] = None
+            if ticker:
+                # 已处理过的股票多出一个新季度时只平移其窗口, 否则整体重新加载
+                self.ttm_engine.update(ticker, self.processor.normalize_statements(
+                    data['financials'], ticker=ticker, quarterly=True))
+                data['ttm'] = self.ttm_engine.values(ticker)
+        return data
+
+    def store_history(self, ticker, history):
+        """把行情写入 history_store 并返回存储上的视图; 没有行情时原样返回"""
+        if history is None or history.empty:
+            return history
+        self.history_store.write(ticker, history)
+        return self.history_store.frame(ticker)
+
+    def indicators(self, data, ticker=None):
+        """按需计算技术指标; 指标不随原始行情一起保存, 避免每只股票多存一份带7个附加列的副本"""
+        ticker = ticker or (data.get('info') or {}).get('symbol')
+        return self.processor.calculate_technical_indicators(data['history'], ticker=ticker)
+
+    def dcf_inputs(self, main_data):
+        """整理 DCF 估值所需的参数; 返回 (参数字典, 缺失项目列表)"""
+        beta = main_data['info'].get('beta')
+        market_cap = main_data['info'].get('marketCap')
+        shares_outstanding = main_data['info'].get('sharesOutstanding')
+        current_fcf = main_data['fcf'].iloc[-1] if not main_data['fcf'].empty else None
+        total_debt = main_data['total_debt'].iloc[-1] if not main_data['total_debt'].empty else None
+        cash_equivalents = main_data['cash_equivalents'].iloc[-1] if not main_data[
+            'cash_equivalents'].empty else None
+        ttm = main_data.get('ttm') or {}
+        basis = "年报"
+        if ttm.get('free_cash_flow') is not None:
+            current_fcf, basis = ttm['free_cash_flow'], f"TTM, 截至 {ttm['as_of']:%Y-%m-%d}"
+        if ttm.get('total_liabilities') is not None:
+            total_debt = ttm['total_liabilities']
+        if ttm.get('cash_and_equivalents') is not None:
+            cash_equivalents = ttm['cash_and_equivalents']
+        required_data_map = {'Beta值': beta, '市值': market_cap, '流通股数': shares_outstanding,
+                             '最新自由现金流': current_fcf, '总负债': total_debt, '现金及等价物': cash_equivalents}
+        missing_items = [name for name, value in required_data_map.items() if value is None]
+        if missing_items:
+            return None, missing_items
+        if len(main_data['fcf']) > 1:
+            hist_growth = main_data['fcf'].pct_change().mean()
+            low, high = GROWTH_RATE_BOUNDS
+            growth_rates_high = [max(min(hist_growth * (1 - 0.1 * i), high), low)
+                                 for i in range(len(DEFAULT_GROWTH_RATES))]
+        else:
+            growth_rates_high = list(DEFAULT_GROWTH_RATES)
+        terminal_growth_rate = TERMINAL_GROWTH_RATE
+        cost_of_debt = COST_OF_DEBT
+        risk_free_rate = self.rates.risk_free_rate(default=self.valuation_model.risk_free_rate)
+        cost_of_equity = self.valuation_model.calculate_cost_of_equity(beta, risk_free_rate)
+        wacc = self.valuation_model.calculate_wacc(market_cap, total_debt, cost_of_equity, cost_of_debt)
+        return {'beta': beta, 'market_cap': market_cap, 'shares_outstanding': shares_outstanding,
+                'current_fcf': current_fcf, 'total_debt': total_debt, 'cash_equivalents': cash_equivalents,
+                'growth_rates_high': growth_rates_high, 'terminal_growth_rate': terminal_growth_rate,
+                'cost_of_debt': cost_of_debt, 'risk_free_rate': risk_free_rate, 'cost_of_equity': cost_of_equity,
+                'wacc': wacc,
+                'fcf_basis': basis}, []
+
+    def eps_growth(self, main_data):
+        """以最近3个正值年度EPS的复合年均增长率 (百分比) 作为格雷厄姆公式中g的代理"""
+        eps_history = main_data.get('eps_history')
+        if eps_history is not None and len(eps_history) > 2:
+            # 过滤负值或零值以避免计算错误
+            eps_history_positive = eps_history[eps_history > 0]
+            if len(eps_history_positive) > 2:
+                end_value = eps_history_positive.iloc[-1]
+                start_value = eps_history_positive.iloc[-3]
+                cagr = ((end_value / start_value) ** (1 / 2)) - 1
+                return cagr * 100  # 转换为百分比
+        return None
+
+    def evaluate(self, main_ticker, main_data, peer_infos=None, current_yield_Y=None, peers=None):
+        """
+        计算 DCF、格雷厄姆和相对估值。
+        :param peer_infos: 竞争对手的 info 字典列表, 会先写入可比公司索引
+        :param peers: 已在可比公司索引中的竞争对手代码; 与 peer_infos 均为空时按行业自动选择
+        :param current_yield_Y: 格雷厄姆公式中的债券收益率 Y (百分比), 为空时从共享利率服务获取
+        :return: 结构化的估值结果字典; 某个模型出错或数据不足时, 对应部分带有 error 或 missing 字段
+        """
+        if current_yield_Y is None:
+            current_yield_Y = self.rates.graham_yield()
+        history = main_data['history']
+        result = {'ticker': main_ticker, 'price': history['Close'].iloc[-1] if not history.empty else None}
+
+        result['dcf'] = self._dcf(main_ticker, main_data)
+        result['graham'] = self._graham(main_ticker, main_data, current_yield_Y)
+        result['relative'] = self._relative(main_ticker, main_data, peer_infos, peers)
+        return result
+
+    @tracing.traced('dcf', 'value', ticker='main_ticker')
+    def _dcf(self, main_ticker, main_data):
+        dcf = {'value': None, 'missing': [], 'error': None}
+        try:
+            dcf_inputs, missing_items = self.dcf_inputs(main_data)
+            if missing_items:
+                dcf['missing'] = missing_items
+            else:
+                dcf.update(dcf_inputs)
+                dcf['value'] = self.valuation_model.dcf_valuation(
+                    dcf_inputs['current_fcf'], dcf_inputs['growth_rates_high'], dcf_inputs['terminal_growth_rate'],
+                    dcf_inputs['wacc'], dcf_inputs['shares_outstanding'], dcf_inputs['total_debt'],
+                    dcf_inputs['cash_equivalents'])
+        except Exception as e:
+            dcf['error'] = str(e)
+        return dcf
+
+    @tracing.traced('graham', 'value', ticker='main_ticker')
+    def _graham(self, main_ticker, main_data, current_yield_Y):
+        graham = {'value': None, 'eps': None, 'g': None, 'bond_yield': current_yield_Y, 'error': None}
+        try:
+            graham['eps'] = main_data['info'].get('trailingEps') or (main_data.get('ttm') or {}).get('diluted_eps')
+            graham['g'] = self.eps_growth(main_data)
+            if all([graham['eps'], graham['g'] is not None, current_yield_Y]):
+                graham['value'] = self.valuation_model.benjamin_graham_valuation(graham['eps'], graham['g'],
+                                                                                 current_yield_Y)
+        except Exception as e:
+            graham['error'] = str(e)
+        return graham
+
+    @tracing.traced('relative', 'value', ticker='main_ticker')
+    def _relative(self, main_ticker, main_data, peer_infos, peers):
+        relative = {'avg_pe': None, 'avg_ps': None, 'avg_pb': None, 'values': {}, 'peers': [], 'peer_group': None,
+                    'statistic': self.peer_statistic, 'error': None}
+        try:
+            explicit_peers = list(peers or [])
+            for info in peer_infos or []:
+                if info and info.get('symbol'):
+                    self.peer_index.update(info['symbol'], info)
+                    explicit_peers.append(info['symbol'])
+            if explicit_peers:
+                relative['peers'], relative['peer_group'] = explicit_peers, "自选"
+            else:
+                relative['peers'], relative['peer_group'] = self.peer_index.peers(main_ticker,
+                                                                                  limit=self.max_auto_peers)
+            multiples = self.peer_index.multiples(relative['peers'], self.peer_statistic)
+            relative['avg_pe'], relative['avg_ps'] = multiples['pe'], multiples['ps']
+            relative['avg_pb'] = multiples['pb']
+            ttm = main_data.get('ttm') or {}
+            target_eps = main_data['info'].get('trailingEps') or ttm.get('diluted_eps')
+            total_revenue = ttm.get('total_revenue') or main_data['statements'].latest('total_revenue')
+            total_equity = ttm.get('stockholder_equity') or (
+                main_data['total_equity'].iloc[-1] if not main_data['total_equity'].empty else None)
+            shares_outstanding = main_data['info'].get('sharesOutstanding')
+            target_sps = total_revenue / shares_outstanding if total_revenue and shares_outstanding else None
+            target_bps = total_equity / shares_outstanding if total_equity and shares_outstanding else None
+            relative['values'] = self.valuation_model.relative_valuation(
+                target_eps, target_sps, target_bps, relative['avg_pe'], relative['avg_ps'], relative['avg_pb'])
+        except Exception as e:
+            relative['error'] = str(e)
+        return relative
+
+    def dcf_sensitivity(self, main_data, steps=41):
+        """以当前假设为中心计算 WACC × 永续增长率 敏感性表, 数据不足时返回 None"""
+        try:
+            dcf_inputs, missing_items = self.dcf_inputs(main_data)
+        except Exception as e:
+            print(f"DCF 敏感性分析参数整理出错: {e}")
+            return None
+        if missing_items or not np.isfinite(dcf_inputs['wacc']):
+            return None
+        waccs = np.linspace(max(dcf_inputs['wacc'] - 0.04, 0.01), dcf_inputs['wacc'] + 0.04, steps)
+        terminal_growth_rates = np.linspace(0.0, 0.05, steps)
+        grid = self.valuation_model.dcf_sensitivity_grid(
+            dcf_inputs['current_fcf'], dcf_inputs['growth_rates_high'], terminal_growth_rates, waccs,
+            dcf_inputs['shares_outstanding'], dcf_inputs['total_debt'], dcf_inputs['cash_equivalents'])
+        return {'values': grid[:, :, 0], 'waccs': waccs, 'terminal_growth_rates': terminal_growth_rates,
+                'base_point': (dcf_inputs['wacc'], dcf_inputs['terminal_growth_rate']),
+                'current_price': main_data['history']['Close'].iloc[-1]}
+
+
+def flatten_valuation(result):
+    """将结构化估值结果展开为一行扁平记录, 供批量筛选输出使用"""
+    dcf, graham, relative = result['dcf'], result['graham'], result['relative']
+    row = {
+        'ticker': result['ticker'],
+        'price': result['price'],
+        'dcf_value': dcf['value'],
+        'dcf_wacc': dcf.get('wacc'),
+        'dcf_cost_of_equity': dcf.get('cost_of_equity'),
+        'dcf_beta': dcf.get('beta'),
+        'dcf_fcf_basis': dcf.get('fcf_basis'),
+        'dcf_missing': ', '.join(dcf['missing']) or None,
+        'dcf_error': dcf['error'],
+        'graham_value': graham['value'],
+        'graham_eps': graham['eps'],
+        'graham_g': graham['g'],
+        'graham_bond_yield': graham['bond_yield'],
+        'graham_error': graham['error'],
+        'peer_avg_pe': relative['avg_pe'],
+        'peer_avg_ps': relative['avg_ps'],
+        'peer_avg_pb': relative['avg_pb'],
+        'peer_group': relative.get('peer_group'),
+        'peer_count': len(relative.get('peers') or []),
+        'relative_error': relative['error'],
+    }
+    for method, key in RELATIVE_METHOD_KEYS.items():
+        row[f'relative_{key}_value'] = relative['values'].get(method)
+    return row
+
+
+def format_valuation_report(result):
+    """生成估值结果选项卡中展示的报告文本"""
+    main_ticker = result['ticker']
+    dcf, graham, relative = result['dcf'], result['graham'], result['relative']
+    output = f"--- {main_ticker} 估值分析 ---\n\n"
+
+    output += "### 1. 折现现金流 (DCF) 估值 ###\n"
+    if dcf['error']:
+        output += f"  - DCF 估值计算出错: {dcf['error']}\n"
+    elif dcf['missing']:
+        output += f"  - 关键数据不足，无法进行DCF估值。\n"
+        output += f"  - 缺失的项目: {', '.join(dcf['missing'])}\n"
+    else:
+        output += f"  - WACC 计算参数: Beta={dcf['beta']:.2f}, 无风险利率={dcf['risk_free_rate']:.2%}, 股权成本={dcf['cost_of_equity']:.2%}, WACC={dcf['wacc']:.2%}\n"
+        output += f"  - 当前自由现金流: {dcf['current_fcf']:,.0f} ({dcf['fcf_basis']})\n"
+        output += f"  - FCF 增长假设 (5年): {[f'{g:.2%}' for g in dcf['growth_rates_high']]}\n"
+        output += f"  >>> DCF 每股内在价值: ${dcf['value']:.2f}\n"
+
+    output += "\n### 2. 本杰明·格雷厄姆估值 ###\n"
+    if graham['error']:
+        output += f"  - 格雷厄姆估值计算出错: {graham['error']}\n"
+    elif graham['value'] is None:
+        output += "  - 关键数据不足 (如 EPS, EPS历史增长率, 或债券收益率)，无法进行估值。\n"
+    else:
+        output += f"  - 计算参数: EPS=${graham['eps']:.2f}, 历史EPS增长率g={graham['g']:.2f}%, 债券收益率Y={graham['bond_yield']:.2f}%\n"
+        output += f"  >>> 格雷厄姆内在价值: ${graham['value']:.2f}\n"
+
+    output += "\n### 3. 相对估值 ###\n"
+    if relative['error']:
+        output += f"  - 相对估值计算出错: {relative['error']}\n"
+    else:
+        pe_str = f"{relative['avg_pe']:.2f}" if relative['avg_pe'] is not None else "N/A"
+        ps_str = f"{relative['avg_ps']:.2f}" if relative['avg_ps'] is not None else "N/A"
+        pb_str = f"{relative['avg_pb']:.2f}" if relative['avg_pb'] is not None else "N/A"
+        if relative['peer_group'] is None:
+            output += "  - 没有可比公司 (未指定竞争对手, 且可比公司索引中没有同行业股票)。\n"
+        else:
+            shown = ', '.join(relative['peers'][:10]) + (" ..." if len(relative['peers']) > 10 else "")
+            output += f"  - 可比公司 ({relative['peer_group']}, {len(relative['peers'])} 家): {shown}\n"
+        label = PEER_STATISTIC_LABELS.get(relative['statistic'], relative['statistic'])
+        output += f"  - 可比公司{label}倍数: P/E={pe_str}, P/S={ps_str}, P/B={pb_str}\n"
+        if not relative['values']:
+            output += "  - 关键数据不足 (如 EPS, 股东权益等)，无法进行相对估值。\n"
+        else:
+            for method, value in relative['values'].items():
+                output += f"  >>> 基于 {method} 的估值: ${value:.2f}\n"
+
+    if result['price'] is not None:
+        output += f"\n### 当前市场价格 ###\n  - {main_ticker} 当前股价: ${result['price']:.2f}\n"
+    return output
@@ -0,0 +1,84 @@
+import queue
+import threading
+
+
+class AnalysisCancelled(Exception):
+    """分析任务被取消或被新任务取代"""
+
+
+class AnalysisAborted(Exception):
+    """流水线无法继续 (如主股票数据获取失败); 任务以 'failed' 结束而不是 'done'"""
+
+
+class AnalysisRun:
+    """一次分析任务的上下文: 用于投递进度事件和检查是否已被取消"""
+
+    def __init__(self, run_id, cancel_event, events):
+        self.run_id = run_id
+        self._cancel_event = cancel_event
+        self._events = events
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self):
+        """若任务已被取消则抛出 AnalysisCancelled, 在各阶段之间调用"""
+        if self._cancel_event.is_set():
+            raise AnalysisCancelled()
+
+    def post(self, kind, ticker=None, stage=None, **payload):
+        """向 UI 线程投递一个事件"""
+        self._events.put({'run_id': self.run_id, 'kind': kind, 'ticker': ticker, 'stage': stage,
+                          'payload': payload})
+
+
+class AnalysisWorker:
+    """
+    在后台线程中运行 获取 → 处理 → 估值 流水线，保证 Tk 主循环不被阻塞。
+    事件通过线程安全的队列传回，由 UI 线程使用 root.after 轮询处理；
+    启动新任务会取消并取代正在运行的旧任务，旧任务的事件可通过 run_id 过滤。
+    """
+
+    def __init__(self):
+        self.events = queue.Queue()
+        self._lock = threading.Lock()
+        self._run_id = 0
+        self._cancel_event = None
+
+    @property
+    def current_run_id(self):
+        return self._run_id
+
+    def start(self, pipeline, *args):
+        """
+        在新线程中运行 pipeline(run, *args)，返回本次任务的 run_id。
+        pipeline 应在适当位置调用 run.check_cancelled() 并通过 run.post() 报告进度。
+        """
+        with self._lock:
+            if self._cancel_event is not None:
+                self._cancel_event.set()
+            self._run_id += 1
+            self._cancel_event = threading.Event()
+            run = AnalysisRun(self._run_id, self._cancel_event, self.events)
+        thread = threading.Thread(target=self._run, args=(run, pipeline, args),
+                                  name=f"analysis-{run.run_id}", daemon=True)
+        thread.start()
+        return run.run_id
+
+    def cancel(self):
+        """取消当前正在运行的任务"""
+        with self._lock:
+            if self._cancel_event is not None:
+                self._cancel_event.set()
+
+    def _run(self, run, pipeline, args):
+        try:
+            pipeline(run, *args)
+            run.post('done')
+        except AnalysisCancelled:
+            run.post('cancelled')
+        except AnalysisAborted as e:
+            run.post('failed', message=str(e), aborted=True)
+        except Exception as e:
+            run.post('failed', message=str(e))
@@ -0,0 +1,351 @@
+import math
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from analysis_pipeline import COST_OF_DEBT, DEFAULT_GROWTH_RATES, GROWTH_RATE_BOUNDS, TERMINAL_GROWTH_RATE
+from statement_normalizer import default_normalizer
+from valuation_model import StockValuationModel
+
+# 远期收益的持有期 (交易日): 约1个月、1个季度、半年、1年
+HORIZONS = (21, 63, 126, 252)
+SIGNALS = ('dcf', 'graham', 'dcf_and_graham')
+# 由报表得到的时点输入; 每项按各自报表的发布日期对齐到调仓日
+INPUT_ITEMS = ('fcf', 'fcf_growth', 'total_debt', 'cash', 'eps', 'eps_growth')
+
+
+def _as_of(grid, dates, values):
+    """每个调仓日可见的最近一期数值 (dates 为升序的可用日期); 在第一期之前为 NaN"""
+    index = np.searchsorted(dates, grid, side='right') - 1
+    if not len(values):
+        return np.full(len(grid), np.nan)
+    result = values[np.maximum(index, 0)].astype(float)
+    result[index < 0] = np.nan
+    return result
+
+
+def _expanding_growth(fcf):
+    """截至每一期的历史自由现金流平均增长率 (与 dcf_inputs 中的 pct_change().mean() 一致); 第一期为 NaN"""
+    growth = np.full(len(fcf), np.nan)
+    if len(fcf) > 1:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            changes = fcf[1:] / fcf[:-1] - 1
+        changes[~np.isfinite(changes)] = np.nan
+        valid = ~np.isnan(changes)
+        counts = np.cumsum(valid)
+        with np.errstate(invalid='ignore'):
+            growth[1:] = np.where(counts > 0, np.cumsum(np.where(valid, changes, 0.0)) / counts, np.nan)
+    return growth
+
+
+def _expanding_eps_growth(eps):
+    """截至每一期最近3个正值 EPS 的复合年均增长率 (百分比, 与 eps_growth 一致); 不足3个正值时为 NaN"""
+    positive = np.flatnonzero(eps > 0)
+    counts = np.searchsorted(positive, np.arange(len(eps)), side='right')
+    growth = np.full(len(eps), np.nan)
+    ok = counts > 2
+    if ok.any():
+        end = eps[positive[counts[ok] - 1]]
+        start = eps[positive[counts[ok] - 3]]
+        growth[ok] = ((end / start) ** 0.5 - 1) * 100
+    return growth
+
+
+def statement_inputs(financials_by_ticker, tickers, grid, report_lag_days=90):
+    """
+    把每只股票的年报转换为 (调仓日 × 股票) 的时点输入面板。
+    报表期末日加 report_lag_days 天视为公开日期, 调仓日只能看到此前已公开的报表, 避免前视偏差;
+    增长率等派生输入只用截至该期 (含) 的报表计算。
+    :return: ({输入项: (调仓日数 × 股票数) 数组}, fresh) ; fresh 标记自上一调仓日以来有新报表公开的单元格
+    """
+    lag = np.timedelta64(int(report_lag_days), 'D')
+    panels = {item: np.full((len(grid), len(tickers)), np.nan) for item in INPUT_ITEMS}
+    fresh = np.zeros((len(grid), len(tickers)), dtype=bool)
+    previous = np.concatenate([[grid[0] - (grid[1] - grid[0] if len(grid) > 1 else np.timedelta64(1, 'D'))],
+                               grid[:-1]]) if len(grid) else grid
+    for j, ticker in enumerate(tickers):
+        financials = financials_by_ticker.get(ticker)
+        if not financials:
+            continue
+        statements = default_normalizer.normalize(financials, ticker=ticker)
+        fcf_dates, fcf = statements.array('free_cash_flow')
+        debt_dates, debt = statements.array('total_liabilities')
+        cash_dates, cash = statements.array('cash_and_equivalents')
+        eps_dates, eps = statements.array('diluted_eps')
+        columns = {'fcf': (fcf_dates, fcf), 'fcf_growth': (fcf_dates, _expanding_growth(fcf)),
+                   'total_debt': (debt_dates, debt), 'cash': (cash_dates, cash),
+                   'eps': (eps_dates, eps), 'eps_growth': (eps_dates, _expanding_eps_growth(eps))}
+        for item, (dates, values) in columns.items():
+            panels[item][:, j] = _as_of(grid, dates + lag, values)
+        published = np.unique(np.concatenate([fcf_dates, debt_dates, cash_dates, eps_dates])) + lag
+        fresh[:, j] = (np.searchsorted(published, grid, side='right')
+                       > np.searchsorted(published, previous, side='right'))
+    return panels, fresh
+
+
+def _shard_inputs(shard):
+    """进程池中执行的分片任务 (必须是模块级函数才能被 pickle)"""
+    financials_by_ticker, tickers, grid, report_lag_days = shard
+    return statement_inputs(financials_by_ticker, tickers, grid, report_lag_days)
+
+
+def close_panel(histories, tickers=None):
+    """把 {代码: 日线 DataFrame} 合并为 (交易日 × 股票) 的收盘价面板; 带时区的索引转换为不带时区的交易日"""
+    series = {}
+    for ticker, df in histories.items():
+        if df is None or df.empty:
+            continue
+        index = pd.DatetimeIndex(df.index)
+        if index.tz is not None:
+            index = index.tz_localize(None)
+        series[ticker] = pd.Series(df['Close'].to_numpy(dtype=float), index=index.normalize())
+    columns = [t for t in (tickers or list(histories)) if t in series]
+    return pd.DataFrame(series, columns=columns).sort_index()
+
+
+class BacktestResult:
+    """
+    回测结果: 调仓日 × 股票 的价格、各模型估值和各持有期的远期收益。
+    signal() 与 summary() 只做数组运算, 可以用不同的安全边际反复评估而无需重新回测。
+    """
+
+    def __init__(self, dates, tickers, price, values, forward_returns, fresh):
+        self.dates = dates
+        self.tickers = tickers
+        self.price = price
+        self.values = values
+        self.forward_returns = forward_returns
+        self.fresh = fresh
+
+    def signal(self, name, margin=0.0):
+        """
+        (信号, 可评估) 两个布尔数组; 信号为 估值 > 价格 × (1 + margin),
+        dcf_and_graham 要求两个模型同时给出信号。估值或价格缺失的单元格不可评估。
+        """
+        names = ('dcf', 'graham') if name == 'dcf_and_graham' else (name,)
+        evaluable = np.isfinite(self.price)
+        signal = evaluable.copy()
+        with np.errstate(invalid='ignore'):
+            for model in names:
+                value = self.values[model]
+                evaluable &= np.isfinite(value)
+                signal &= value > self.price * (1 + margin)
+        return signal & evaluable, evaluable
+
+    def summary(self, margin=0.0, events_only=False):
+        """
+        每个 (信号, 持有期) 一行:
+        evaluated 可评估的单元格数, signals 发出信号的单元格数, signal_return / other_return 有信号 / 无信号时的平均远期收益,
+        spread 两者之差, hit_rate 有信号时远期收益为正的比例, beat_rate 有信号时跑赢同日全部股票远期收益中位数的比例,
+        universe_return 同期全部股票的平均远期收益。
+        :param events_only: 只评估自上一调仓日以来刚公开新报表的单元格 (即每份报表公开后的第一个调仓日)
+        """
+        rows = []
+        for horizon, forward in self.forward_returns.items():
+            universe = np.isfinite(forward) & np.isfinite(self.price)
+            if events_only:
+                universe &= self.fresh
+            with warnings.catch_warnings():
+                # 没有任何股票可评估的调仓日 (如最后一个持有期内) 中位数为 NaN
+                warnings.simplefilter('ignore', RuntimeWarning)
+                median = np.nanmedian(np.where(universe, forward, np.nan), axis=1)[:, None]
+            for name in SIGNALS:
+                signal, evaluable = self.signal(name, margin)
+                evaluable &= universe
+                signal &= evaluable
+                other = evaluable & ~signal
+                n_signals = int(signal.sum())
+                signal_return = float(forward[signal].mean()) if n_signals else math.nan
+                other_return = float(forward[other].mean()) if other.any() else math.nan
+                rows.append({'signal': name, 'horizon': horizon, 'evaluated': int(evaluable.sum()),
+                             'signals': n_signals, 'signal_return': signal_return, 'other_return': other_return,
+                             'spread': signal_return - other_return,
+                             'hit_rate': float((forward[signal] > 0).mean()) if n_signals else math.nan,
+                             'beat_rate': float((forward > median)[signal].mean()) if n_signals else math.nan,
+                             'universe_return': float(forward[universe].mean()) if universe.any() else math.nan})
+        return pd.DataFrame(rows)
+
+    def format_summary(self, margin=0.0, events_only=False):
+        table = self.summary(margin, events_only)
+        scope = "报表公开后的首个调仓日" if events_only else "全部调仓日"
+        lines = [f"回测区间 {self.dates[0]:%Y-%m-%d} 至 {self.dates[-1]:%Y-%m-%d}, {len(self.dates)} 个调仓日 × "
+                 f"{len(self.tickers)} 只股票 ({scope}, 安全边际 {margin:.0%})",
+                 f"{'信号':<16}{'持有期':>6}{'可评估':>9}{'信号数':>8}{'信号收益':>10}{'其余收益':>10}"
+                 f"{'差值':>9}{'胜率':>8}{'跑赢中位数':>10}"]
+        for row in table.itertuples():
+            lines.append(f"{row.signal:<16}{row.horizon:>5}d{row.evaluated:>9}{row.signals:>8}"
+                         f"{row.signal_return:>10.2%}{row.other_return:>10.2%}{row.spread:>9.2%}"
+                         f"{row.hit_rate:>8.1%}{row.beat_rate:>10.1%}")
+        return "\n".join(lines)
+
+    def frame(self):
+        """长表 (调仓日, 代码, 价格, 各模型估值, 各持有期远期收益), 只保留至少有一个估值的单元格"""
+        dates = np.repeat(self.dates.values, len(self.tickers))
+        data = {'date': dates, 'ticker': np.tile(np.asarray(self.tickers, dtype=object), len(self.dates)),
+                'price': self.price.ravel()}
+        for name, value in self.values.items():
+            data[f'{name}_value'] = value.ravel()
+        for horizon, forward in self.forward_returns.items():
+            data[f'return_{horizon}d'] = forward.ravel()
+        keep = np.isfinite(np.column_stack([value.ravel() for value in self.values.values()])).any(axis=1)
+        return pd.DataFrame(data)[keep].reset_index(drop=True)
+
+
+class ValuationBacktest:
+    """
+    DCF 与格雷厄姆 "估值 > 价格" 信号的历史回测。
+    在每个调仓日用当时已公开的年报重建估值输入 (自由现金流、负债、现金、EPS 及其历史增长率),
+    以滚动窗口估计的 Beta 和当日价格计算市值与 WACC, 然后对 (调仓日 × 股票) 的整张数组一次性估值,
+    公式与 StockAnalysisPipeline.evaluate 中的 DCF / 格雷厄姆估值相同。
+    流通股数没有历史数据, 使用当前值; 利率默认为常数, 可传入历史收益率序列。
+    报表解析是唯一逐只股票进行的步骤, processes > 1 时按股票分片在多个进程中执行。
+    """
+
+    def __init__(self, valuation_model=None, horizons=HORIZONS, rebalance='M', report_lag_days=90,
+                 beta_window=252, processes=1):
+        """
+        :param rebalance: 调仓频率: 'D' 每个交易日, 'W' 每周, 'M' 每月, 'Y' 每年 (取每期最后一个交易日)
+        :param report_lag_days: 报表期末日到公开日的天数
+        :param beta_window: 估计 Beta 的滚动窗口 (交易日), 以全部股票的等权平均收益作为市场收益
+        """
+        if rebalance not in ('D', 'W', 'M', 'Y'):
+            raise ValueError(f"不支持的调仓频率: {rebalance} (可选 D / W / M / Y)")
+        self.valuation_model = valuation_model or StockValuationModel()
+        self.horizons = tuple(horizons)
+        self.rebalance = rebalance
+        self.report_lag_days = report_lag_days
+        self.beta_window = beta_window
+        self.processes = processes
+
+    def rebalance_positions(self, dates):
+        """每个调仓期最后一个交易日在 dates 中的位置"""
+        dates = np.asarray(dates, dtype='datetime64[D]')
+        if self.rebalance == 'D':
+            return np.arange(len(dates))
+        if self.rebalance == 'W':
+            # 1970-01-01 是星期四, 加3天后按7天分组即为周一开始的自然周
+            periods = (dates.astype(np.int64) + 3) // 7
+        else:
+            periods = dates.astype(f'datetime64[{self.rebalance}]')
+        return np.flatnonzero(np.append(periods[1:] != periods[:-1], True))
+
+    def rolling_beta(self, closes):
+        """(交易日 × 股票) 的滚动 Beta; 市场收益为全部股票日收益的等权平均"""
+        prices = closes.to_numpy(dtype=float)
+        returns = np.full(prices.shape, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            returns[1:] = prices[1:] / prices[:-1] - 1
+        returns = pd.DataFrame(returns, index=closes.index, columns=closes.columns)
+        market = returns.mean(axis=1)
+        min_periods = max(2, self.beta_window // 2)
+        covariance = returns.rolling(self.beta_window, min_periods=min_periods).cov(market)
+        variance = market.rolling(self.beta_window, min_periods=min_periods).var()
+        return covariance.to_numpy() / variance.to_numpy()[:, None]
+
+    def forward_returns(self, prices, positions):
+        """{持有期: (调仓日 × 股票) 远期收益}; 超出行情末尾的为 NaN"""
+        start = prices[positions]
+        result = {}
+        for horizon in self.horizons:
+            end = np.full(start.shape, np.nan)
+            inside = positions + horizon < len(prices)
+            end[inside] = prices[positions[inside] + horizon]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                result[horizon] = end / start - 1
+        return result
+
+    def _statement_inputs(self, financials_by_ticker, tickers, grid):
+        if self.processes <= 1 or len(tickers) < 2 * self.processes:
+            return statement_inputs(financials_by_ticker, tickers, grid, self.report_lag_days)
+        shards = [list(shard) for shard in np.array_split(np.asarray(tickers, dtype=object), self.processes)]
+        jobs = [({t: financials_by_ticker.get(t) for t in shard}, shard, grid, self.report_lag_days)
+                for shard in shards]
+        with ProcessPoolExecutor(max_workers=self.processes) as executor:
+            results = list(executor.map(_shard_inputs, jobs))
+        panels = {item: np.concatenate([panels[item] for panels, _ in results], axis=1) for item in INPUT_ITEMS}
+        return panels, np.concatenate([fresh for _, fresh in results], axis=1)
+
+    def _rates(self, grid, yields):
+        """每个调仓日的 (无风险利率 小数, 格雷厄姆债券收益率 Y 百分比), 形状为 (调仓日数, 1)"""
+        constant = np.full(len(grid), self.valuation_model.risk_free_rate * 100)
+        if yields is not None and len(yields):
+            index = pd.DatetimeIndex(yields.index)
+            if index.tz is not None:
+                index = index.tz_localize(None)
+            order = np.argsort(index.values, kind='stable')
+            observed = _as_of(grid, index.values[order], yields.to_numpy(dtype=float)[order])
+            constant = np.where(np.isfinite(observed), observed, constant)
+        return (constant / 100)[:, None], constant[:, None]
+
+    def run(self, closes, financials_by_ticker, shares_outstanding, yields=None):
+        """
+        :param closes: (交易日 × 股票) 的收盘价 DataFrame, 例如 close_panel(...) 或 HistoryStore.close_frame()
+        :param financials_by_ticker: {代码: get_financials 返回的字典}; 缺失的股票没有估值
+        :param shares_outstanding: {代码: 流通股数}
+        :param yields: 可选的10年期国债收益率 (百分比) 序列, 按日期对齐到调仓日; 缺失时使用模型的无风险利率
+        :return: BacktestResult
+        """
+        tickers = list(closes.columns)
+        dates = pd.DatetimeIndex(closes.index)
+        prices = closes.to_numpy(dtype=float)
+        positions = self.rebalance_positions(dates.values)
+        grid = dates.values[positions]
+        inputs, fresh = self._statement_inputs(financials_by_ticker, tickers, grid)
+
+        model = self.valuation_model
+        price = prices[positions]
+        beta = self.rolling_beta(closes)[positions]
+        risk_free_rate, bond_yield = self._rates(grid, yields)
+        shares = np.array([shares_outstanding.get(t) or np.nan for t in tickers], dtype=float)[None, :]
+        market_cap = price * shares
+        debt, cash = inputs['total_debt'], inputs['cash']
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cost_of_equity = model.calculate_cost_of_equity(beta, risk_free_rate)
+            # 与 calculate_wacc 相同的公式, 按数组逐元素计算
+            total = market_cap + debt
+            wacc = np.where(total != 0, (market_cap * cost_of_equity
+                                         + debt * COST_OF_DEBT * (1 - model.corporate_tax_rate)) / total, np.nan)
+            low, high = GROWTH_RATE_BOUNDS
+            decay = 1 - 0.1 * np.arange(len(DEFAULT_GROWTH_RATES))
+            growth = np.clip(inputs['fcf_growth'][..., None] * decay, low, high)
+            growth = np.where(np.isfinite(inputs['fcf_growth'])[..., None], growth, DEFAULT_GROWTH_RATES)
+            dcf = model.dcf_valuation_batch(inputs['fcf'], growth, TERMINAL_GROWTH_RATE, wacc, shares, debt, cash)
+            dcf[~np.isfinite(dcf)] = np.nan
+            # 格雷厄姆公式对 Y 成反比, 先以 Y=1 计算再逐日除以 Y; 与 evaluate 一样, EPS 为0时不估值
+            graham = model.benjamin_graham_valuation(inputs['eps'], inputs['eps_growth'], 1.0) / bond_yield
+            graham[~np.isfinite(graham) | (inputs['eps'] == 0)] = np.nan
+
+        return BacktestResult(pd.DatetimeIndex(grid), tickers, price, {'dcf': dcf, 'graham': graham},
+                              self.forward_returns(prices, positions), fresh)
+
+
+def load_inputs(fetcher, scheduler, tickers, period="10y", store=None):
+    """
+    获取回测输入: (收盘价面板, {代码: 报表字典}, {代码: 流通股数})。
+    给定 HistoryStore 时行情直接从存储读取, 否则批量下载; 单只股票获取失败时跳过并打印原因。
+    """
+    from data_fetcher import YAHOO_API_HOST
+    from http_client import FetchError
+
+    futures = {ticker: (scheduler.submit(fetcher.get_company_info, ticker, host=YAHOO_API_HOST),
+                        scheduler.submit(fetcher.get_financials, ticker, host=YAHOO_API_HOST))
+               for ticker in tickers}
+    if store is not None:
+        closes = store.close_frame([t for t in tickers if t in store])
+    else:
+        histories, errors = fetcher.get_stock_histories(tickers, period=period)
+        for ticker, error in errors.items():
+            print(f"获取 {ticker} 历史数据失败: {error}")
+        closes = close_panel(histories, tickers)
+
+    financials_by_ticker, shares = {}, {}
+    for ticker, (info_future, financials_future) in futures.items():
+        try:
+            shares[ticker] = (info_future.result() or {}).get('sharesOutstanding')
+            financials_by_ticker[ticker] = financials_future.result()
+        except FetchError as e:
+            print(f"获取 {ticker} 的公司信息或财务报表失败: {e}")
+    return closes, financials_by_ticker, shares
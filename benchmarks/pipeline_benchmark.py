@@ -0,0 +1,315 @@
+"""
+端到端流水线基准测试: 在 1、10、100、1000 只股票上分别计时数据获取、技术指标、报表项目提取、
+DCF / 格雷厄姆估值和图表渲染, 全程离线 (经由 ReplayBackend 回放响应文件, 不访问网络)。
+
+    python benchmarks/pipeline_benchmark.py                        # 合成数据, 与基线比较, 退化时返回 1, 缺少基线 (或其中的项) 时返回 2
+    python benchmarks/pipeline_benchmark.py --update-baseline      # 在本机记录新的基线
+    python benchmarks/pipeline_benchmark.py --fixtures ./fixtures  # 改用 stockapp record 录制的真实响应
+
+默认使用按固定种子生成的合成响应 (结构与 yfinance 返回的一致), 首次运行时生成并保存在临时目录中;
+使用录制的响应时, 超过已录制股票数的规模会被跳过。
+每个阶段取多次重复中的最小值 (受其他进程干扰最少的一次) 与基线比较。
+仓库中的 benchmarks/pipeline_baseline.json 是合成数据在参考机器上的结果; 基线与机器相关,
+在其他机器上比较前应先用 --update-baseline 重新生成。
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+import warnings
+
+import numpy as np
+import pandas as pd
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARK_DIR))
+
+from data_backend import FixtureStore, ReplayBackend  # noqa: E402
+from data_fetcher import YahooFinanceDataFetcher, history_key  # noqa: E402
+from data_processor import StockDataProcessor  # noqa: E402
+from fetch_scheduler import FetchScheduler  # noqa: E402
+from valuation_model import StockValuationModel  # noqa: E402
+
+DEFAULT_BASELINE_PATH = os.path.join(BENCHMARK_DIR, 'pipeline_baseline.json')
+DEFAULT_SYNTHETIC_PATH = os.path.join(tempfile.gettempdir(), 'stockapp_benchmark_fixtures')
+DEFAULT_SIZES = (1, 10, 100, 1000)
+STAGES = ('fetch', 'indicators', 'statements', 'valuation', 'chart')
+PERIOD = '5y'
+# 超过该秒数的阶段使用 --long-min-delta 作为噪声下限 (长阶段的绝对抖动更大)
+LONG_STAGE_SECONDS = 0.1
+SYNTHETIC_META = 'synthetic.json'
+
+# 合成报表使用 yfinance 的科目名, 另加若干无关科目使行数接近真实报表
+_FILLER_ROWS = [f"Other Item {i:02d}" for i in range(40)]
+_INDUSTRIES = [('Technology', 'Semiconductors'), ('Technology', 'Software - Infrastructure'),
+               ('Healthcare', 'Drug Manufacturers - General'), ('Financial Services', 'Banks - Diversified'),
+               ('Consumer Cyclical', 'Auto Manufacturers'), ('Energy', 'Oil & Gas Integrated'),
+               ('Industrials', 'Aerospace & Defense'), ('Utilities', 'Utilities - Regulated Electric')]
+
+
+def _statement(rng, rows, dates, scale):
+    values = {label: base * scale * (1 + 0.1 * rng.standard_normal(len(dates))) for label, base in rows.items()}
+    values.update({label: scale * rng.standard_normal(len(dates)) for label in _FILLER_ROWS})
+    return pd.DataFrame(values, index=dates).T
+
+
+def _synthetic_ticker(i, seed):
+    """第 i 只合成股票的全部响应: (info, 日线行情, {报表属性: DataFrame})"""
+    rng = np.random.default_rng([seed, i])
+    ticker = f"SYN{i:04d}"
+    dates = pd.bdate_range(end='2024-12-31', periods=1258, tz='America/New_York', name='Date')
+    close = 20 * np.exp(np.cumsum(rng.normal(0.0004, 0.02, len(dates))))
+    spread = close * np.abs(rng.normal(0, 0.01, len(dates)))
+    history = pd.DataFrame({'Open': close + rng.normal(0, 0.5, len(dates)) * spread, 'High': close + spread,
+                            'Low': close - spread, 'Close': close,
+                            'Volume': rng.integers(1e5, 1e7, len(dates)), 'Dividends': 0.0, 'Stock Splits': 0.0},
+                           index=dates)
+    scale = float(rng.uniform(1e8, 5e10))
+    shares = scale / rng.uniform(5, 50)
+    sector, industry = _INDUSTRIES[i % len(_INDUSTRIES)]
+    info = {'symbol': ticker, 'shortName': f"Synthetic {i}", 'sector': sector, 'industry': industry,
+            'marketCap': float(close[-1] * shares), 'sharesOutstanding': float(shares),
+            'beta': float(rng.uniform(0.6, 1.8)), 'trailingEps': float(scale * 0.1 / shares),
+            'trailingPE': float(rng.uniform(8, 40)), 'priceToSalesTrailing12Months': float(rng.uniform(1, 10)),
+            'priceToBook': float(rng.uniform(1, 8)), 'currentPrice': float(close[-1])}
+
+    annual = pd.DatetimeIndex(['2024-12-31', '2023-12-31', '2022-12-31', '2021-12-31'])
+    quarterly = pd.DatetimeIndex(['2024-12-31', '2024-09-30', '2024-06-30', '2024-03-31', '2023-12-31'])
+    income = {'Total Revenue': 1.0, 'Net Income': 0.1, 'Diluted EPS': 0.1 / shares}
+    balance = {'Total Liabilities Net Minority Interest': 0.8, 'Current Liabilities': 0.3,
+               'Cash And Cash Equivalents': 0.2, 'Stockholders Equity': 0.6, 'Total Debt': 0.4}
+    cash_flow = {'Operating Cash Flow': 0.15, 'Capital Expenditure': -0.05, 'Free Cash Flow': 0.1}
+    statements = {}
+    for prefix, dates_, factor in (('', annual, 1.0), ('quarterly_', quarterly, 0.25)):
+        statements[prefix + 'financials'] = _statement(rng, income, dates_, scale * factor)
+        statements[prefix + 'balance_sheet'] = _statement(rng, balance, dates_, scale)
+        statements[prefix + 'cashflow'] = _statement(rng, cash_flow, dates_, scale * factor)
+    return ticker, info, history, statements
+
+
+def synthesize_fixtures(path, n, seed=0):
+    """生成 n 只合成股票 (以及利率) 的响应文件; 同一种子下已生成的股票不再重复生成"""
+    store = FixtureStore(path)
+    meta_path = os.path.join(path, SYNTHETIC_META)
+    meta = {'seed': seed, 'count': 0}
+    if os.path.exists(meta_path):
+        with open(meta_path, encoding='utf-8') as f:
+            existing = json.load(f)
+        if existing['seed'] == seed:
+            meta = existing
+    if meta['count'] >= n:
+        return [f"SYN{i:04d}" for i in range(n)]
+
+    print(f"生成 {n - meta['count']} 只股票的合成响应到 {path} ...")
+    for i in range(meta['count'], n):
+        ticker, info, history, statements = _synthetic_ticker(i, seed)
+        store.save('info', ticker, info)
+        store.save('history', history_key(ticker, '1d', period=PERIOD), history)
+        for attribute, df in statements.items():
+            store.save('statement', f"{ticker}|{attribute}", df)
+    rates = pd.DataFrame({'Close': [4.2, 4.25, 4.3]}, index=pd.bdate_range(end='2024-12-31', periods=3))
+    for symbol in ('^IRX', '^TNX', '^TYX'):
+        store.save('history', history_key(symbol, '1d', period='5d'), rates)
+    meta['count'] = n
+    os.makedirs(path, exist_ok=True)
+    with open(meta_path, 'w', encoding='utf-8') as f:
+        json.dump(meta, f)
+    return [f"SYN{i:04d}" for i in range(n)]
+
+
+def stage_fetch(tickers, store, latency):
+    """并发获取 (批量行情 + 逐只公司信息与报表), 与应用和批量筛选的获取方式相同"""
+    fetcher = YahooFinanceDataFetcher(backend=ReplayBackend(store, latency=latency))
+    scheduler = FetchScheduler(max_workers=8, requests_per_second=1e9, burst=1e9)
+    try:
+        return dict(scheduler.fetch_stocks(fetcher, tickers, period=PERIOD, bulk_history=True))
+    finally:
+        scheduler.shutdown()
+
+
+def stage_indicators(raw, processor):
+    return {ticker: processor.calculate_technical_indicators(data['history'], ticker=ticker)
+            for ticker, data in raw.items()}
+
+
+def stage_statements(raw, processor):
+    """逐只调用报表项目提取函数 (自由现金流、EPS、总负债、现金、股东权益)"""
+    extracted = {}
+    for ticker, data in raw.items():
+        financials = data['financials']
+        cash_flow = processor.get_yearly_financial_data(financials, 'cash_flow')
+        balance = processor.get_yearly_financial_data(financials, 'balance_sheet')
+        income = processor.get_yearly_financial_data(financials, 'income_stmt')
+        extracted[ticker] = {
+            'fcf': processor.calculate_free_cash_flow(cash_flow),
+            'eps': processor.get_eps_from_financials(income),
+            'total_debt': processor.get_total_debt(balance),
+            'cash': processor.get_cash_and_equivalents(balance),
+            'equity': processor.get_total_stockholder_equity(balance),
+        }
+    return extracted
+
+
+def stage_valuation(raw, extracted, model):
+    values = {}
+    for ticker, data in raw.items():
+        info, items = data['info'], extracted[ticker]
+        if items['fcf'].empty or not info.get('sharesOutstanding'):
+            continue
+        total_debt = items['total_debt'].iloc[-1] if not items['total_debt'].empty else 0.0
+        cost_of_equity = model.calculate_cost_of_equity(info.get('beta') or 1.0)
+        wacc = model.calculate_wacc(info['marketCap'], total_debt, cost_of_equity, 0.05)
+        dcf = model.dcf_valuation(items['fcf'].iloc[-1], [0.10] * 5, 0.025, max(wacc, 0.05),
+                                  info['sharesOutstanding'], total_debt,
+                                  items['cash'].iloc[-1] if not items['cash'].empty else 0.0)
+        graham = model.benjamin_graham_valuation(info.get('trailingEps') or 0.0, 10.0, 4.4)
+        values[ticker] = (dcf, graham)
+    return values
+
+
+def stage_chart(raw):
+    """在一张对比图中绘制全部股票的收盘价, 并完成一次完整的光栅化"""
+    from visualizer import StockVisualizer
+    import matplotlib.pyplot as plt
+
+    visualizer = StockVisualizer(master=None)
+    try:
+        visualizer.plot_multi_stock_comparison({ticker: data['history'] for ticker, data in raw.items()})
+        visualizer.fig.canvas.draw()
+    finally:
+        plt.close(visualizer.fig)
+
+
+def _timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def run_size(tickers, store, latency, repeat):
+    """对一组股票依次运行全部阶段 repeat 次, 返回 {阶段: 最小秒数}"""
+    processor = StockDataProcessor()
+    model = StockValuationModel(risk_free_rate=0.04, market_return=0.09)
+    timings = {stage: [] for stage in STAGES}
+    for _ in range(repeat):
+        raw, elapsed = _timed(stage_fetch, tickers, store, latency)
+        timings['fetch'].append(elapsed)
+        missing = [ticker for ticker in tickers if raw.get(ticker, {}).get('errors')]
+        if missing:
+            raise RuntimeError(f"{len(missing)} 只股票缺少响应文件, 例如 {missing[0]}: {raw[missing[0]]['errors']}")
+        timings['indicators'].append(_timed(stage_indicators, raw, processor)[1])
+        extracted, elapsed = _timed(stage_statements, raw, processor)
+        timings['statements'].append(elapsed)
+        timings['valuation'].append(_timed(stage_valuation, raw, extracted, model)[1])
+        timings['chart'].append(_timed(stage_chart, raw)[1])
+    return {stage: min(values) for stage, values in timings.items()}
+
+
+def compare(results, baseline, threshold, min_delta, long_min_delta):
+    """
+    返回 (退化项列表 [(键, 本次秒数, 基线秒数)], 基线中没有的键列表)。
+    差值小于 min_delta 秒 (基线超过 LONG_STAGE_SECONDS 的阶段为 long_min_delta 秒) 的视为计时噪声。
+    """
+    regressions, missing = [], []
+    for key, elapsed in results.items():
+        base = baseline.get(key)
+        if base is None:
+            missing.append(key)
+            continue
+        noise = long_min_delta if base > LONG_STAGE_SECONDS else min_delta
+        if elapsed > base * (1 + threshold) and elapsed - base > noise:
+            regressions.append((key, elapsed, base))
+    return regressions, missing
+
+
+def _machine():
+    return f"{platform.machine()} {os.cpu_count()} CPU, {platform.system()}"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="离线测量获取、指标、报表提取、估值和绘图在不同股票数下的耗时")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES), help="股票数")
+    parser.add_argument('--repeat', type=int, default=5, help="每个规模的重复次数 (取最小值)")
+    parser.add_argument('--warmup', type=int, default=1, help="不计入结果的预热次数 (导入模块、加载字体等)")
+    parser.add_argument('--fixtures', help="stockapp record 录制的响应目录 (默认使用合成数据)")
+    parser.add_argument('--synthetic-dir', default=DEFAULT_SYNTHETIC_PATH, help="合成响应的保存目录")
+    parser.add_argument('--seed', type=int, default=0, help="合成数据的随机种子")
+    parser.add_argument('--latency', type=float, default=0.0, help="回放时每个请求模拟的网络延迟 (秒)")
+    parser.add_argument('--threshold', type=float, default=0.20, help="允许比基线慢的比例")
+    parser.add_argument('--min-delta', type=float, default=0.01, help="低于该秒数的差值不算退化")
+    parser.add_argument('--long-min-delta', type=float, default=0.05,
+                        help=f"超过 {LONG_STAGE_SECONDS * 1000:.0f} ms 的阶段低于该秒数的差值不算退化")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH, help="基线文件路径")
+    parser.add_argument('--update-baseline', action='store_true', help="把本次结果写入基线文件")
+    args = parser.parse_args(argv)
+
+    import matplotlib
+    matplotlib.use('Agg')
+    # 没有中文字体的机器上每次绘图都会输出大量字体警告
+    logging.getLogger('matplotlib.font_manager').setLevel(logging.ERROR)
+    warnings.filterwarnings('ignore', category=UserWarning)
+
+    if args.fixtures:
+        store = FixtureStore(args.fixtures)
+        available = store.tickers()
+        source = os.path.abspath(args.fixtures)
+    else:
+        available = synthesize_fixtures(args.synthetic_dir, max(args.sizes), args.seed)
+        store = FixtureStore(args.synthetic_dir)
+        source = f"synthetic:seed={args.seed}"
+
+    for _ in range(args.warmup):
+        run_size(available[:1], store, 0.0, 1)
+    results = {}
+    print(f"{'股票数':>6} " + " ".join(f"{stage:>11}" for stage in STAGES))
+    for size in sorted(args.sizes):
+        if size > len(available):
+            print(f"{size:>6} 跳过: 只有 {len(available)} 只股票的响应")
+            continue
+        timings = run_size(available[:size], store, args.latency, args.repeat)
+        print(f"{size:>6} " + " ".join(f"{timings[stage] * 1000:>9.1f}ms" for stage in STAGES))
+        results.update({f"{stage}@{size}": elapsed for stage, elapsed in timings.items()})
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'fixtures': source, 'latency': args.latency, 'repeat': args.repeat, 'statistic': 'min',
+                       'machine': _machine(), 'python': sys.version.split()[0], 'results': results}, f, indent=2)
+        print(f"基线已写入 {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"错误: 未找到基线文件 {args.baseline}, 无法判断是否退化。请先使用 --update-baseline 生成。")
+        return 2
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    if baseline.get('fixtures') != source or baseline.get('latency') != args.latency:
+        print(f"警告: 基线使用的数据 ({baseline.get('fixtures')}, 延迟 {baseline.get('latency')}s) "
+              f"与本次 ({source}, 延迟 {args.latency}s) 不同, 比较结果可能没有意义。")
+    if baseline.get('machine') != _machine():
+        print(f"警告: 基线记录于 {baseline.get('machine')}, 本机为 {_machine()}; "
+              f"请在本机用 --update-baseline 重新生成基线后再比较。")
+    if baseline.get('statistic') != 'min' or args.repeat < 5:
+        print(f"警告: 基线统计量为 {baseline.get('statistic', 'median')} (重复 {baseline.get('repeat')} 次), "
+              f"本次为最小值 (重复 {args.repeat} 次); 重复少于 5 次时计时噪声较大。")
+    regressions, missing = compare(results, baseline['results'], args.threshold, args.min_delta,
+                                   args.long_min_delta)
+    for key, elapsed, base in regressions:
+        print(f"性能退化: {key} {elapsed * 1000:.1f} ms, 基线 {base * 1000:.1f} ms "
+              f"(上限 {base * (1 + args.threshold) * 1000:.1f} ms)")
+    if missing:
+        print(f"错误: 基线中没有以下 {len(missing)} 项, 无法判断是否退化: {', '.join(missing)}。"
+              f"请使用 --update-baseline 重新生成基线。")
+    if regressions:
+        return 1
+    if missing:
+        return 2
+    print(f"未退化 (阈值 {args.threshold:.0%}, 共比较 {len(set(results) & set(baseline['results']))} 项)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
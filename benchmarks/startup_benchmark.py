@@ -0,0 +1,91 @@
+"""
+启动耗时基准测试: 测量从启动 main_app.py 到主窗口首次可见的时间 (time-to-first-window)。
+
+    python benchmarks/startup_benchmark.py                     # 与基线比较, 退化超过阈值时返回 1
+    python benchmarks/startup_benchmark.py --update-baseline   # 在本机记录新的基线
+
+退出码: 0 未退化 (或已写入基线), 1 退化, 2 缺少基线文件, 3 没有图形显示、未能测量。
+
+每次运行都在新的解释器进程中启动程序, 并设置环境变量 STOCKAPP_STARTUP_PROBE=1,
+程序在窗口可见时输出 FIRST_WINDOW 标记后立即退出。取多次运行的中位数以减少抖动。
+基线与机器相关, 保存在 benchmarks/startup_baseline.json 中, 需先在本机用 --update-baseline 生成。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+APP_PATH = os.path.join(os.path.dirname(BENCHMARK_DIR), 'main_app.py')
+DEFAULT_BASELINE_PATH = os.path.join(BENCHMARK_DIR, 'startup_baseline.json')
+MARKER = 'FIRST_WINDOW'
+# 没有图形显示时无法测量; 用单独的退出码, 避免在无头 CI 中被当作通过
+EXIT_NO_DISPLAY = 3
+
+
+def measure_once(timeout=60.0):
+    """启动一次程序, 返回看到 FIRST_WINDOW 标记所用的秒数"""
+    env = dict(os.environ, STOCKAPP_STARTUP_PROBE='1')
+    started = time.perf_counter()
+    proc = subprocess.Popen([sys.executable, APP_PATH], stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            env=env, text=True, cwd=os.path.dirname(APP_PATH))
+    try:
+        for line in proc.stdout:
+            if line.strip() == MARKER:
+                elapsed = time.perf_counter() - started
+                proc.wait(timeout=timeout)
+                return elapsed
+        proc.wait(timeout=timeout)
+    except subprocess.TimeoutExpired:
+        proc.kill()
+        raise RuntimeError(f"程序在 {timeout} 秒内没有退出")
+    raise RuntimeError(f"未收到窗口可见标记, 退出码 {proc.returncode}:\n{proc.stderr.read()}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="测量主窗口首次可见的启动耗时")
+    parser.add_argument('--runs', type=int, default=7, help="测量次数 (取中位数)")
+    parser.add_argument('--warmup', type=int, default=1, help="不计入结果的预热次数 (生成字节码缓存等)")
+    parser.add_argument('--threshold', type=float, default=0.20, help="允许比基线慢的比例")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE_PATH, help="基线文件路径")
+    parser.add_argument('--update-baseline', action='store_true', help="把本次结果写入基线文件")
+    args = parser.parse_args(argv)
+
+    if not args.update_baseline and not os.path.exists(args.baseline):
+        print(f"未找到基线文件 {args.baseline}, 请先使用 --update-baseline 生成。")
+        return 2
+    if sys.platform.startswith('linux') and not os.environ.get('DISPLAY') and not os.environ.get('WAYLAND_DISPLAY'):
+        print(f"没有可用的图形显示 (DISPLAY 未设置), 无法测量启动耗时, 返回 {EXIT_NO_DISPLAY}。"
+              "无头环境中可在 xvfb-run 下运行。")
+        return EXIT_NO_DISPLAY
+
+    for _ in range(args.warmup):
+        measure_once()
+    timings = [measure_once() for _ in range(args.runs)]
+    median = statistics.median(timings)
+    print(f"首个窗口可见耗时: 中位数 {median * 1000:.0f} ms "
+          f"(最快 {min(timings) * 1000:.0f} ms, 最慢 {max(timings) * 1000:.0f} ms, 共 {args.runs} 次)")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'time_to_first_window_s': median, 'runs': args.runs, 'python': sys.version.split()[0]},
+                      f, indent=2)
+        print(f"基线已写入 {args.baseline}")
+        return 0
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)['time_to_first_window_s']
+    limit = baseline * (1 + args.threshold)
+    if median > limit:
+        print(f"启动耗时退化: {median * 1000:.0f} ms 超过基线 {baseline * 1000:.0f} ms 的 "
+              f"{1 + args.threshold:.0%} ({limit * 1000:.0f} ms)")
+        return 1
+    print(f"未退化 (基线 {baseline * 1000:.0f} ms, 上限 {limit * 1000:.0f} ms)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,125 @@
+import os
+import pickle
+import random
+import threading
+import time
+from urllib.parse import quote, unquote
+
+from http_client import FetchError
+
+
+class FixtureMissingError(FetchError):
+    """回放模式下没有录制过该请求的响应"""
+
+
+class FixtureStore:
+    """
+    录制的响应文件目录。
+    每个响应一个 pickle 文件, 路径为 <目录>/<操作>/<URL 编码的键>.pkl, 例如 history/AAPL%7C1d%7Cperiod%3D5y.pkl;
+    操作名与 YahooFinanceDataFetcher 的请求种类一致 (info / history / statement / latest_price / search)。
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def _file(self, operation, key):
+        return os.path.join(self.path, operation, quote(key, safe='') + '.pkl')
+
+    def has(self, operation, key):
+        return os.path.exists(self._file(operation, key))
+
+    def load(self, operation, key):
+        try:
+            with open(self._file(operation, key), 'rb') as f:
+                return pickle.load(f)
+        except FileNotFoundError:
+            raise FixtureMissingError(f"没有录制的响应: {operation} {key}") from None
+
+    def save(self, operation, key, value):
+        """原子地写入一个响应 (并发录制时不会留下半个文件)"""
+        path = self._file(operation, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+
+    def keys(self, operation):
+        directory = os.path.join(self.path, operation)
+        if not os.path.isdir(directory):
+            return []
+        return sorted(unquote(name[:-4]) for name in os.listdir(directory) if name.endswith('.pkl'))
+
+    def tickers(self):
+        """录制了公司信息的股票代码"""
+        return self.keys('info')
+
+
+class LiveBackend:
+    """
+    直接访问 Yahoo 的数据后端 (默认)。
+    fetch(操作, 键, func) 由 YahooFinanceDataFetcher 对每个原始请求调用, func() 执行实际的网络请求;
+    fetch_many(操作, {名称: 键}, func) 用于一次请求返回多项结果的批量接口 (如 yf.download),
+    func() 返回 ({名称: 值}, {名称: FetchError}), 每项按各自的键录制和回放。
+    """
+
+    def fetch(self, operation, key, func):
+        return func()
+
+    def fetch_many(self, operation, keys, func):
+        return func()
+
+
+class RecordingBackend(LiveBackend):
+    """访问 Yahoo 的同时把每个成功的响应录制到 FixtureStore; 失败的请求不录制"""
+
+    def __init__(self, store):
+        self.store = store if isinstance(store, FixtureStore) else FixtureStore(store)
+
+    def fetch(self, operation, key, func):
+        value = func()
+        self.store.save(operation, key, value)
+        return value
+
+    def fetch_many(self, operation, keys, func):
+        values, errors = func()
+        for name, value in values.items():
+            self.store.save(operation, keys[name], value)
+        return values, errors
+
+
+class ReplayBackend(LiveBackend):
+    """
+    离线回放录制的响应, 不产生任何网络请求。
+    每个请求 (批量请求整体算一个) 先等待 latency 秒加上 [0, jitter] 内的随机时间, 以模拟网络延迟;
+    没有录制过的请求抛出 FixtureMissingError。
+    """
+
+    def __init__(self, store, latency=0.0, jitter=0.0, seed=None):
+        self.store = store if isinstance(store, FixtureStore) else FixtureStore(store)
+        self.latency = latency
+        self.jitter = jitter
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _wait(self):
+        delay = self.latency
+        if self.jitter:
+            with self._lock:
+                delay += self._random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+    def fetch(self, operation, key, func):
+        self._wait()
+        return self.store.load(operation, key)
+
+    def fetch_many(self, operation, keys, func):
+        self._wait()
+        values, errors = {}, {}
+        for name, key in keys.items():
+            try:
+                values[name] = self.store.load(operation, key)
+            except FixtureMissingError as e:
+                errors[name] = e
+        return values, errors
@@ -0,0 +1,135 @@
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+import tracing
+
+
+class MarketDataCache:
+    """
+    基于 SQLite 的本地持久化行情数据缓存。
+    每个数据集 (行情、公司信息、财务报表) 有独立的有效期 (TTL)，
+    缓存总大小超过上限时按最近最少使用 (LRU) 的顺序淘汰。
+    """
+
+    DEFAULT_TTLS = {
+        'quotes': 15 * 60,               # 历史行情与收益率: 15分钟
+        'info': 24 * 3600,               # 公司基本信息: 1天
+        'statements': 7 * 24 * 3600,     # 财务报表: 7天 (报表最多按季度更新)
+        'bars': None,                    # 增量维护的K线序列: 不过期, 刷新间隔复用 quotes 的 TTL
+    }
+
+    def __init__(self, cache_dir=None, ttls=None, max_size_bytes=512 * 1024 * 1024):
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.expanduser('~'), '.stock_analysis_cache')
+        os.makedirs(cache_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.ttls = dict(self.DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+        self.max_size_bytes = max_size_bytes
+
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(os.path.join(cache_dir, 'market_data.sqlite3'), check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            " dataset TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL, PRIMARY KEY (dataset, key))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_accessed ON entries (accessed)")
+        self._conn.commit()
+        self._total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        self._hits = {}
+        self._misses = {}
+
+    def get(self, dataset, key, default=None):
+        """读取缓存; 条目不存在或已过期时返回 default 并记为一次未命中"""
+        ttl = self.ttls.get(dataset)
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created FROM entries WHERE dataset = ? AND key = ?", (dataset, key)
+            ).fetchone()
+            if row is None or (ttl is not None and now - row[1] > ttl):
+                self._misses[dataset] = self._misses.get(dataset, 0) + 1
+                tracing.count('cache_misses')
+                return default
+            self._conn.execute(
+                "UPDATE entries SET accessed = ? WHERE dataset = ? AND key = ?", (now, dataset, key)
+            )
+            self._conn.commit()
+            self._hits[dataset] = self._hits.get(dataset, 0) + 1
+            tracing.count('cache_hits')
+        return pickle.loads(row[0])
+
+    def set(self, dataset, key, value):
+        """写入缓存, 必要时淘汰最久未访问的条目"""
+        blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute(
+                "SELECT size FROM entries WHERE dataset = ? AND key = ?", (dataset, key)
+            ).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (dataset, key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?, ?)",
+                (dataset, key, sqlite3.Binary(blob), len(blob), now, now)
+            )
+            self._total_size += len(blob) - (old[0] if old else 0)
+            self._evict_locked()
+            self._conn.commit()
+
+    def get_or_fetch(self, dataset, key, fetch_func, is_valid=None):
+        """
+        命中缓存则直接返回，否则调用 fetch_func 获取并写入缓存。
+        is_valid 用于过滤失败的结果 (例如空的 DataFrame)，无效结果不会被缓存。
+        """
+        missing = object()
+        value = self.get(dataset, key, missing)
+        if value is not missing:
+            return value
+        value = fetch_func()
+        if is_valid is None or is_valid(value):
+            self.set(dataset, key, value)
+        return value
+
+    def invalidate(self, dataset, key=None):
+        """删除指定数据集中的一个条目, key 为 None 时清空整个数据集"""
+        with self._lock:
+            if key is None:
+                self._conn.execute("DELETE FROM entries WHERE dataset = ?", (dataset,))
+            else:
+                self._conn.execute("DELETE FROM entries WHERE dataset = ? AND key = ?", (dataset, key))
+            self._conn.commit()
+            self._total_size = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM entries")
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+            self._total_size = 0
+
+    def stats(self):
+        """返回各数据集的命中/未命中次数以及缓存占用大小"""
+        with self._lock:
+            datasets = sorted(set(self._hits) | set(self._misses))
+            return {
+                'hits': {d: self._hits.get(d, 0) for d in datasets},
+                'misses': {d: self._misses.get(d, 0) for d in datasets},
+                'total_hits': sum(self._hits.values()),
+                'total_misses': sum(self._misses.values()),
+                'size_bytes': self._total_size,
+            }
+
+    def _evict_locked(self):
+        """按访问时间从旧到新淘汰, 直到总大小低于上限 (调用方需持有锁)"""
+        if self._total_size <= self.max_size_bytes:
+            return
+        rows = self._conn.execute("SELECT dataset, key, size FROM entries ORDER BY accessed ASC").fetchall()
+        for dataset, key, size in rows:
+            if self._total_size <= self.max_size_bytes:
+                break
+            self._conn.execute("DELETE FROM entries WHERE dataset = ? AND key = ?", (dataset, key))
+            self._total_size -= size
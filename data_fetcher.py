@@ -1,49 +1,357 @@
+import sys
+import threading
+import time
+
 import yfinance as yf
 import pandas as pd
-import requests
+import numpy as np
+from yfinance.exceptions import YFTickerMissingError
+
+import tracing
+from data_backend import LiveBackend
+from http_client import EmptyResponseError, FetchError, classify_error, shared_http_client
+
+# yfinance 行情、公司信息和财务报表接口所在的主机, 供调度器按主机限速
+YAHOO_API_HOST = 'query2.finance.yahoo.com'
+YAHOO_SEARCH_URL = 'https://query1.finance.yahoo.com'
+
+# yfinance 的 period 参数与对应的时间跨度
+_PERIOD_OFFSETS = {
+    '1d': pd.DateOffset(days=1), '5d': pd.DateOffset(days=5),
+    '1mo': pd.DateOffset(months=1), '3mo': pd.DateOffset(months=3), '6mo': pd.DateOffset(months=6),
+    '1y': pd.DateOffset(years=1), '2y': pd.DateOffset(years=2), '5y': pd.DateOffset(years=5),
+    '10y': pd.DateOffset(years=10),
+}
+# 覆盖范围判断的容差: 周末和节假日会使首个K线晚于理论起始日
+_COVERAGE_TOLERANCE = pd.Timedelta(days=7)
+
+
+def _period_start(period, now):
+    """将 period 转换为起始时间 (不含时区), 'max' 或无法识别时返回 None 表示全部历史"""
+    if period == 'ytd':
+        return pd.Timestamp(year=now.year, month=1, day=1)
+    offset = _PERIOD_OFFSETS.get(period)
+    return now - offset if offset is not None else None
+
+
+def history_key(ticker, interval, period=None, start=None):
+    """历史行情请求在录制/回放中的键; 单只与批量下载的同一请求共用一个键"""
+    return f"{ticker}|{interval}|start={start}" if start is not None else f"{ticker}|{interval}|period={period}"
+
+
+def _slice_from(bars, start):
+    """截取 start 之后的K线, 兼容带时区的索引"""
+    if start is None or bars.empty:
+        return bars
+    if bars.index.tz is not None:
+        start = start.tz_localize(bars.index.tz)
+    return bars[bars.index >= start]
 
 class YahooFinanceDataFetcher:
-    def __init__(self):
+    """
+    Yahoo Finance 数据获取器。
+    所有请求 (包括 yfinance 内部的请求) 共用 HttpClient 的同一个连接池会话，并经过其超时、退避重试和熔断器;
+    重试用尽后抛出 FetchError 的子类 (RateLimitedError、NetworkError 等)，而不是返回空结果，
+    使调用方能区分"获取失败"与"确实没有数据"。
+    """
+
+    def __init__(self, cache=None, http=None, search_url=YAHOO_SEARCH_URL, backend=None):
+        """
+        :param cache: 可选的 MarketDataCache 实例。提供时，历史行情、公司信息、
+                      财务报表和收益率会优先从本地缓存读取。
+        :param http: 可选的 HttpClient, 默认使用进程内共享的客户端
+        :param search_url: 代码搜索接口的根地址, 测试时可指向本地桩服务器
+        :param backend: 数据后端 (data_backend 中的 LiveBackend / RecordingBackend / ReplayBackend),
+                        默认直接访问 Yahoo
+        """
         self.headers = {
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
         }
+        self.cache = cache
+        self.http = http or shared_http_client()
+        self.search_url = search_url.rstrip('/')
+        self.backend = backend or LiveBackend()
+        self._tickers = {}
+        self._tickers_lock = threading.Lock()
+
+    def _ticker(self, ticker):
+        """复用同一代码的 yf.Ticker 对象, 供信息、行情和报表请求共享"""
+        with self._tickers_lock:
+            stock = self._tickers.get(ticker)
+            if stock is None:
+                stock = yf.Ticker(ticker, session=self.http.session)
+                self._tickers[ticker] = stock
+            return stock
+
+    def _call(self, func, *args, **kwargs):
+        """在 Yahoo 主机的熔断器与重试策略下调用 yfinance"""
+        return self.http.call(YAHOO_API_HOST, func, *args, **kwargs)
+
+    def _history(self, ticker, **kwargs):
+        """
+        Ticker.history 的包装: 以 raise_errors=True 调用, 使网络故障以异常形式交给 HttpClient 重试和分类;
+        代码确实没有行情 (退市、代码不存在) 且期间没有网络错误时仍返回空 DataFrame
+        """
+        try:
+            return self._ticker(ticker).history(raise_errors=True, timeout=self.http.read_timeout, **kwargs)
+        except YFTickerMissingError:
+            # 时区或行情请求失败时 yfinance 同样报告"代码缺失", 这时交给 HttpClient 按网络故障重试
+            if self.http.last_transport_error() is not None:
+                raise
+            return pd.DataFrame()
+
+    def _fetch(self, operation, key, func, *args, max_retries=None, **kwargs):
+        """经由数据后端发出一个原始请求 (录制模式下保存响应, 回放模式下不访问网络)"""
+        ticker = key.split('|', 1)[0]
+
+        def attempt():
+            try:
+                return func(*args, **kwargs)
+            finally:
+                # yfinance 会在 Ticker 对象上记住失败的结果 (时区、公司信息), 出现网络错误后换用新对象重试
+                if self.http.last_transport_error() is not None:
+                    with self._tickers_lock:
+                        self._tickers.pop(ticker, None)
+
+        with tracing.span(f"network.{operation}", 'network', ticker=ticker) as span:
+            return span.measure(self.backend.fetch(operation, key,
+                                                   lambda: self._call(attempt, max_retries=max_retries)))
+
+    def _cached(self, dataset, key, fetch_func, is_valid):
+        """若启用了缓存则经由缓存获取，否则直接调用 fetch_func"""
+        if self.cache is None:
+            return fetch_func()
+        return self.cache.get_or_fetch(dataset, key, fetch_func, is_valid)
 
     def get_stock_history(self, ticker, period="1y", interval="1d"):
         """获取股票历史数据"""
+        with tracing.span('fetch.history', 'fetch', ticker=ticker) as span:
+            if self.cache is None:
+                return span.measure(self._download_history(ticker, period, interval))
+            return span.measure(self._get_history_incremental(ticker, period, interval))
+
+    def _get_history_incremental(self, ticker, period, interval):
+        """
+        按 (代码, 周期) 在本地保存K线序列，只下载上次保存之后的缺口并合并。
+        若缺口中出现分红/拆股，或重叠K线的复权价格发生变化，则重新下载全部历史。
+        """
+        key = f"bars|{ticker}|{interval}"
+        required_start = _period_start(period, pd.Timestamp.now())
+        entry = self.cache.get('bars', key)
+        if entry is None or not self._covers(entry, required_start):
+            return self._reload_history(ticker, period, interval, key, required_start)
+
+        bars = entry['bars']
+        if time.time() - entry['checked'] <= self.cache.ttls.get('quotes', 0):
+            return _slice_from(bars, required_start)
+
+        # 从倒数第二根K线开始请求: 它是已完成的K线, 可用于校验复权价格是否变化;
+        # 最后一根K线可能是盘中未完成的数据, 直接被新数据覆盖
+        overlap_start = bars.index[-2] if len(bars) > 1 else bars.index[-1]
+        gap = self._download_history_since(ticker, overlap_start, interval)
+        if gap is None:
+            print(f"警告: 无法增量更新 {ticker} 的历史数据，使用本地已保存的数据。")
+            return _slice_from(bars, required_start)
+        if self._needs_full_reload(bars, gap):
+            print(f"信息: {ticker} 出现分红/拆股或复权价格变化，重新下载全部历史数据。")
+            return self._reload_history(ticker, period, interval, key, required_start)
+
+        if not gap.empty:
+            bars = pd.concat([bars, gap])
+            bars = bars[~bars.index.duplicated(keep='last')].sort_index()
+        self.cache.set('bars', key, {'bars': bars, 'coverage_start': entry['coverage_start'],
+                                     'checked': time.time()})
+        return _slice_from(bars, required_start)
+
+    def _covers(self, entry, required_start):
+        """已保存的K线是否覆盖所请求的时间范围"""
+        coverage_start = entry['coverage_start']
+        if coverage_start is None:
+            return True
+        if required_start is None:
+            return False
+        return coverage_start <= required_start + _COVERAGE_TOLERANCE
+
+    def _reload_history(self, ticker, period, interval, key, required_start):
+        hist = self._download_history(ticker, period, interval)
+        if not hist.empty:
+            self.cache.set('bars', key, {'bars': hist, 'coverage_start': required_start, 'checked': time.time()})
+        return hist
+
+    def _needs_full_reload(self, bars, gap):
+        if gap.empty:
+            return False
+        last_stored = bars.index[-1]
+        new_rows = gap[gap.index > last_stored]
+        for col in ('Dividends', 'Stock Splits'):
+            if col in new_rows.columns and (new_rows[col].fillna(0) != 0).any():
+                return True
+        # 校验已完成的重叠K线 (不含最后一根可能未完成的K线)
+        overlap = gap.index.intersection(bars.index[:-1])
+        if len(overlap) == 0:
+            return True
+        return not np.allclose(gap.loc[overlap, 'Close'].values, bars.loc[overlap, 'Close'].values,
+                               rtol=1e-6, equal_nan=True)
+
+    def _download_history_since(self, ticker, start, interval):
+        """下载 start 之后的K线, 出错时返回 None 以便与"没有新数据"区分"""
         try:
-            stock = yf.Ticker(ticker)
-            hist = stock.history(period=period, interval=interval)
-            return hist
-        except Exception as e:
-            print(f"获取 {ticker} 历史数据时出错: {e}")
-            return pd.DataFrame()
+            start = start.strftime('%Y-%m-%d')
+            return self._fetch('history', history_key(ticker, interval, start=start), self._history, ticker,
+                               start=start, interval=interval)
+        except FetchError as e:
+            print(f"增量获取 {ticker} 历史数据时出错: {e}")
+            return None
+
+    def _download_history(self, ticker, period, interval):
+        return self._fetch('history', history_key(ticker, interval, period=period), self._history, ticker,
+                           period=period, interval=interval)
+
+    @tracing.traced('fetch.histories', 'fetch')
+    def get_stock_histories(self, tickers, period="1y", interval="1d", batch_size=100, max_retries=2):
+        """
+        批量获取多只股票的历史行情: 按 batch_size 分组, 每组调用一次 yf.download (共享同一会话),
+        再把合并的结果拆回每只股票; 失败的股票单独重试, 最终仍失败的记录在 errors 中。
+        启用缓存时, 仍在刷新间隔内的股票直接读缓存, 其余股票的缺口也按组批量下载。
+        :return: (histories, errors) — {代码: DataFrame}, {代码: 错误信息}
+        """
+        tickers = list(dict.fromkeys(tickers))
+        if self.cache is None:
+            return self._bulk_download(tickers, batch_size, max_retries, period=period, interval=interval)
+
+        histories, errors = {}, {}
+        required_start = _period_start(period, pd.Timestamp.now())
+        missing, stale = [], {}
+        for ticker in tickers:
+            entry = self.cache.get('bars', f"bars|{ticker}|{interval}")
+            if entry is None or not self._covers(entry, required_start):
+                missing.append(ticker)
+            elif time.time() - entry['checked'] <= self.cache.ttls.get('quotes', 0):
+                histories[ticker] = _slice_from(entry['bars'], required_start)
+            else:
+                stale[ticker] = entry
+
+        if stale:
+            # 所有过期股票的缺口从最早的重叠K线开始一起下载, 再按各自的重叠位置截取
+            overlap_start = {t: e['bars'].index[-2] if len(e['bars']) > 1 else e['bars'].index[-1]
+                             for t, e in stale.items()}
+            since = min(ts.tz_convert(None) if ts.tz is not None else ts for ts in overlap_start.values())
+            gaps, gap_errors = self._bulk_download(list(stale), batch_size, max_retries,
+                                                   start=since.strftime('%Y-%m-%d'), interval=interval)
+            for ticker, entry in stale.items():
+                bars = entry['bars']
+                if ticker in gap_errors:
+                    print(f"警告: 无法增量更新 {ticker} 的历史数据，使用本地已保存的数据。")
+                    histories[ticker] = _slice_from(bars, required_start)
+                    continue
+                gap = gaps[ticker][gaps[ticker].index >= overlap_start[ticker]]
+                if self._needs_full_reload(bars, gap):
+                    missing.append(ticker)
+                    continue
+                if not gap.empty:
+                    bars = pd.concat([bars, gap])
+                    bars = bars[~bars.index.duplicated(keep='last')].sort_index()
+                self.cache.set('bars', f"bars|{ticker}|{interval}",
+                               {'bars': bars, 'coverage_start': entry['coverage_start'], 'checked': time.time()})
+                histories[ticker] = _slice_from(bars, required_start)
+
+        if missing:
+            downloaded, errors = self._bulk_download(missing, batch_size, max_retries, period=period,
+                                                     interval=interval)
+            for ticker, hist in downloaded.items():
+                self.cache.set('bars', f"bars|{ticker}|{interval}",
+                               {'bars': hist, 'coverage_start': required_start, 'checked': time.time()})
+            histories.update(downloaded)
+        return histories, errors
+
+    def _bulk_download(self, tickers, batch_size, max_retries, **download_kwargs):
+        """分组批量下载; 只重试失败的股票, 每轮重试前按 HttpClient 的抖动退避等待"""
+        histories, final_errors = {}, {}
+        pending = list(tickers)
+        for attempt in range(max_retries + 1):
+            errors = {}
+            for start in range(0, len(pending), batch_size):
+                frames, batch_errors = self._download_batch(pending[start:start + batch_size], **download_kwargs)
+                histories.update(frames)
+                errors.update(batch_errors)
+            # 熔断器打开或不可重试的错误, 再试也不会成功; 先保存下来, 以免被下一轮的结果覆盖
+            final_errors.update({ticker: error for ticker, error in errors.items() if not error.retryable})
+            pending = [ticker for ticker, error in errors.items() if error.retryable]
+            if not pending or attempt == max_retries:
+                break
+            self.http.sleep(self.http.backoff(attempt, max((errors[t].retry_after or 0) for t in pending) or None))
+        final_errors.update({ticker: errors[ticker] for ticker in pending})
+        return histories, final_errors
+
+    def _download_batch(self, tickers, **download_kwargs):
+        """一次 yf.download 获取一组股票, 返回 ({代码: DataFrame}, {代码: FetchError})"""
+        keys = {ticker: history_key(ticker, download_kwargs.get('interval', '1d'), download_kwargs.get('period'),
+                                     download_kwargs.get('start')) for ticker in tickers}
+        with tracing.span('network.download', 'network', tickers=len(tickers)) as span:
+            frames, errors = self.backend.fetch_many('history', keys,
+                                                     lambda: self._download_batch_live(tickers, **download_kwargs))
+            span.measure(frames)
+            span.add('errors', len(errors))
+            return frames, errors
+
+    def _download_batch_live(self, tickers, **download_kwargs):
+        try:
+            # 整组的重试由 _bulk_download 按股票进行, 这里只经过熔断器
+            data = self._call(yf.download, tickers, group_by='ticker', actions=True, auto_adjust=True,
+                              ignore_tz=False, progress=False, threads=min(len(tickers), 8),
+                              multi_level_index=True, timeout=self.http.read_timeout, session=self.http.session,
+                              max_retries=0, **download_kwargs)
+        except FetchError as e:
+            return {}, {ticker: e for ticker in tickers}
+        # yfinance 把每只股票的失败原因记录在 shared._ERRORS 中, 据此区分限流/网络故障与无数据
+        known_errors = dict(getattr(sys.modules.get('yfinance.shared'), '_ERRORS', None) or {})
+        downloaded = set(data.columns.get_level_values(0)) if data is not None and not data.empty else set()
+        frames, errors = {}, {}
+        for ticker in tickers:
+            df = data[ticker].dropna(subset=['Close']) if ticker in downloaded else None
+            if df is None or df.empty:
+                reason = known_errors.get(ticker)
+                errors[ticker] = classify_error(RuntimeError(reason), YAHOO_API_HOST) if reason else \
+                    FetchError("未返回任何行情数据", YAHOO_API_HOST)
+                continue
+            df.columns.name = None
+            frames[ticker] = df
+        return frames, errors
 
     def get_company_info(self, ticker):
         """获取公司基本信息"""
-        try:
-            stock = yf.Ticker(ticker)
-            info = stock.info
-            return info
-        except Exception as e:
-            print(f"获取 {ticker} 公司信息时出错: {e}")
-            return {}
+        with tracing.span('fetch.info', 'fetch', ticker=ticker):
+            return self._cached('info', f"info|{ticker}", lambda: self._download_info(ticker), bool)
+
+    def _download_info(self, ticker):
+        return self._fetch('info', ticker, lambda: self._ticker(ticker).info)
 
     def get_financials(self, ticker):
         """获取公司财务报表 (年报和季报)"""
-        try:
-            stock = yf.Ticker(ticker)
-            financials = {
-                'income_stmt': stock.financials,
-                'balance_sheet': stock.balance_sheet,
-                'cash_flow': stock.cashflow,
-                'quarterly_income_stmt': stock.quarterly_financials,
-                'quarterly_balance_sheet': stock.quarterly_balance_sheet,
-                'quarterly_cash_flow': stock.quarterly_cashflow
-            }
-            return financials
-        except Exception as e:
-            print(f"获取 {ticker} 财务报表时出错: {e}")
-            return {}
+        with tracing.span('fetch.financials', 'fetch', ticker=ticker) as span:
+            return span.measure(self._cached('statements', f"financials|{ticker}",
+                                             lambda: self._download_financials(ticker), bool))
+
+    def _download_financials(self, ticker):
+        statements = {
+            'income_stmt': 'financials',
+            'balance_sheet': 'balance_sheet',
+            'cash_flow': 'cashflow',
+            'quarterly_income_stmt': 'quarterly_financials',
+            'quarterly_balance_sheet': 'quarterly_balance_sheet',
+            'quarterly_cash_flow': 'quarterly_cashflow'
+        }
+        # 每张报表单独重试, 已获取的报表不会因后一张被限流而重新请求
+        with self.http.capture_transport_errors() as transport:
+            result = {key: self._fetch('statement', f"{ticker}|{attribute}",
+                                       lambda: getattr(self._ticker(ticker), attribute))
+                      for key, attribute in statements.items()}
+        # yfinance 获取报表失败时不报错而是返回空表; 全部为空时按暂时性故障抛出, 不写入缓存
+        if all(df is None or df.empty for df in result.values()):
+            error = transport[-1] if transport else EmptyResponseError(f"{ticker} 的财务报表全部为空", YAHOO_API_HOST)
+            self.http.breaker(YAHOO_API_HOST).record_failure(error.retry_after)
+            raise error
+        return result
 
     def get_key_stats(self, ticker):
         """
@@ -51,8 +359,7 @@ class YahooFinanceDataFetcher:
         `yfinance`的`info`对象已经包含了大部分关键统计数据。
         """
         try:
-            stock = yf.Ticker(ticker)
-            info = stock.info
+            info = self.get_company_info(ticker)
             # 从info字典中提取我们关心的关键统计数据
             key_stats = {
                 'Market Cap': info.get('marketCap'),
@@ -72,30 +379,30 @@ class YahooFinanceDataFetcher:
             print(f"获取 {ticker} 关键统计数据时出错: {e}")
             return {}
 
-    def search_ticker(self, company_name):
-        """根据公司名称搜索股票代码"""
-        search_url = f"https://query1.finance.yahoo.com/v1/finance/search?q={company_name}&quotesCount=1&newsCount=0"
-        try:
-            response = requests.get(search_url, headers=self.headers)
-            response.raise_for_status()
-            data = response.json()
-            if data and 'quotes' in data and len(data['quotes']) > 0:
-                return data['quotes'][0]['symbol']
-            return None
-        except Exception as e:
-            print(f"为 {company_name} 搜索代码时出错: {e}")
-            return None
+    def get_latest_price(self, ticker):
+        """获取最新成交价 (实时模式使用, 不经过缓存)"""
+        # 实时轮询本身会很快再次请求, 因此不重试
+        price = self._fetch('latest_price', ticker, lambda: self._ticker(ticker).fast_info['lastPrice'], max_retries=0)
+        return float(price) if price is not None else None
 
-        # 在 data_fetcher.py 的 YahooFinanceDataFetcher 类中添加此方法
+    def search_ticker(self, company_name):
+        """根据公司名称搜索股票代码; 没有匹配时返回 None, 请求失败时抛出 FetchError"""
+        data = self.backend.fetch('search', company_name, lambda: self.http.get_json(
+            f"{self.search_url}/v1/finance/search", headers=self.headers,
+            params={'q': company_name, 'quotesCount': 1, 'newsCount': 0}))
+        if data and 'quotes' in data and len(data['quotes']) > 0:
+            return data['quotes'][0]['symbol']
+        return None
 
     def get_current_yield(self, ticker="^TNX"):
         """获取指定代码的当前收益率/价格，默认为美国10年期国债收益率"""
-        try:
-            # 获取最近5天的数据足以找到最新收盘价
-            data = yf.Ticker(ticker).history(period="5d")
-            if not data.empty:
-                return data['Close'].iloc[-1]
-            return None
-        except Exception as e:
-            print(f"获取 {ticker} 的当前收益率时出错: {e}")
-            return None
\ No newline at end of file
+        with tracing.span('fetch.yield', 'fetch', ticker=ticker):
+            return self._cached('quotes', f"yield|{ticker}", lambda: self._download_current_yield(ticker),
+                                lambda value: value is not None)
+
+    def _download_current_yield(self, ticker):
+        # 获取最近5天的数据足以找到最新收盘价
+        data = self._fetch('history', history_key(ticker, '1d', period='5d'), self._history, ticker, period="5d")
+        if not data.empty:
+            return data['Close'].iloc[-1]
+        return None
\ No newline at end of file
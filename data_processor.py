@@ -1,8 +1,39 @@
+import json
+import math
+from collections import deque
+
+import numpy as np
 import pandas as pd
 
+import tracing
+from statement_normalizer import default_normalizer
+
+# 面板指标引擎输出的指标 (BB_Mid 与 SMA_20 相同, 不重复存储)
+PANEL_INDICATORS = ['SMA_20', 'SMA_50', 'RSI_14', 'BB_Upper', 'BB_Lower']
+
+
+def _prefix_sums(values):
+    """沿时间轴 (第0维) 的前缀和, 首行补0, 使任意窗口和都可以用两行相减得到"""
+    prefix = np.empty((values.shape[0] + 1,) + values.shape[1:])
+    prefix[0] = 0.0
+    np.cumsum(values, axis=0, out=prefix[1:])
+    return prefix
+
+
+def _trailing_sums(values, window):
+    """沿时间轴计算最近 window 行的和 (不足 window 行时为已有行之和), values 不含 NaN"""
+    prefix = np.cumsum(values, axis=0)
+    sums = prefix.copy()
+    sums[window:] -= prefix[:-window]
+    return sums
+
 
 class StockDataProcessor:
-    def calculate_technical_indicators(self, hist_df):
+    # 报表项目解析器; 别名索引在模块导入时编译一次, 所有实例共用
+    normalizer = default_normalizer
+
+    @tracing.traced('indicators', 'process', ticker='ticker', measure=True)
+    def calculate_technical_indicators(self, hist_df, ticker=None):
         df = hist_df.copy()
         df['SMA_20'] = df['Close'].rolling(window=20).mean()
         df['SMA_50'] = df['Close'].rolling(window=50).mean()
@@ -14,39 +45,87 @@ class StockDataProcessor:
         rs = avg_gain / avg_loss
         df['RSI_14'] = 100 - (100 / (1 + rs))
         df['BB_Mid'] = df['SMA_20']
-        df['BB_Upper'] = df['BB_Mid'] + 2 * df['Close'].rolling(window=20).std()
-        df['BB_Lower'] = df['BB_Mid'] - 2 * df['Close'].rolling(window=20).std()
+        std_20 = df['Close'].rolling(window=20).std()
+        df['BB_Upper'] = df['BB_Mid'] + 2 * std_20
+        df['BB_Lower'] = df['BB_Mid'] - 2 * std_20
         return df
 
+    def build_close_panel(self, history_by_ticker):
+        """将 {代码: 历史数据} 合并为 日期 × 代码 的收盘价宽表"""
+        return pd.DataFrame({ticker: df['Close'] for ticker, df in history_by_ticker.items() if not df.empty})
+
+    def calculate_panel_indicators(self, close_prices):
+        """
+        面板版本的 calculate_technical_indicators: 对 日期 × 代码 的收盘价宽表一次性计算所有股票的
+        SMA_20/50、RSI_14 和布林带, 全程在 NumPy 数组上完成, 不逐只复制 DataFrame。
+        上市较晚的股票 (前段为 NaN) 的结果与单只计算一致。
+        :return: 以 (指标, 代码) 为多级列索引的 DataFrame
+        """
+        closes = close_prices.to_numpy(dtype=float)
+        n_dates, n_tickers = closes.shape
+        out = np.full((n_dates, len(PANEL_INDICATORS), n_tickers), np.nan)
+
+        # 按每只股票的首个有效价格平移后再求和, 避免平方和相减时的精度损失 (方差与平移无关)
+        valid = ~np.isnan(closes)
+        first_valid = np.where(valid.any(axis=0), valid.argmax(axis=0), n_dates)
+        offset = np.nan_to_num(closes[np.minimum(first_valid, n_dates - 1), np.arange(n_tickers)])
+        centered = closes - offset
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            # 所有滚动窗口共用同一组前缀和: 窗口和 = prefix[t+1] - prefix[t+1-window]
+            filled = np.where(valid, centered, 0.0)
+            count_prefix = _prefix_sums(valid)
+            sum_prefix = _prefix_sums(filled)
+            for name, window in (('SMA_20', 20), ('SMA_50', 50)):
+                if n_dates < window:
+                    continue
+                full = (count_prefix[window:] - count_prefix[:-window]) == window
+                sums = sum_prefix[window:] - sum_prefix[:-window]
+                sma = np.where(full, sums / window + offset, np.nan)
+                out[window - 1:, PANEL_INDICATORS.index(name), :] = sma
+                if window == 20:
+                    sq_prefix = _prefix_sums(filled * filled)
+                    sq_sums = sq_prefix[window:] - sq_prefix[:-window]
+                    variance = (sq_sums - sums * sums / window) / (window - 1)
+                    two_std = 2 * np.sqrt(np.maximum(variance, 0.0))
+                    out[window - 1:, PANEL_INDICATORS.index('BB_Upper'), :] = sma + two_std
+                    out[window - 1:, PANEL_INDICATORS.index('BB_Lower'), :] = sma - two_std
+
+            # RSI: 与单只版本相同, 使用 min_periods=1 的14日简单平均, 窗口从该股票首个有效日起算
+            delta = np.full(closes.shape, np.nan)
+            delta[1:] = closes[1:] - closes[:-1]
+            gain = np.where(delta > 0, delta, 0.0)
+            loss = np.where(delta < 0, -delta, 0.0)
+            # 首个有效日之前的涨跌幅均为0, 因此窗口和可直接用前缀和相减, 只需按实际天数求平均
+            counts = np.clip(np.arange(n_dates)[:, None] - first_valid + 1, 0, 14)
+            avg_gain = _trailing_sums(gain, 14) / counts
+            avg_loss = _trailing_sums(loss, 14) / counts
+            out[:, PANEL_INDICATORS.index('RSI_14'), :] = 100 - (100 / (1 + avg_gain / avg_loss))
+
+        columns = pd.MultiIndex.from_product([PANEL_INDICATORS, close_prices.columns], names=['indicator', 'ticker'])
+        return pd.DataFrame(out.reshape(n_dates, -1), index=close_prices.index, columns=columns)
+
+    def create_indicator_engine(self, history_by_ticker=None):
+        """创建增量指标引擎, 可选地用已有的历史收盘价初始化各股票的状态"""
+        engine = IncrementalIndicatorEngine()
+        for ticker, df in (history_by_ticker or {}).items():
+            engine.seed(ticker, df['Close'])
+        return engine
+
     def get_yearly_financial_data(self, financial_data_dict, statement_type='income_stmt'):
         if statement_type in financial_data_dict:
             return financial_data_dict[statement_type]
         return pd.DataFrame()
 
+    def normalize_statements(self, financials, ticker=None, quarterly=False):
+        """一次解析全部标准报表项目, 返回按日期升序排列的 NormalizedStatements"""
+        return self.normalizer.normalize(financials, ticker=ticker, quarterly=quarterly)
+
     def calculate_free_cash_flow(self, cash_flow_df):
-        if cash_flow_df.empty: return pd.Series(dtype=float)
-        op_cash_flow_keys = ['Total Cash From Operating Activities', 'Operating Cash Flow']
-        capex_keys = ['Capital Expenditures', 'Capital Expenditure']
-        op_cash_flow = pd.Series(dtype=float)
-        for key in op_cash_flow_keys:
-            if key in cash_flow_df.index:
-                op_cash_flow = cash_flow_df.loc[key]
-                break
-        capex = pd.Series(dtype=float)
-        for key in capex_keys:
-            if key in cash_flow_df.index:
-                capex = cash_flow_df.loc[key]
-                break
-        if not op_cash_flow.empty and not capex.empty:
-            common_index = op_cash_flow.index.intersection(capex.index)
-            fcf = op_cash_flow.loc[common_index] + capex.loc[common_index]
-            return fcf.sort_index(ascending=True)
-        return pd.Series(dtype=float)
+        return self.normalizer.normalize({'cash_flow': cash_flow_df}).series('free_cash_flow')
 
     def get_eps_from_financials(self, income_stmt_df):
-        if not income_stmt_df.empty and 'Diluted EPS' in income_stmt_df.index:
-            return income_stmt_df.loc['Diluted EPS'].sort_index(ascending=True)
-        return pd.Series(dtype=float)
+        return self.normalizer.normalize({'income_stmt': income_stmt_df}).series('diluted_eps')
 
     def get_shares_outstanding(self, info_dict):
         return info_dict.get('sharesOutstanding')
@@ -55,62 +134,159 @@ class StockDataProcessor:
         return info_dict.get('marketCap')
 
     def get_total_debt(self, balance_sheet_df):
-        """(最终修复版) 获取总负债 - 已修复Bug并使用从调试信息中找到的精确名称"""
-        if balance_sheet_df.empty: return pd.Series(dtype=float)
-
-        # 方法1: 优先直接查找总负债项目
-        # 根据您提供的调试列表，我们添加了精确的名称
-        possible_keys = ['Total Liab', 'Total Liabilities', 'Total Liabilities Net Minority Interest', 'Total Debt']
-        for key in possible_keys:
-            if key in balance_sheet_df.index:
-                print(f"信息: 已直接找到 '{key}' 项目。")
-                return balance_sheet_df.loc[key].sort_index(ascending=True)
-
-        # 方法2: 如果直接项目不存在，则通过组件相加计算
-        # 根据您的调试列表，我们使用精确的组件名称
-        current_liab_keys = ['Total Current Liabilities', 'Current Liabilities']
-        non_current_liab_keys = ['Total Non Current Liabilities', 'Total Non Current Liabilities Net Minority Interest']
-
-        current_liab_key_found = None
-        for key in current_liab_keys:
-            if key in balance_sheet_df.index:
-                current_liab_key_found = key
-                break
-
-        non_current_liab_key_found = None
-        # --- Bug修复处 ---
-        for key in non_current_liab_keys:
-            # 修正了这里的逻辑错误，之前是检查 key in non_current_liab_keys
-            if key in balance_sheet_df.index:
-                non_current_liab_key_found = key
-                break
-        # --- Bug修复结束 ---
-
-        if current_liab_key_found and non_current_liab_key_found:
-            print(
-                f"信息: 未找到总负债项目，正在通过 '{current_liab_key_found}' + '{non_current_liab_key_found}' 来计算...")
-            current_liabilities = balance_sheet_df.loc[current_liab_key_found]
-            non_current_liabilities = balance_sheet_df.loc[non_current_liab_key_found]
-            total_liabilities = current_liabilities + non_current_liabilities
-            return total_liabilities.sort_index(ascending=True)
-
-        print("警告: 最终尝试后，仍无法在资产负债表中找到或计算出'总负债'。")
-        return pd.Series(dtype=float)
+        """获取总负债; 找不到直接项目时用流动负债 + 非流动负债计算"""
+        return self.normalizer.normalize({'balance_sheet': balance_sheet_df}).series('total_liabilities')
 
     def get_cash_and_equivalents(self, balance_sheet_df):
-        if balance_sheet_df.empty: return pd.Series(dtype=float)
-        possible_keys = ['Total Cash', 'Cash And Cash Equivalents', 'Cash Cash Equivalents And Short Term Investments']
-        for key in possible_keys:
-            if key in balance_sheet_df.index:
-                return balance_sheet_df.loc[key].sort_index(ascending=True)
-        print(f"警告: 未在资产负债表中找到现金项目。")
-        return pd.Series(dtype=float)
+        return self.normalizer.normalize({'balance_sheet': balance_sheet_df}).series('cash_and_equivalents')
 
     def get_total_stockholder_equity(self, balance_sheet_df):
-        if balance_sheet_df.empty: return pd.Series(dtype=float)
-        possible_keys = ['Total Stockholder Equity', 'Stockholders Equity', 'Total Equity', 'Common Stock Equity']
-        for key in possible_keys:
-            if key in balance_sheet_df.index:
-                return balance_sheet_df.loc[key].sort_index(ascending=True)
-        print(f"警告: 未在资产负债表中找到股东权益项目。")
-        return pd.Series(dtype=float)
\ No newline at end of file
+        return self.normalizer.normalize({'balance_sheet': balance_sheet_df}).series('stockholder_equity')
+
+
+class IncrementalIndicatorState:
+    """
+    单只股票的增量指标状态, 每追加一根K线只需 O(1) 计算。
+    保存 SMA/布林带所需的滚动和与平方和, 以及 RSI 所需的涨跌幅滚动和;
+    定义与 calculate_technical_indicators 完全一致, 结果在浮点误差范围内相同。
+    """
+
+    # 每隔若干次更新从窗口内的原始数据重新求和, 防止长时间运行时浮点误差累积
+    RESYNC_INTERVAL = 1000
+
+    def __init__(self):
+        self.closes = deque(maxlen=50)
+        self.gains = deque(maxlen=14)
+        self.losses = deque(maxlen=14)
+        self.anchor = None          # 平移基准 (首个收盘价), 提高平方和的数值精度
+        self.prev_close = None
+        self.sum_20 = 0.0
+        self.sum_sq_20 = 0.0
+        self.sum_50 = 0.0
+        self.gain_sum = 0.0
+        self.loss_sum = 0.0
+        self.updates = 0
+
+    def update(self, close):
+        """追加一根K线的收盘价, 返回最新的指标值 (数据不足的指标为 NaN)"""
+        close = float(close)
+        if math.isnan(close):
+            return self.values()
+        if self.anchor is None:
+            self.anchor = close
+        x = close - self.anchor
+
+        if len(self.closes) >= 20:
+            old_20 = self.closes[-20]
+            self.sum_20 -= old_20
+            self.sum_sq_20 -= old_20 * old_20
+        if len(self.closes) == self.closes.maxlen:
+            self.sum_50 -= self.closes[0]
+        self.closes.append(x)
+        self.sum_20 += x
+        self.sum_sq_20 += x * x
+        self.sum_50 += x
+
+        # 与批量版本一致: 第一根K线的涨跌幅视为0, 并计入RSI窗口
+        delta = close - self.prev_close if self.prev_close is not None else 0.0
+        gain, loss = max(delta, 0.0), max(-delta, 0.0)
+        if len(self.gains) == self.gains.maxlen:
+            self.gain_sum -= self.gains[0]
+            self.loss_sum -= self.losses[0]
+        self.gains.append(gain)
+        self.losses.append(loss)
+        self.gain_sum += gain
+        self.loss_sum += loss
+        self.prev_close = close
+
+        self.updates += 1
+        if self.updates % self.RESYNC_INTERVAL == 0:
+            self._resync()
+        return self.values()
+
+    def values(self):
+        result = dict.fromkeys(['SMA_20', 'SMA_50', 'RSI_14', 'BB_Mid', 'BB_Upper', 'BB_Lower'], np.nan)
+        n = len(self.closes)
+        if n >= 20:
+            sma_20 = self.sum_20 / 20
+            variance = (self.sum_sq_20 - self.sum_20 * self.sum_20 / 20) / 19
+            std_20 = math.sqrt(max(variance, 0.0))
+            result['SMA_20'] = result['BB_Mid'] = sma_20 + self.anchor
+            result['BB_Upper'] = result['SMA_20'] + 2 * std_20
+            result['BB_Lower'] = result['SMA_20'] - 2 * std_20
+        if n >= 50:
+            result['SMA_50'] = self.sum_50 / 50 + self.anchor
+        if self.gains:
+            count = len(self.gains)
+            avg_gain, avg_loss = self.gain_sum / count, self.loss_sum / count
+            if avg_loss > 0:
+                result['RSI_14'] = 100 - (100 / (1 + avg_gain / avg_loss))
+            elif avg_gain > 0:
+                result['RSI_14'] = 100.0
+        return result
+
+    def _resync(self):
+        last_20 = list(self.closes)[-20:]
+        self.sum_20 = math.fsum(last_20)
+        self.sum_sq_20 = math.fsum(x * x for x in last_20)
+        self.sum_50 = math.fsum(self.closes)
+        self.gain_sum = math.fsum(self.gains)
+        self.loss_sum = math.fsum(self.losses)
+
+    def to_dict(self):
+        """可 JSON 序列化的状态, 用于重启后恢复"""
+        return {'closes': list(self.closes), 'gains': list(self.gains), 'losses': list(self.losses),
+                'anchor': self.anchor, 'prev_close': self.prev_close, 'updates': self.updates}
+
+    @classmethod
+    def from_dict(cls, data):
+        state = cls()
+        state.closes.extend(data['closes'])
+        state.gains.extend(data['gains'])
+        state.losses.extend(data['losses'])
+        state.anchor = data['anchor']
+        state.prev_close = data['prev_close']
+        state.updates = data['updates']
+        state._resync()
+        return state
+
+
+class IncrementalIndicatorEngine:
+    """按股票代码管理增量指标状态, 支持整体保存与恢复"""
+
+    def __init__(self):
+        self.states = {}
+
+    def update(self, ticker, close):
+        state = self.states.get(ticker)
+        if state is None:
+            state = self.states[ticker] = IncrementalIndicatorState()
+        return state.update(close)
+
+    def seed(self, ticker, closes):
+        """用历史收盘价初始化 (或继续推进) 某只股票的状态, 返回最后一根K线的指标值"""
+        values = None
+        for close in closes:
+            values = self.update(ticker, close)
+        return values
+
+    def values(self, ticker):
+        return self.states[ticker].values()
+
+    def to_dict(self):
+        return {ticker: state.to_dict() for ticker, state in self.states.items()}
+
+    @classmethod
+    def from_dict(cls, data):
+        engine = cls()
+        engine.states = {ticker: IncrementalIndicatorState.from_dict(state) for ticker, state in data.items()}
+        return engine
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
@@ -0,0 +1,125 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+class RateLimiter:
+    """令牌桶限速器: 平均每秒最多 rate 个请求, 允许 burst 个请求的突发"""
+
+    def __init__(self, rate=5.0, burst=5):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self._tokens = float(burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """阻塞直到获得一个令牌"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class FetchScheduler:
+    """
+    并发抓取调度器。
+    使用线程池并发执行网络请求，线程池大小即并发上限；
+    每个目标主机有独立的限速器，避免因请求过快被 Yahoo 限流。
+    """
+
+    def __init__(self, max_workers=8, requests_per_second=5.0, burst=5):
+        self.max_workers = max_workers
+        self.requests_per_second = requests_per_second
+        self.burst = burst
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='fetch')
+        self._limiters = {}
+        self._limiters_lock = threading.Lock()
+
+    def _limiter_for(self, host):
+        with self._limiters_lock:
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                limiter = RateLimiter(self.requests_per_second, self.burst)
+                self._limiters[host] = limiter
+            return limiter
+
+    def submit(self, func, *args, host=None, **kwargs):
+        """提交一个抓取任务; 指定 host 时先经过该主机的限速器"""
+        limiter = self._limiter_for(host) if host else None
+
+        def task():
+            if limiter is not None:
+                limiter.acquire()
+            return func(*args, **kwargs)
+
+        return self._executor.submit(task)
+
+    def fetch_stocks(self, fetcher, tickers, period="5y", host=None, bulk_history=False):
+        """
+        并发获取多只股票的公司信息、历史行情和财务报表。
+        这是一个生成器: 每当某只股票的三项数据全部到达时，立即产出 (ticker, raw_data)，
+        因此总耗时接近最慢的单只股票，而不是所有股票耗时之和。
+        某项数据获取失败时该项为空值, 失败原因 (FetchError) 记录在 raw_data['errors'][数据项] 中。
+        :param bulk_history: 为 True 时所有股票的历史行情通过一次 get_stock_histories 批量获取
+        """
+        tickers = list(dict.fromkeys(tickers))
+        jobs = {}
+        future_to_tickers = {}
+        bulk_future = None
+        if bulk_history:
+            bulk_future = self.submit(fetcher.get_stock_histories, tickers, period=period, host=host)
+            future_to_tickers[bulk_future] = list(tickers)
+        for ticker in tickers:
+            jobs[ticker] = {
+                'info': self.submit(fetcher.get_company_info, ticker, host=host),
+                'history': bulk_future or self.submit(fetcher.get_stock_history, ticker, period=period, host=host),
+                'financials': self.submit(fetcher.get_financials, ticker, host=host),
+            }
+            for name, future in jobs[ticker].items():
+                if future is not bulk_future:
+                    future_to_tickers[future] = [ticker]
+
+        remaining = {ticker: len(futures) for ticker, futures in jobs.items()}
+        try:
+            for future in as_completed(future_to_tickers):
+                for ticker in future_to_tickers[future]:
+                    remaining[ticker] -= 1
+                    if remaining[ticker] == 0:
+                        yield ticker, self._collect(jobs[ticker], ticker, bulk_future)
+        finally:
+            # 调用方提前关闭生成器 (例如任务被取消) 时, 撤销尚未开始的请求
+            for future in future_to_tickers:
+                future.cancel()
+
+    @staticmethod
+    def _collect(futures, ticker, bulk_future):
+        import pandas as pd
+        from http_client import FetchError
+
+        empty = {'info': {}, 'history': pd.DataFrame(), 'financials': {}}
+        raw_data, errors = {}, {}
+        for name, future in futures.items():
+            try:
+                if future is bulk_future:
+                    histories, bulk_errors = future.result()
+                    if ticker in bulk_errors:
+                        raise bulk_errors[ticker]
+                    raw_data[name] = histories.get(ticker, empty[name])
+                else:
+                    raw_data[name] = future.result()
+            except FetchError as e:
+                print(f"获取 {ticker} 的 {name} 时出错: {e}")
+                raw_data[name] = empty[name]
+                errors[name] = e
+        raw_data['errors'] = errors
+        return raw_data
+
+    def shutdown(self, wait=False):
+        self._executor.shutdown(wait=wait)
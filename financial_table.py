@@ -0,0 +1,273 @@
+import math
+import tkinter as tk
+from tkinter import ttk
+
+# 可选的报表: (显示名称, 年度报表键, 季度报表键), 键与 YahooFinanceDataFetcher.get_financials 的返回值一致
+STATEMENTS = [
+    ("利润表", 'income_stmt', 'quarterly_income_stmt'),
+    ("资产负债表", 'balance_sheet', 'quarterly_balance_sheet'),
+    ("现金流量表", 'cash_flow', 'quarterly_cash_flow'),
+]
+PERIODS = ["年度", "季度"]
+
+
+def _format_number(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    if abs(value) >= 1e4:
+        return f"{value:,.0f}"
+    return f"{value:,.4g}"
+
+
+class _StatementTable:
+    """
+    一张报表的只读表格模型: 行为会计科目，列为报告期。
+    数值在构建时转换为 Python 浮点数，格式化后的文本在首次显示时才生成并缓存。
+    """
+
+    def __init__(self, df):
+        self.labels = [str(label) for label in df.index]
+        self.lower_labels = [label.lower() for label in self.labels]
+        self.columns = [column.strftime('%Y-%m-%d') if hasattr(column, 'strftime') else str(column)
+                        for column in df.columns]
+        self.values = [[self._to_float(v) for v in row] for row in df.to_numpy().tolist()]
+        self._text = [None] * len(self.labels)
+
+    @staticmethod
+    def _to_float(value):
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return math.nan
+
+    def row_text(self, row):
+        if self._text[row] is None:
+            self._text[row] = [_format_number(v) for v in self.values[row]]
+        return self._text[row]
+
+    def order(self, filter_text="", sort_column=None, descending=False):
+        """返回过滤、排序后的行号列表; sort_column 为 None 时按科目名称排序 (-1) 或保持原顺序"""
+        needle = filter_text.strip().lower()
+        rows = [i for i, label in enumerate(self.lower_labels) if needle in label] if needle else \
+            list(range(len(self.labels)))
+        if sort_column == -1:
+            rows.sort(key=lambda i: self.lower_labels[i], reverse=descending)
+        elif sort_column is not None:
+            # 空值无论升序降序都排在最后
+            present = [i for i in rows if not math.isnan(self.values[i][sort_column])]
+            missing = [i for i in rows if math.isnan(self.values[i][sort_column])]
+            present.sort(key=lambda i: self.values[i][sort_column], reverse=descending)
+            rows = present + missing
+        return rows
+
+
+class FinancialStatementGrid:
+    """
+    虚拟化的财务报表表格。
+    Treeview 中只保留一屏可见的行 (以及可见的列)，滚动时复用这些行并改写其内容，
+    因此无论报表多宽、多长，切换股票/报表/年度季度时的开销都只与可见单元格数量有关。
+    已下载的报表按 (代码, 报表键) 缓存为表格模型，切换时不会重新获取数据。
+    """
+
+    ROW_HEIGHT = 22
+    LABEL_WIDTH = 280
+    COLUMN_WIDTH = 120
+
+    def __init__(self, master):
+        self.frame = ttk.Frame(master)
+        self._financials = {}
+        self._tables = {}
+        self._order = []
+        self._first_row = 0
+        self._first_column = 0
+        self._visible_rows = 0
+        self._visible_columns = 0
+        self._sort_column = None
+        self._descending = False
+
+        controls = ttk.Frame(self.frame)
+        controls.pack(side=tk.TOP, fill=tk.X, pady=(0, 5))
+        ttk.Label(controls, text="股票:").pack(side=tk.LEFT)
+        self.ticker_var = tk.StringVar()
+        self.ticker_combo = ttk.Combobox(controls, textvariable=self.ticker_var, state="readonly", width=10)
+        self.ticker_combo.pack(side=tk.LEFT, padx=(2, 10))
+        ttk.Label(controls, text="报表:").pack(side=tk.LEFT)
+        self.statement_var = tk.StringVar(value=STATEMENTS[0][0])
+        ttk.Combobox(controls, textvariable=self.statement_var, state="readonly", width=10,
+                     values=[s[0] for s in STATEMENTS]).pack(side=tk.LEFT, padx=(2, 10))
+        self.period_var = tk.StringVar(value=PERIODS[0])
+        ttk.Combobox(controls, textvariable=self.period_var, state="readonly", width=6,
+                     values=PERIODS).pack(side=tk.LEFT, padx=(0, 10))
+        ttk.Label(controls, text="筛选科目:").pack(side=tk.LEFT)
+        self.filter_var = tk.StringVar()
+        ttk.Entry(controls, textvariable=self.filter_var, width=24).pack(side=tk.LEFT, padx=2)
+        self.summary_var = tk.StringVar()
+        ttk.Label(controls, textvariable=self.summary_var).pack(side=tk.RIGHT)
+        for var in (self.ticker_var, self.statement_var, self.period_var):
+            var.trace_add('write', lambda *_: self._on_selection_changed())
+        self.filter_var.trace_add('write', lambda *_: self._refresh_order())
+
+        body = ttk.Frame(self.frame)
+        body.pack(side=tk.TOP, fill=tk.BOTH, expand=True)
+        self.tree = ttk.Treeview(body, show='tree headings', selectmode='browse')
+        self.tree.column('#0', width=self.LABEL_WIDTH, minwidth=120, stretch=False)
+        self.tree.heading('#0', text="科目", command=lambda: self._sort_by(-1))
+        self.vscroll = ttk.Scrollbar(body, orient=tk.VERTICAL, command=self._on_vscroll)
+        self.hscroll = ttk.Scrollbar(body, orient=tk.HORIZONTAL, command=self._on_hscroll)
+        self.tree.grid(row=0, column=0, sticky='nsew')
+        self.vscroll.grid(row=0, column=1, sticky='ns')
+        self.hscroll.grid(row=1, column=0, sticky='ew')
+        body.rowconfigure(0, weight=1)
+        body.columnconfigure(0, weight=1)
+
+        self.tree.bind('<Configure>', self._on_resize)
+        self.tree.bind('<MouseWheel>', lambda e: self._scroll_rows(-1 if e.delta > 0 else 1, 'units'))
+        self.tree.bind('<Button-4>', lambda e: self._scroll_rows(-1, 'units'))
+        self.tree.bind('<Button-5>', lambda e: self._scroll_rows(1, 'units'))
+
+    def pack(self, **kwargs):
+        self.frame.pack(**kwargs)
+
+    def clear(self):
+        self._financials = {}
+        self._tables = {}
+        self.ticker_combo.config(values=[])
+        self.ticker_var.set("")
+
+    def set_financials(self, ticker, financials):
+        """添加或替换一只股票的报表 (get_financials 返回的字典)"""
+        self._financials[ticker] = financials or {}
+        for key in [k for k in self._tables if k[0] == ticker]:
+            del self._tables[key]
+        self.ticker_combo.config(values=list(self._financials))
+        if not self.ticker_var.get():
+            self.ticker_var.set(ticker)
+        elif self.ticker_var.get() == ticker:
+            self._on_selection_changed()
+
+    def show_ticker(self, ticker):
+        if ticker in self._financials:
+            self.ticker_var.set(ticker)
+
+    def _current_key(self):
+        periods = PERIODS.index(self.period_var.get())
+        for name, annual_key, quarterly_key in STATEMENTS:
+            if name == self.statement_var.get():
+                return quarterly_key if periods else annual_key
+
+    def _current_table(self):
+        ticker = self.ticker_var.get()
+        if ticker not in self._financials:
+            return None
+        key = (ticker, self._current_key())
+        if key not in self._tables:
+            df = self._financials[ticker].get(key[1])
+            self._tables[key] = _StatementTable(df) if df is not None and not df.empty else None
+        return self._tables[key]
+
+    def _on_selection_changed(self):
+        self._first_column = 0
+        self._rebuild_columns()
+        self._refresh_order()
+
+    def _sort_by(self, column):
+        if self._sort_column == column:
+            self._descending = not self._descending
+        else:
+            self._sort_column, self._descending = column, column != -1
+        # 先更新列标题上的 ▲/▼ 标记, 再按新的排序刷新行
+        self._rebuild_columns()
+        self._refresh_order()
+
+    def _refresh_order(self):
+        table = self._current_table()
+        if table is None:
+            self._order = []
+        else:
+            sort_column = self._sort_column
+            if sort_column is not None and sort_column >= len(table.columns):
+                sort_column = None
+            self._order = table.order(self.filter_var.get(), sort_column, self._descending)
+        self._first_row = 0
+        self._render()
+
+    def _on_resize(self, event):
+        # 表头大约占一行的高度
+        visible_rows = max(1, event.height // self.ROW_HEIGHT - 1)
+        visible_columns = max(1, (event.width - self.LABEL_WIDTH) // self.COLUMN_WIDTH)
+        if (visible_rows, visible_columns) != (self._visible_rows, self._visible_columns):
+            self._visible_rows, self._visible_columns = visible_rows, visible_columns
+            self._rebuild_columns()
+            self._render()
+
+    def _rebuild_columns(self):
+        """Treeview 的列只对应当前可见的报告期，水平滚动时改写列标题而不是增加列"""
+        table = self._current_table()
+        n_columns = len(table.columns) if table is not None else 0
+        count = min(self._visible_columns, n_columns)
+        self._first_column = max(0, min(self._first_column, n_columns - count))
+        slots = [f"c{i}" for i in range(count)]
+        if tuple(slots) != tuple(self.tree['columns']):
+            self.tree.config(columns=slots)
+            for slot in slots:
+                self.tree.column(slot, width=self.COLUMN_WIDTH, anchor=tk.E, stretch=True)
+        for i, slot in enumerate(slots):
+            column = self._first_column + i
+            arrow = (" ▼" if self._descending else " ▲") if column == self._sort_column else ""
+            self.tree.heading(slot, text=table.columns[column] + arrow,
+                              command=lambda c=column: self._sort_by(c))
+        self.tree.heading('#0', text="科目" + ((" ▼" if self._descending else " ▲") if self._sort_column == -1 else ""))
+        if n_columns:
+            self.hscroll.set(self._first_column / n_columns, (self._first_column + count) / n_columns)
+        else:
+            self.hscroll.set(0, 1)
+
+    def _render(self):
+        """只改写可见行对应的 Treeview 条目; 条目数量保持为一屏的行数"""
+        table = self._current_table()
+        self._first_row = max(0, min(self._first_row, len(self._order) - self._visible_rows))
+        visible = self._order[self._first_row:self._first_row + self._visible_rows]
+        items = self.tree.get_children()
+        if len(items) > len(visible):
+            self.tree.delete(*items[len(visible):])
+            items = items[:len(visible)]
+        for _ in range(len(visible) - len(items)):
+            self.tree.insert('', tk.END)
+        items = self.tree.get_children()
+        column_slice = slice(self._first_column, self._first_column + len(self.tree['columns']))
+        for item, row in zip(items, visible):
+            self.tree.item(item, text=table.labels[row], values=table.row_text(row)[column_slice])
+
+        total = len(self._order)
+        if total:
+            self.vscroll.set(self._first_row / total, (self._first_row + len(visible)) / total)
+        else:
+            self.vscroll.set(0, 1)
+        if table is None:
+            self.summary_var.set("数据不可用" if self.ticker_var.get() else "")
+        else:
+            self.summary_var.set(f"{total}/{len(table.labels)} 个科目, {len(table.columns)} 个报告期")
+
+    def _scroll_rows(self, amount, what):
+        step = self._visible_rows if what == 'pages' else 1
+        self._first_row += int(amount) * step
+        self._render()
+
+    def _on_vscroll(self, action, *args):
+        if action == 'moveto':
+            self._first_row = int(float(args[0]) * len(self._order))
+            self._render()
+        else:
+            self._scroll_rows(args[0], args[1])
+
+    def _on_hscroll(self, action, *args):
+        table = self._current_table()
+        if table is None:
+            return
+        if action == 'moveto':
+            self._first_column = int(float(args[0]) * len(table.columns))
+        else:
+            step = self._visible_columns if args[1] == 'pages' else 1
+            self._first_column += int(args[0]) * step
+        self._rebuild_columns()
+        self._render()
@@ -0,0 +1,229 @@
+import json
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+# 存储的字段及类型; 价格用 float32 (缺失为 NaN), 成交量用 int64 (缺失为 0)
+FIELDS = {'Open': np.float32, 'High': np.float32, 'Low': np.float32, 'Close': np.float32, 'Volume': np.int64}
+
+
+def _daily_dates(index):
+    """把 yfinance 日线的 (带时区) 索引转换为不带时区的交易日, 使不同交易所的股票共用一套日期"""
+    index = pd.DatetimeIndex(index)
+    if index.tz is not None:
+        index = index.tz_localize(None)
+    return index.normalize().values.astype('datetime64[ns]')
+
+
+class HistoryStore:
+    """
+    按字段分列、内存映射的日线行情存储。
+    目录中每个字段一个文件, 形状为 (交易日数 × 股票容量), 另有共享的日期文件与 meta.json。
+    column / panel 返回的是内存映射上的零拷贝视图; 技术指标只在需要时由收盘价面板计算, 不与原始数据一起保存。
+    新交易日追加在文件末尾, 无需重写; 股票数超过容量或插入更早的日期时才整体重写一次。
+    """
+
+    META_FILE = 'meta.json'
+    DATES_FILE = 'dates.i8'
+
+    def __init__(self, path, mode='r'):
+        """打开已有的存储; mode 为 'r' (只读) 或 'r+' (可写)"""
+        self.path = path
+        self.mode = mode
+        self._lock = threading.Lock()
+        with open(os.path.join(path, self.META_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+        self.tickers = meta['tickers']
+        self.capacity = meta['capacity']
+        self._rows = {t: i for i, t in enumerate(self.tickers)}
+        self._open(meta['n_dates'])
+
+    @classmethod
+    def create(cls, path, capacity=1024):
+        """创建空的存储 (目录已存在时覆盖其中的存储文件)"""
+        os.makedirs(path, exist_ok=True)
+        cls._write_meta(path, [], capacity, 0)
+        open(os.path.join(path, cls.DATES_FILE), 'wb').close()
+        for field in FIELDS:
+            open(os.path.join(path, f'{field}.bin'), 'wb').close()
+        return cls(path, mode='r+')
+
+    @classmethod
+    def open_or_create(cls, path, capacity=1024):
+        if os.path.exists(os.path.join(path, cls.META_FILE)):
+            return cls(path, mode='r+')
+        return cls.create(path, capacity)
+
+    @staticmethod
+    def _write_meta(path, tickers, capacity, n_dates):
+        tmp_path = os.path.join(path, HistoryStore.META_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'tickers': tickers, 'capacity': capacity, 'n_dates': n_dates, 'fields': list(FIELDS)}, f)
+        os.replace(tmp_path, os.path.join(path, HistoryStore.META_FILE))
+
+    def _memmap(self, name, dtype, shape):
+        # 长度为 0 的文件无法建立内存映射, 用空数组代替
+        if shape[0] == 0:
+            return np.zeros(shape, dtype=dtype)
+        return np.memmap(os.path.join(self.path, name), dtype=dtype, mode=self.mode, shape=shape)
+
+    def _open(self, n_dates):
+        self._dates = self._memmap(self.DATES_FILE, np.int64, (n_dates,))
+        self._fields = {field: self._memmap(f'{field}.bin', dtype, (n_dates, self.capacity))
+                        for field, dtype in FIELDS.items()}
+
+    @property
+    def dates(self):
+        return self._dates.view('datetime64[ns]')
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def __contains__(self, ticker):
+        return ticker in self._rows
+
+    def nbytes(self):
+        return self._dates.nbytes + sum(array.nbytes for array in self._fields.values())
+
+    def column(self, ticker, field='Close'):
+        """单只股票某个字段的零拷贝视图, 与 dates 对齐"""
+        return self._fields[field][:, self._rows[ticker]]
+
+    def panel(self, field='Close', tickers=None):
+        """(交易日 × 股票) 面板; 不指定 tickers 时为零拷贝视图, 指定时按所给顺序取列 (会复制)"""
+        if tickers is None:
+            return self._fields[field][:, :len(self.tickers)]
+        return self._fields[field][:, [self._rows[t] for t in tickers]]
+
+    def frame(self, ticker, fields=None):
+        """
+        单只股票有收盘价的交易日组成的 DataFrame, 供指标、估值和绘图使用。
+        这些交易日连续时各列是内存映射上的零拷贝视图; 与其他交易所的股票共用日期索引而中间有空缺时才复制。
+        """
+        close = self.column(ticker, 'Close')
+        valid = np.flatnonzero(~np.isnan(close))
+        start, stop = (valid[0], valid[-1] + 1) if len(valid) else (0, 0)
+        rows = slice(start, stop) if len(valid) == stop - start else valid
+        return pd.DataFrame({field: self.column(ticker, field)[rows] for field in (fields or FIELDS)},
+                            index=pd.DatetimeIndex(self.dates[rows], name='Date'), copy=False)
+
+    def close_frame(self, tickers=None):
+        """收盘价面板的 DataFrame (float64), 可直接传给 calculate_panel_indicators"""
+        tickers = list(self.tickers) if tickers is None else list(tickers)
+        return pd.DataFrame(self.panel('Close', tickers).astype(np.float64), index=pd.DatetimeIndex(self.dates),
+                            columns=tickers)
+
+    def indicators(self, processor, tickers=None):
+        """按需计算技术指标面板 (不写入存储)"""
+        return processor.calculate_panel_indicators(self.close_frame(tickers))
+
+    def write(self, ticker, history):
+        self.write_many({ticker: history})
+
+    def write_many(self, history_by_ticker):
+        """
+        写入 (或覆盖) 多只股票的日线数据。
+        所有新交易日先合并为一次日期扩展, 再逐只写入对应的列。
+        """
+        if self.mode != 'r+':
+            raise ValueError("存储以只读方式打开, 无法写入")
+        history_by_ticker = {t: df for t, df in history_by_ticker.items() if df is not None and not df.empty}
+        if not history_by_ticker:
+            return
+        with self._lock:
+            incoming = {t: _daily_dates(df.index) for t, df in history_by_ticker.items()}
+            new_dates = np.setdiff1d(np.concatenate(list(incoming.values())), self.dates)
+            new_tickers = [t for t in history_by_ticker if t not in self._rows]
+            capacity = self.capacity
+            while len(self.tickers) + len(new_tickers) > capacity:
+                capacity *= 2
+            if capacity != self.capacity or (len(new_dates) and len(self.dates) and new_dates[0] < self.dates[-1]):
+                self._rewrite(np.union1d(self.dates, new_dates), capacity)
+            elif len(new_dates):
+                self._append_dates(new_dates)
+            for ticker in new_tickers:
+                self._rows[ticker] = len(self.tickers)
+                self.tickers.append(ticker)
+
+            # 先在内存中拼出受影响的 (日期范围 × 股票) 块, 每个字段只对内存映射做一次读和一次写
+            dates = self.dates
+            positions = {t: np.searchsorted(dates, d) for t, d in incoming.items()}
+            lo = min(int(p.min()) for p in positions.values())
+            hi = max(int(p.max()) for p in positions.values()) + 1
+            columns = np.array([self._rows[t] for t in history_by_ticker])
+            order = np.argsort(columns)
+            columns = columns[order]
+            tickers = [list(history_by_ticker)[i] for i in order]
+            contiguous = columns[-1] - columns[0] + 1 == len(columns)
+            target = slice(columns[0], columns[-1] + 1) if contiguous else columns
+            for field, dtype in FIELDS.items():
+                block = np.array(self._fields[field][lo:hi, target])
+                for j, ticker in enumerate(tickers):
+                    df = history_by_ticker[ticker]
+                    if field in df.columns:
+                        values = df[field].to_numpy()
+                        if dtype is np.int64:
+                            values = np.nan_to_num(values.astype(np.float64), nan=0.0)
+                        block[positions[ticker] - lo, j] = values
+                self._fields[field][lo:hi, target] = block
+            self.flush()
+
+    def _append_dates(self, new_dates):
+        """新交易日都晚于已有日期: 直接扩展文件末尾, 已有数据不动"""
+        old_n = len(self._dates)
+        n_dates = old_n + len(new_dates)
+        self._release()
+        self._extend_file(self.DATES_FILE, n_dates * 8)
+        for field, dtype in FIELDS.items():
+            self._extend_file(f'{field}.bin', n_dates * self.capacity * np.dtype(dtype).itemsize)
+        self._open(n_dates)
+        self._dates[old_n:] = new_dates.view(np.int64)
+        for field, dtype in FIELDS.items():
+            self._fields[field][old_n:] = np.nan if dtype is np.float32 else 0
+        self._write_meta(self.path, self.tickers, self.capacity, n_dates)
+
+    def _extend_file(self, name, size):
+        with open(os.path.join(self.path, name), 'r+b') as f:
+            f.truncate(size)
+
+    def _rewrite(self, dates, capacity):
+        """按新的日期索引和容量重写全部文件 (写入临时文件后替换)"""
+        old_dates = self.dates
+        positions = np.searchsorted(dates, old_dates)
+        n = len(self.tickers)
+        for field, dtype in FIELDS.items():
+            tmp_name = f'{field}.bin.tmp'
+            tmp_path = os.path.join(self.path, tmp_name)
+            open(tmp_path, 'wb').close()
+            with open(tmp_path, 'r+b') as f:
+                f.truncate(len(dates) * capacity * np.dtype(dtype).itemsize)
+            new = np.memmap(tmp_path, dtype=dtype, mode='r+', shape=(len(dates), capacity))
+            new[:] = np.nan if dtype is np.float32 else 0
+            if len(old_dates) and n:
+                new[positions, :n] = self._fields[field][:, :n]
+            new.flush()
+            del new
+        tmp_dates = os.path.join(self.path, self.DATES_FILE + '.tmp')
+        np.asarray(dates, dtype='datetime64[ns]').view(np.int64).tofile(tmp_dates)
+        self._release()
+        for field in FIELDS:
+            os.replace(os.path.join(self.path, f'{field}.bin.tmp'), os.path.join(self.path, f'{field}.bin'))
+        os.replace(tmp_dates, os.path.join(self.path, self.DATES_FILE))
+        self.capacity = capacity
+        self._write_meta(self.path, self.tickers, capacity, len(dates))
+        self._open(len(dates))
+
+    def _release(self):
+        for array in list(self._fields.values()) + [self._dates]:
+            if isinstance(array, np.memmap):
+                array.flush()
+        self._fields = {}
+        self._dates = np.zeros(0, dtype=np.int64)
+
+    def flush(self):
+        for array in list(self._fields.values()) + [self._dates]:
+            if isinstance(array, np.memmap):
+                array.flush()
+        self._write_meta(self.path, self.tickers, self.capacity, len(self._dates))
@@ -0,0 +1,373 @@
+import email.utils
+import random
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlparse
+
+import tracing
+
+
+class FetchError(Exception):
+    """
+    网络获取失败的基类。
+    host 为目标主机, status 为 HTTP 状态码 (没有响应时为 None);
+    retryable 表示该错误是否属于暂时性故障 (超时、连接中断、5xx、429), 只有这类错误会被重试并计入熔断器。
+    """
+
+    retryable = False
+
+    def __init__(self, message, host=None, status=None, retry_after=None):
+        super().__init__(message)
+        self.host = host
+        self.status = status
+        self.retry_after = retry_after
+
+    def __str__(self):
+        text = super().__str__()
+        return f"{type(self).__name__}: {text}" + (f" ({self.host})" if self.host else "")
+
+
+class NetworkError(FetchError):
+    """超时、连接失败或连接被重置"""
+    retryable = True
+
+
+class HTTPStatusError(FetchError):
+    """服务器返回了错误状态码; 5xx 视为暂时性故障, 4xx 不重试"""
+
+    @property
+    def retryable(self):
+        return self.status is not None and self.status >= 500
+
+
+class RateLimitedError(HTTPStatusError):
+    """被限流 (HTTP 429); retry_after 为服务器要求等待的秒数 (未提供时为 None)"""
+
+    @property
+    def retryable(self):
+        return True
+
+
+class CircuitOpenError(FetchError):
+    """目标主机的熔断器处于打开状态, 请求未发出; retry_after 为距离下次探测的秒数"""
+
+
+class ResponseError(FetchError):
+    """响应内容无法解析 (例如不是合法的 JSON)"""
+
+
+class EmptyResponseError(FetchError):
+    """本应有数据的请求全部返回空结果且没有报错; yfinance 被限流或网络故障时常表现为这样, 按暂时性故障处理"""
+    retryable = True
+
+
+def parse_retry_after(value, now=None):
+    """解析 Retry-After 响应头 (秒数或 HTTP 日期), 返回需要等待的秒数; 无法解析时返回 None"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(0.0, when.timestamp() - (time.time() if now is None else now))
+
+
+def classify_error(exc, host=None):
+    """把 requests / curl_cffi / yfinance 抛出的异常转换为对应的 FetchError 子类"""
+    if isinstance(exc, FetchError):
+        return exc
+    response = getattr(exc, 'response', None)
+    status = getattr(response, 'status_code', None)
+    name = type(exc).__name__
+    text = str(exc)
+    message = f"{name}: {text}"
+    if status == 429 or 'RateLimit' in name or 'RateLimit' in text or 'Too Many Requests' in text:
+        headers = getattr(response, 'headers', None) or {}
+        return RateLimitedError(message, host, 429, parse_retry_after(headers.get('Retry-After')))
+    if status is not None and status >= 400:
+        return HTTPStatusError(message, host, status)
+    if isinstance(exc, ValueError):
+        return ResponseError(message, host)
+    # requests 与 curl_cffi 的网络异常都继承自 OSError; yfinance 只留下错误文本时按文本判断
+    if isinstance(exc, OSError) or 'Timeout' in name or 'Connection' in name or 'timed out' in text.lower():
+        return NetworkError(message, host)
+    return FetchError(message, host)
+
+
+class CircuitBreaker:
+    """
+    单个主机的熔断器。
+    连续 failure_threshold 次暂时性故障后打开, 打开期间的请求立即以 CircuitOpenError 失败;
+    reset_timeout 秒后进入半开状态, 只放行一个探测请求: 成功则关闭, 失败则重新打开。
+    """
+
+    CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+    def __init__(self, host, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """请求发出前调用; 熔断器打开时抛出 CircuitOpenError"""
+        with self._lock:
+            if self.state == self.OPEN:
+                remaining = self._opened_at + self.reset_timeout - self.clock()
+                if remaining > 0:
+                    raise CircuitOpenError(f"熔断器已打开, {remaining:.1f} 秒后重试", self.host,
+                                           retry_after=remaining)
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN:
+                if self._probing:
+                    raise CircuitOpenError("熔断器半开, 正在等待探测请求的结果", self.host)
+                self._probing = True
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def record_failure(self, retry_after=None):
+        """记录一次暂时性故障; 服务器给出的 Retry-After 长于 reset_timeout 时按其延长打开时间"""
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self._opened_at = self.clock() + max(0.0, (retry_after or 0.0) - self.reset_timeout)
+
+
+def _is_empty(result):
+    """None、空 DataFrame 或空容器"""
+    if result is None:
+        return True
+    empty = getattr(result, 'empty', None)
+    if isinstance(empty, bool):
+        return empty
+    return isinstance(result, (dict, list, tuple)) and not result
+
+
+def _default_session(pool_size):
+    """
+    优先使用 curl_cffi 会话 (yfinance 自身所用, 可模拟浏览器指纹, 每个线程复用自己的 curl 句柄与连接),
+    不可用时退回带连接池的 requests 会话
+    """
+    try:
+        from curl_cffi import requests as curl_requests
+        return curl_requests.Session(impersonate='chrome')
+    except ImportError:
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+
+class HttpClient:
+    """
+    所有获取请求共用的 HTTP 客户端。
+    持有一个带连接池的会话 (保持连接复用), 每个请求都有超时;
+    暂时性故障按"完全抖动"的指数退避重试, 服务器给出 Retry-After 时按其等待;
+    每个主机一个熔断器, 主机持续故障时快速失败而不是让每个请求都等到超时。
+    最终失败时抛出 FetchError 的子类, 调用方据此区分"被限流/网络故障"和"确实没有数据"。
+    """
+
+    def __init__(self, session=None, timeout=(5.0, 20.0), max_retries=3, backoff_base=0.5, backoff_max=30.0,
+                 failure_threshold=5, reset_timeout=30.0, pool_size=16, headers=None, sleep=time.sleep,
+                 clock=time.monotonic):
+        """
+        :param session: 可选的会话对象 (curl_cffi 或 requests), 默认自动创建
+        :param timeout: (连接超时, 读取超时) 秒
+        :param backoff_max: 单次等待的上限; 服务器要求等待更久时不再重试, 直接抛出 RateLimitedError
+        """
+        self.session = session if session is not None else _default_session(pool_size)
+        if headers:
+            self.session.headers.update(headers)
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.sleep = sleep
+        self.clock = clock
+        self._breakers = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._track_session(self.session)
+        self.request_count = 0
+        self.retry_count = 0
+        self.failure_count = 0
+
+    @property
+    def read_timeout(self):
+        return self.timeout[1] if isinstance(self.timeout, tuple) else self.timeout
+
+    def _track_session(self, session):
+        """
+        包装会话的 request 方法, 记录每次网络异常和 429/5xx 响应。
+        yfinance 会吞掉这些错误 (返回空结果或抛出 TypeError 等无关异常), 记录下来后 call() 才能据此重试并计入熔断器。
+        """
+        send = session.request
+
+        def request(method, url, *args, **kwargs):
+            host = urlparse(url).netloc
+            try:
+                response = send(method, url, *args, **kwargs)
+            except Exception as e:
+                self._record_transport_error(classify_error(e, host))
+                raise
+            status = getattr(response, 'status_code', None)
+            if status == 429 or (status is not None and status >= 500):
+                message = f"HTTP {status} {method} {url}"
+                self._record_transport_error(
+                    RateLimitedError(message, host, 429, parse_retry_after(response.headers.get('Retry-After')))
+                    if status == 429 else HTTPStatusError(message, host, status))
+            return response
+
+        session.request = request
+
+    def _record_transport_error(self, error):
+        for errors in getattr(self._local, 'captures', ()):
+            errors.append(error)
+
+    @contextmanager
+    def capture_transport_errors(self):
+        """在当前线程收集代码块内经由会话发生的网络错误, 返回按发生顺序排列的 FetchError 列表"""
+        captures = self._local.__dict__.setdefault('captures', [])
+        errors = []
+        captures.append(errors)
+        try:
+            yield errors
+        finally:
+            captures.pop()
+
+    def last_transport_error(self):
+        """当前线程最内层 capture_transport_errors 中记录到的最后一个网络错误, 没有时返回 None"""
+        captures = getattr(self._local, 'captures', None)
+        return captures[-1][-1] if captures and captures[-1] else None
+
+    def breaker(self, host):
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = CircuitBreaker(host, self.failure_threshold, self.reset_timeout, self.clock)
+                self._breakers[host] = breaker
+            return breaker
+
+    def backoff(self, attempt, retry_after=None):
+        """第 attempt 次重试前的等待秒数: 有 Retry-After 时按其等待, 否则在 [0, base·2^attempt] 内随机取值"""
+        if retry_after is not None:
+            return retry_after
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    def call(self, host, func, *args, max_retries=None, **kwargs):
+        """
+        在 host 的熔断器与重试策略下执行 func(*args, **kwargs), 用于包装 yfinance 等自行发请求的调用。
+        :return: func 的返回值
+        :raises FetchError: 重试用尽、遇到不可重试的错误或熔断器打开时
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        breaker = self.breaker(host)
+        attempt = 0
+        while True:
+            breaker.before_call()
+            with self._lock:
+                self.request_count += 1
+            cause = None
+            try:
+                with self.capture_transport_errors() as transport:
+                    result = func(*args, **kwargs)
+            except Exception as e:
+                cause = e
+                error = classify_error(e, host)
+            else:
+                # yfinance 吞掉网络错误时返回 None 或空表; 期间会话上出现过网络错误则按失败处理
+                if not transport or not _is_empty(result):
+                    breaker.record_success()
+                    return result
+                error = transport[-1]
+            # yfinance 把网络故障变成了无关的异常时, 以会话上记录到的真实错误为准
+            last = transport[-1] if transport else None
+            if last is not None and last.retryable and \
+                    (not error.retryable or (error.retry_after is None and last.retry_after is not None)):
+                error = last
+            if not error.retryable:
+                # 不可重试的错误 (如 404) 说明主机本身是正常的
+                breaker.record_success()
+                raise error from cause
+            breaker.record_failure(error.retry_after)
+            delay = self.backoff(attempt, error.retry_after)
+            # 本次失败使熔断器打开时直接放弃, 抛出真实的错误而不是 CircuitOpenError
+            if attempt >= max_retries or delay > self.backoff_max or breaker.state == breaker.OPEN:
+                with self._lock:
+                    self.failure_count += 1
+                tracing.count('failures')
+                raise error from cause
+            with self._lock:
+                self.retry_count += 1
+            tracing.count('retries')
+            attempt += 1
+            self.sleep(delay)
+
+    def request(self, method, url, max_retries=None, **kwargs):
+        """发送请求并在状态码 >= 400 时抛出对应的 FetchError; 返回响应对象"""
+        host = urlparse(url).netloc
+        kwargs.setdefault('timeout', self.timeout)
+
+        def send():
+            response = self.session.request(method, url, **kwargs)
+            if response.status_code >= 400:
+                message = f"HTTP {response.status_code} {method} {url}"
+                if response.status_code == 429:
+                    raise RateLimitedError(message, host, 429,
+                                           parse_retry_after(response.headers.get('Retry-After')))
+                raise HTTPStatusError(message, host, response.status_code)
+            return response
+
+        return self.call(host, send, max_retries=max_retries)
+
+    def get_json(self, url, params=None, **kwargs):
+        response = self.request('GET', url, params=params, **kwargs)
+        try:
+            return response.json()
+        except ValueError as e:
+            raise ResponseError(f"响应不是合法的 JSON: {e}", urlparse(url).netloc) from e
+
+    def stats(self):
+        with self._lock:
+            breakers = {host: breaker.state for host, breaker in self._breakers.items()}
+            return {'requests': self.request_count, 'retries': self.retry_count, 'failures': self.failure_count,
+                    'breakers': breakers}
+
+
+_shared_client = None
+_shared_lock = threading.Lock()
+
+
+def shared_http_client():
+    """进程内唯一的 HTTP 客户端; 所有 YahooFinanceDataFetcher 默认共用它的会话与熔断器"""
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            _shared_client = HttpClient()
+        return _shared_client
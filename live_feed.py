@@ -0,0 +1,117 @@
+import math
+import queue
+import random
+import threading
+import time
+
+import pandas as pd
+
+from http_client import FetchError
+
+
+class QuoteSource:
+    """
+    实时行情数据源的基类。
+    子类实现 poll(tickers)，返回自上次调用以来的新报价列表 [(代码, 时间戳, 价格), ...]。
+    """
+
+    # 两次轮询之间的默认间隔 (秒)
+    poll_interval = 5.0
+
+    def poll(self, tickers):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class YahooQuoteSource(QuoteSource):
+    """通过 YahooFinanceDataFetcher 轮询最新成交价"""
+
+    poll_interval = 5.0
+
+    def __init__(self, fetcher):
+        self.fetcher = fetcher
+
+    def poll(self, tickers):
+        quotes = []
+        for ticker in tickers:
+            try:
+                price = self.fetcher.get_latest_price(ticker)
+            except FetchError as e:
+                print(f"获取 {ticker} 最新价格时出错: {e}")
+                continue
+            if price is not None:
+                quotes.append((ticker, pd.Timestamp.now(tz='UTC'), price))
+        return quotes
+
+
+class SimulatedQuoteSource(QuoteSource):
+    """
+    本地模拟行情, 用于测试: 每只股票按几何布朗运动随机游走,
+    每次轮询随机产生 0 到 max_burst 个报价, 以模拟成交密集时的报价突发。
+    """
+
+    poll_interval = 0.05
+
+    def __init__(self, start_prices, volatility=0.0005, max_burst=20, seed=None):
+        self.prices = dict(start_prices)
+        self.volatility = volatility
+        self.max_burst = max_burst
+        self._rng = random.Random(seed)
+
+    def poll(self, tickers):
+        quotes = []
+        now = pd.Timestamp.now(tz='UTC')
+        for ticker in tickers:
+            if ticker not in self.prices:
+                continue
+            for _ in range(self._rng.randint(0, self.max_burst)):
+                self.prices[ticker] *= math.exp(self._rng.gauss(0, self.volatility))
+                quotes.append((ticker, now, self.prices[ticker]))
+        return quotes
+
+
+class LiveQuoteStream:
+    """在后台线程中轮询数据源, 把报价放入线程安全的队列, 由 UI 线程按帧率批量取出"""
+
+    def __init__(self, source, tickers, poll_interval=None):
+        self.source = source
+        self.tickers = list(tickers)
+        self.poll_interval = poll_interval if poll_interval is not None else source.poll_interval
+        self.quotes = queue.Queue()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='live-quotes', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self.source.close()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive() and not self._stop_event.is_set()
+
+    def drain(self, max_items=100000):
+        """取出队列中当前所有报价"""
+        quotes = []
+        try:
+            while len(quotes) < max_items:
+                quotes.append(self.quotes.get_nowait())
+        except queue.Empty:
+            pass
+        return quotes
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            try:
+                for quote in self.source.poll(self.tickers):
+                    self.quotes.put(quote)
+            except Exception as e:
+                print(f"实时行情轮询出错: {e}")
+            self._stop_event.wait(max(0.0, self.poll_interval - (time.monotonic() - started)))
@@ -1,12 +1,29 @@
+import collections
+import math
+import os
+import queue
+import shutil
+import sys
+import tempfile
+import threading
 import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox
-import numpy as np
-import yfinance as yf  # 确保 yfinance 已导入
+from contextlib import closing
+from tkinter import ttk, scrolledtext, messagebox, filedialog
 
-from data_fetcher import YahooFinanceDataFetcher
-from data_processor import StockDataProcessor
-from visualizer import StockVisualizer
-from valuation_model import StockValuationModel
+# 仅导入轻量的标准库模块, 保证窗口尽快出现;
+# yfinance / pandas / NumPy / matplotlib 在后台线程中预热, 或在首次使用时再导入
+from analysis_worker import AnalysisAborted, AnalysisWorker
+from fetch_scheduler import FetchScheduler
+from financial_table import FinancialStatementGrid
+import tracing
+
+
+# 实时模式下图表的最高刷新帧率; 两帧之间到达的报价会合并为一次重绘
+LIVE_MAX_FPS = 5
+# 实时模式下每只股票最多保留的报价行数; 更早的报价丢弃, 图表只显示最近这部分
+LIVE_MAX_ROWS = 2000
+# 实时指标栏中显示的指标
+LIVE_INDICATORS = ['SMA_20', 'SMA_50', 'RSI_14', 'BB_Upper', 'BB_Lower']
 
 
 class StockAnalysisApp:
@@ -15,12 +32,73 @@ class StockAnalysisApp:
         self.root.title("股票估值与可视化工具")
         self.root.geometry("1200x800")
 
-        self.fetcher = YahooFinanceDataFetcher()
-        self.processor = StockDataProcessor()
-        self.valuation_model = StockValuationModel(risk_free_rate=0.04, market_return=0.09)
+        # 数据获取/处理/估值组件在后台线程中创建, 见 _ensure_backend
+        self.fetcher = None
+        self.processor = None
+        self.valuation_model = None
+        self.pipeline = None
+        self._backend_lock = threading.Lock()
+        self._matplotlib_ready = threading.Event()
+        # 并发上限与每秒请求数, 避免被 Yahoo 限流
+        self.scheduler = FetchScheduler(max_workers=8, requests_per_second=5.0)
+        self.worker = AnalysisWorker()
 
         self.fetched_data = {}
+        # 按需计算的技术指标: 代码 -> (计算所用的行情, 带指标列的 DataFrame)
+        self._indicator_frames = {}
+        self.history_dir = None
+        self.main_ticker = None
+        self.competitor_tickers = []
+        self.live_stream = None
+        self.indicator_engine = None
+        # 实时报价及当时的增量指标值: 代码 -> 定长 deque, 不追加到 fetched_data 中的历史行情
+        self.live_rows = {}
+        self.visualizer = None
+        self.sensitivity_visualizer = None
+        self._pending_sensitivity = None
         self._create_widgets()
+        self.root.after(100, self._poll_worker_events)
+        threading.Thread(target=self._prewarm, name='prewarm', daemon=True).start()
+
+    def _prewarm(self):
+        """后台预热: 先导入 matplotlib (图表选项卡需要), 再创建数据与估值组件"""
+        try:
+            import matplotlib.pyplot  # noqa: F401
+            import matplotlib.backends.backend_tkagg  # noqa: F401
+        except Exception as e:
+            print(f"预加载 matplotlib 时出错: {e}")
+        finally:
+            self._matplotlib_ready.set()
+        self._ensure_backend()
+
+    def _ensure_backend(self):
+        """首次调用时导入数据获取/处理/估值模块并创建对应组件, 可在任意线程中调用"""
+        with self._backend_lock:
+            if self.pipeline is not None:
+                return self.pipeline
+            from analysis_pipeline import StockAnalysisPipeline
+            from data_cache import MarketDataCache
+            from data_fetcher import YahooFinanceDataFetcher
+            from data_processor import StockDataProcessor
+            from history_store import HistoryStore
+            from peer_index import PeerMultipleIndex, default_index_path
+            from valuation_model import StockValuationModel
+
+            self.fetcher = YahooFinanceDataFetcher(cache=MarketDataCache())
+            self.processor = StockDataProcessor()
+            self.valuation_model = StockValuationModel(risk_free_rate=0.04, market_return=0.09)
+            # 本次会话的行情保存在临时目录的内存映射存储中, 各股票只保留存储上的视图; 退出时删除
+            self.history_dir = tempfile.mkdtemp(prefix='stockapp_history_')
+            self.pipeline = StockAnalysisPipeline(self.fetcher, self.processor, self.valuation_model,
+                                                  peer_index=PeerMultipleIndex.load(default_index_path()),
+                                                  history_store=HistoryStore.create(self.history_dir))
+            return self.pipeline
+
+    def shutdown(self):
+        """窗口关闭后调用: 停止实时模式并删除本次会话的行情存储"""
+        self._stop_live_mode()
+        if self.history_dir is not None:
+            shutil.rmtree(self.history_dir, ignore_errors=True)
 
     def _create_widgets(self):
         # GUI布局代码与之前版本相同
@@ -39,206 +117,368 @@ class StockAnalysisApp:
 
         self.run_button = ttk.Button(input_frame, text="获取数据并分析", command=self.analyze_stock)
         self.run_button.grid(row=0, column=2, rowspan=2, padx=10, pady=5, sticky="ns")
+        self.cancel_button = ttk.Button(input_frame, text="取消", command=self.cancel_analysis, state="disabled")
+        self.cancel_button.grid(row=0, column=3, rowspan=2, padx=5, pady=5, sticky="ns")
+        self.status_var = tk.StringVar(value="就绪")
+        ttk.Label(input_frame, textvariable=self.status_var).grid(row=0, column=4, rowspan=2, padx=10, sticky="w")
+
+        self.live_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(input_frame, text="实时模式", variable=self.live_var,
+                        command=self.toggle_live_mode).grid(row=0, column=5, padx=5, pady=2, sticky="w")
+        self.live_source_var = tk.StringVar(value="Yahoo 轮询")
+        ttk.Combobox(input_frame, textvariable=self.live_source_var, values=["Yahoo 轮询", "模拟行情"],
+                     state="readonly", width=12).grid(row=1, column=5, padx=5, pady=2, sticky="w")
+
+        ttk.Label(input_frame, text="图表指标:").grid(row=0, column=6, padx=5, pady=2, sticky="w")
+        self.indicator_var = tk.StringVar(value="无")
+        indicator_box = ttk.Combobox(input_frame, textvariable=self.indicator_var, state="readonly", width=10,
+                                     values=["无", "SMA_20", "SMA_50", "BB_Upper", "BB_Lower"])
+        indicator_box.grid(row=1, column=6, padx=5, pady=2, sticky="w")
+        indicator_box.bind("<<ComboboxSelected>>",
+                           lambda event: self._plot_data(self.main_ticker, self.competitor_tickers))
+        self.live_values_var = tk.StringVar(value="")
+        ttk.Label(input_frame, textvariable=self.live_values_var).grid(row=2, column=0, columnspan=7, padx=5,
+                                                                        pady=2, sticky="w")
 
         self.notebook = ttk.Notebook(self.root)
         self.notebook.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=10, pady=5)
 
+        # 图表在选项卡首次显示时才创建, 避免在窗口出现前构建 matplotlib 图形
         self.plot_frame = ttk.Frame(self.notebook)
         self.notebook.add(self.plot_frame, text="图表分析")
-        self.visualizer = StockVisualizer(master=self.plot_frame)
+        self.plot_placeholder = ttk.Label(self.plot_frame, text="图表加载中...")
+        self.plot_placeholder.pack(expand=True)
+        self.plot_frame.bind("<Map>", self._on_tab_changed)
+        self.notebook.bind("<<NotebookTabChanged>>", self._on_tab_changed)
 
         self.financials_frame = ttk.Frame(self.notebook)
         self.notebook.add(self.financials_frame, text="财务报表")
-        self.financials_text = scrolledtext.ScrolledText(self.financials_frame, wrap=tk.WORD, width=100, height=20)
-        self.financials_text.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        self.financials_grid = FinancialStatementGrid(self.financials_frame)
+        self.financials_grid.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
         self.valuation_frame = ttk.Frame(self.notebook)
         self.notebook.add(self.valuation_frame, text="估值结果")
-        self.valuation_output = scrolledtext.ScrolledText(self.valuation_frame, wrap=tk.WORD, width=100, height=20)
-        self.valuation_output.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+        valuation_panes = ttk.PanedWindow(self.valuation_frame, orient=tk.VERTICAL)
+        valuation_panes.pack(fill=tk.BOTH, expand=True)
+        self.valuation_output = scrolledtext.ScrolledText(valuation_panes, wrap=tk.WORD, width=100, height=12)
+        valuation_panes.add(self.valuation_output, weight=1)
+        self.sensitivity_frame = ttk.Frame(valuation_panes)
+        valuation_panes.add(self.sensitivity_frame, weight=2)
+
+        # 各阶段 (获取、处理、估值、绘图) 的耗时汇总; 追踪关闭时几乎没有开销
+        self.performance_frame = ttk.Frame(self.notebook)
+        self.notebook.add(self.performance_frame, text="性能")
+        performance_controls = ttk.Frame(self.performance_frame)
+        performance_controls.pack(side=tk.TOP, fill=tk.X, padx=5, pady=5)
+        self.trace_var = tk.BooleanVar(value=tracing.tracer.enabled)
+        ttk.Checkbutton(performance_controls, text="记录耗时", variable=self.trace_var,
+                        command=self._toggle_tracing).pack(side=tk.LEFT)
+        ttk.Button(performance_controls, text="刷新", command=self._refresh_performance).pack(side=tk.LEFT, padx=5)
+        ttk.Button(performance_controls, text="清空", command=self._clear_performance).pack(side=tk.LEFT, padx=5)
+        ttk.Button(performance_controls, text="导出...", command=self._export_trace).pack(side=tk.LEFT, padx=5)
+        self.performance_output = scrolledtext.ScrolledText(self.performance_frame, wrap=tk.NONE,
+                                                            font=('Courier', 10))
+        self.performance_output.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
+
+    def _on_tab_changed(self, event=None):
+        selected = self.notebook.nametowidget(self.notebook.select())
+        if selected is self.plot_frame and self.visualizer is None:
+            self._create_visualizer()
+        elif selected is self.valuation_frame and self.sensitivity_visualizer is None:
+            self._create_sensitivity_visualizer()
+
+    def _create_visualizer(self):
+        # matplotlib 仍在后台导入时稍后重试, 避免阻塞事件循环
+        if not self._matplotlib_ready.is_set():
+            self.root.after(50, self._create_visualizer)
+            return
+        if self.visualizer is not None:
+            return
+        from visualizer import StockVisualizer
+        self.plot_placeholder.destroy()
+        self.visualizer = StockVisualizer(master=self.plot_frame)
+        if self.main_ticker in self.fetched_data:
+            self._plot_data(self.main_ticker, self.competitor_tickers)
 
-    def analyze_stock(self):
-        self.run_button.config(state="disabled", text="分析中...")
-        self.root.update_idletasks()
+    def _create_sensitivity_visualizer(self):
+        if not self._matplotlib_ready.is_set():
+            self.root.after(50, self._create_sensitivity_visualizer)
+            return
+        if self.sensitivity_visualizer is not None:
+            return
+        from visualizer import StockVisualizer
+        self.sensitivity_visualizer = StockVisualizer(master=self.sensitivity_frame, figsize=(8, 4))
+        if self._pending_sensitivity is not None:
+            self._plot_sensitivity(self._pending_sensitivity)
 
+    def analyze_stock(self):
         main_ticker = self.main_ticker_entry.get().strip().upper()
         if not main_ticker:
             messagebox.showerror("错误", "请输入主股票代码。")
-            self.run_button.config(state="normal", text="获取数据并分析")
             return
 
         competitor_tickers = [t.strip() for t in self.competitors_entry.get().strip().upper().split(',') if t.strip()]
-        all_tickers = [main_ticker] + competitor_tickers
+        self.main_ticker = main_ticker
+        self.competitor_tickers = competitor_tickers
         self.fetched_data = {}
-
-        for ticker in all_tickers:
-            print(f"正在获取 {ticker} 的数据...")
-            data = self._fetch_and_process_single_stock(ticker)
-            if not data['info']:
-                messagebox.showwarning("警告", f"无法获取 {ticker} 的数据，请检查股票代码。")
-                continue
-            self.fetched_data[ticker] = data
-
-        if main_ticker not in self.fetched_data:
-            messagebox.showerror("错误", f"无法获取主股票 {main_ticker} 的数据。分析中止。")
-            self.run_button.config(state="normal", text="获取数据并分析")
+        self._indicator_frames = {}
+        self.live_rows = {}
+        self.live_values_var.set("")
+        self.financials_grid.clear()
+        self._stop_live_mode()
+
+        # 若已有分析在运行, 新任务会取消并取代它
+        self.worker.start(self._analysis_pipeline, main_ticker, competitor_tickers)
+        self.run_button.config(text="重新分析")
+        self.cancel_button.config(state="normal")
+        self.status_var.set(f"正在分析 {main_ticker} ...")
+
+    def cancel_analysis(self):
+        self.worker.cancel()
+        self.cancel_button.config(state="disabled")
+
+    @tracing.traced('analysis', 'pipeline', ticker='main_ticker')
+    def _analysis_pipeline(self, run, main_ticker, competitor_tickers):
+        """在后台线程中运行; 不直接操作任何 Tk 控件, 只通过 run.post 投递事件"""
+        from data_fetcher import YAHOO_API_HOST
+
+        self._ensure_backend()
+        run.check_cancelled()
+        all_tickers = [main_ticker] + competitor_tickers
+        stock_data = {}
+
+        print(f"正在并发获取 {', '.join(all_tickers)} 的数据...")
+        fetches = self.scheduler.fetch_stocks(self.fetcher, all_tickers, period="5y", host=YAHOO_API_HOST,
+                                              bulk_history=True)
+        with closing(fetches):
+            for ticker, raw_data in fetches:
+                run.check_cancelled()
+                run.post('progress', ticker, 'processing')
+                data = self.pipeline.process(raw_data, ticker)
+                errors = raw_data.get('errors') or {}
+                if not data['info']:
+                    message = f"获取 {ticker} 的数据失败: {errors['info']}" if 'info' in errors else \
+                        f"无法获取 {ticker} 的数据，请检查股票代码。"
+                    run.post('warning', ticker, message=message)
+                    continue
+                if errors:
+                    # 限流或网络故障导致的缺项要明确告知, 而不是表现为"数据缺失"
+                    details = "\n".join(f"{name}: {error}" for name, error in errors.items())
+                    run.post('warning', ticker, message=f"{ticker} 的部分数据获取失败, 结果可能不完整:\n{details}")
+                stock_data[ticker] = data
+                run.post('stock_ready', ticker, 'processed', data=data)
+
+        if main_ticker not in stock_data:
+            raise AnalysisAborted(f"无法获取主股票 {main_ticker} 的数据。分析中止。")
+
+        run.check_cancelled()
+        run.post('progress', main_ticker, 'valuation')
+        # (新增) 获取格雷厄姆公式所需的Y值
+        peer_infos = [stock_data[t]['info'] for t in competitor_tickers if t in stock_data]
+        result = self.pipeline.evaluate(main_ticker, stock_data[main_ticker], peer_infos)
+        self.pipeline.peer_index.save()
+        from analysis_pipeline import format_valuation_report
+        run.check_cancelled()
+        run.post('valuation', main_ticker, 'valuation', report=format_valuation_report(result))
+        sensitivity = self.pipeline.dcf_sensitivity(stock_data[main_ticker])
+        if sensitivity is not None:
+            run.post('sensitivity', main_ticker, 'valuation', **sensitivity)
+
+    def _poll_worker_events(self):
+        """在 UI 线程中处理后台任务投递的事件, 忽略已被取代的旧任务的事件"""
+        try:
+            while True:
+                event = self.worker.events.get_nowait()
+                if event['run_id'] == self.worker.current_run_id:
+                    self._handle_worker_event(event)
+        except queue.Empty:
+            pass
+        self.root.after(100, self._poll_worker_events)
+
+    def _handle_worker_event(self, event):
+        kind, ticker, payload = event['kind'], event['ticker'], event['payload']
+        stage_labels = {'processing': "数据已获取, 正在处理", 'processed': "处理完成", 'valuation': "正在估值"}
+        if kind in ('progress', 'stock_ready'):
+            self.status_var.set(f"{ticker}: {stage_labels.get(event['stage'], event['stage'])}")
+        if kind == 'stock_ready':
+            self.fetched_data[ticker] = payload['data']
+            # 主股票的图表与财务报表先行展示, 竞争对手到达后逐个加入对比图和报表的股票列表
+            self._display_financials(ticker)
+            if self.main_ticker in self.fetched_data:
+                self._plot_data(self.main_ticker, self.competitor_tickers)
+        elif kind == 'warning':
+            messagebox.showwarning("警告", payload['message'])
+        elif kind == 'failed':
+            message = payload['message'] if payload.get('aborted') else f"分析过程中出错: {payload['message']}"
+            messagebox.showerror("错误", message)
+        elif kind == 'valuation':
+            self._display_valuation(payload['report'])
+        elif kind == 'sensitivity':
+            payload['ticker'] = ticker
+            self._pending_sensitivity = payload
+            if self.sensitivity_visualizer is not None:
+                self._plot_sensitivity(payload)
+
+        if kind in ('done', 'cancelled', 'failed'):
+            self.status_var.set({'done': "分析完成", 'cancelled': "已取消", 'failed': "分析失败"}[kind])
+            self.run_button.config(text="获取数据并分析")
+            self.cancel_button.config(state="disabled")
+            if self.fetcher is not None:
+                cache_stats = self.fetcher.cache.stats()
+                print(f"缓存统计: 命中 {cache_stats['total_hits']} 次, 未命中 {cache_stats['total_misses']} 次")
+                http_stats = self.fetcher.http.stats()
+                print(f"网络统计: 请求 {http_stats['requests']} 次, 重试 {http_stats['retries']} 次, "
+                      f"失败 {http_stats['failures']} 次")
+            if tracing.tracer.enabled:
+                self._refresh_performance()
+
+    def _toggle_tracing(self):
+        if self.trace_var.get():
+            tracing.tracer.enable()
+        else:
+            tracing.tracer.disable()
+
+    def _refresh_performance(self):
+        self.performance_output.delete('1.0', tk.END)
+        self.performance_output.insert(tk.END, tracing.tracer.format_summary())
+
+    def _clear_performance(self):
+        tracing.tracer.clear()
+        self._refresh_performance()
+
+    def _export_trace(self):
+        path = filedialog.asksaveasfilename(
+            title="导出耗时追踪", defaultextension='.json',
+            filetypes=[("Chrome trace", "*.json"), ("JSON Lines", "*.jsonl")])
+        if path:
+            tracing.tracer.export(path)
+            self.status_var.set(f"追踪已导出到 {path}")
+
+    def _plot_sensitivity(self, payload):
+        self.sensitivity_visualizer.plot_sensitivity_heatmap(
+            payload['values'], payload['waccs'], payload['terminal_growth_rates'],
+            title=f"{payload['ticker']} DCF 敏感性 (WACC × 永续增长率)", base_point=payload['base_point'],
+            current_price=payload['current_price'])
+
+    def toggle_live_mode(self):
+        if self.live_var.get():
+            self._start_live_mode()
+        else:
+            self._stop_live_mode()
+
+    def _start_live_mode(self):
+        if self.main_ticker not in self.fetched_data:
+            messagebox.showinfo("提示", "请先完成一次分析，再开启实时模式。")
+            self.live_var.set(False)
             return
-
-        print("所有数据获取完毕，开始展示...")
-        self._display_financials(main_ticker)
-        self._calculate_and_display_valuation(main_ticker, competitor_tickers)
-        self._plot_data(main_ticker, competitor_tickers)
-
-        self.run_button.config(state="normal", text="获取数据并分析")
-
-    def _fetch_and_process_single_stock(self, ticker):
-        data = {
-            'info': self.fetcher.get_company_info(ticker),
-            'history': self.fetcher.get_stock_history(ticker, period="5y"),
-            'financials': self.fetcher.get_financials(ticker)
-        }
-        if data['info']:
-            data['processed_history'] = self.processor.calculate_technical_indicators(data['history'])
-            data['annual_cash_flow'] = self.processor.get_yearly_financial_data(data['financials'], 'cash_flow')
-            data['annual_balance'] = self.processor.get_yearly_financial_data(data['financials'], 'balance_sheet')
-            data['annual_income'] = self.processor.get_yearly_financial_data(data['financials'], 'income_stmt')
-            data['fcf'] = self.processor.calculate_free_cash_flow(data['annual_cash_flow'])
-            data['total_debt'] = self.processor.get_total_debt(data['annual_balance'])
-            data['cash_equivalents'] = self.processor.get_cash_and_equivalents(data['annual_balance'])
-            data['total_equity'] = self.processor.get_total_stockholder_equity(data['annual_balance'])
-            # (新增) 获取EPS历史数据用于计算增长率
-            data['eps_history'] = self.processor.get_eps_from_financials(data['annual_income'])
-        return data
+        tickers = [t for t in [self.main_ticker] + self.competitor_tickers if t in self.fetched_data]
+        from live_feed import LiveQuoteStream, SimulatedQuoteSource, YahooQuoteSource
+
+        histories = {t: self.fetched_data[t]['history'] for t in tickers}
+        # 用已有历史初始化增量指标状态, 之后每个报价只需 O(1) 更新
+        self.indicator_engine = self.processor.create_indicator_engine(histories)
+        self.live_rows = {t: collections.deque(maxlen=LIVE_MAX_ROWS) for t in tickers}
+        if self.live_source_var.get() == "模拟行情":
+            source = SimulatedQuoteSource({t: df['Close'].iloc[-1] for t, df in histories.items() if not df.empty})
+        else:
+            source = YahooQuoteSource(self.fetcher)
+        self.live_stream = LiveQuoteStream(source, tickers)
+        self.live_stream.start()
+        self.status_var.set("实时模式运行中")
+        self.root.after(int(1000 / LIVE_MAX_FPS), self._live_frame)
+
+    def _stop_live_mode(self):
+        if self.live_stream is not None:
+            self.live_stream.stop()
+            self.live_stream = None
+            self.status_var.set("实时模式已停止")
+        self.live_var.set(False)
+
+    def _live_frame(self):
+        """每帧取出期间到达的全部报价, 合并追加到历史数据后只重绘一次"""
+        if self.live_stream is None or not self.live_stream.running:
+            return
+        quotes = self.live_stream.drain()
+        if quotes:
+            self._append_live_quotes(quotes)
+            self._plot_data(self.main_ticker, self.competitor_tickers)
+        self.root.after(int(1000 / LIVE_MAX_FPS), self._live_frame)
+
+    def _append_live_quotes(self, quotes):
+        for ticker, timestamp, price in quotes:
+            if ticker not in self.live_rows:
+                continue
+            values = self.indicator_engine.update(ticker, price)
+            self.live_rows[ticker].append(dict(values, Date=timestamp, Close=price))
+        if self.main_ticker in self.live_rows and self.live_rows[self.main_ticker]:
+            latest = self.live_rows[self.main_ticker][-1]
+            shown = [f"{name} {latest[name]:.2f}" for name in LIVE_INDICATORS if not math.isnan(latest[name])]
+            self.live_values_var.set(f"{self.main_ticker} 实时 {latest['Close']:.2f}  " + "  ".join(shown))
+
+    def _with_live_rows(self, ticker, df):
+        """在历史行情 (或带指标的行情) 后接上实时报价; 报价时间换算为交易所当地时间, 与日线日期对齐"""
+        import pandas as pd
+
+        rows = self.live_rows.get(ticker)
+        if not rows:
+            return df
+        live = pd.DataFrame(list(rows)).set_index('Date')
+        timezone = (self.fetched_data[ticker].get('info') or {}).get('exchangeTimezoneName')
+        live.index = live.index.tz_convert(df.index.tz or timezone or 'UTC')
+        if df.index.tz is None:
+            live.index = live.index.tz_localize(None)
+        return pd.concat([df, live[[column for column in live.columns if column in df.columns]]])
 
     def _plot_data(self, main_ticker, competitor_tickers):
+        if self.visualizer is None:
+            # 图表尚未创建, 创建时会自动绘制当前数据
+            return
         plot_dfs = {}
         if main_ticker in self.fetched_data:
-            plot_dfs[main_ticker] = self.fetched_data[main_ticker]['processed_history']
+            plot_dfs[main_ticker] = self.fetched_data[main_ticker]['history']
         for ticker in competitor_tickers:
             if ticker in self.fetched_data:
-                plot_dfs[ticker] = self.fetched_data[ticker]['processed_history']
-        self.visualizer.plot_multi_stock_comparison(plot_dfs, title="收盘价对比 (5年)")
-
-    def _display_financials(self, main_ticker):
-        self.financials_text.delete(1.0, tk.END)
-        data = self.fetched_data[main_ticker]
-        self.financials_text.insert(tk.END, f"--- {main_ticker} 关键财务数据 ---\n\n")
-        for key in ['income_stmt', 'balance_sheet', 'cash_flow']:
-            self.financials_text.insert(tk.END, f"--- {key.replace('_', ' ').title()} ---\n")
-            df = data['financials'].get(key)
-            if df is not None and not df.empty:
-                self.financials_text.insert(tk.END, df.to_string() + "\n\n")
-            else:
-                self.financials_text.insert(tk.END, "数据不可用\n\n")
-
-    def _calculate_and_display_valuation(self, main_ticker, competitor_tickers):
+                plot_dfs[ticker] = self.fetched_data[ticker]['history']
+        indicator = self.indicator_var.get()
+        if indicator == "无":
+            plot_dfs = {ticker: self._with_live_rows(ticker, df) for ticker, df in plot_dfs.items()}
+            self.visualizer.plot_multi_stock_comparison(plot_dfs, title="收盘价对比 (5年)")
+        else:
+            # 实时报价的指标值来自增量引擎, 接在按历史行情计算的指标之后
+            plot_dfs = {ticker: self._with_live_rows(ticker, self._indicator_frame(ticker)) for ticker in plot_dfs}
+            self.visualizer.plot_price_history(plot_dfs, title=f"收盘价与 {indicator} (5年)", indicator_col=indicator)
+
+    def _indicator_frame(self, ticker):
+        """带技术指标列的行情; 指标不随行情保存, 在首次绘制时计算, 行情更新后重新计算"""
+        data = self.fetched_data[ticker]
+        cached = self._indicator_frames.get(ticker)
+        if cached is None or cached[0] is not data['history']:
+            cached = self._indicator_frames[ticker] = (data['history'], self.pipeline.indicators(data, ticker))
+        return cached[1]
+
+    def _display_financials(self, ticker):
+        self.financials_grid.set_financials(ticker, self.fetched_data[ticker]['financials'])
+        if ticker == self.main_ticker:
+            self.financials_grid.show_ticker(ticker)
+
+    def _display_valuation(self, report):
         self.valuation_output.delete(1.0, tk.END)
-        main_data = self.fetched_data[main_ticker]
-        output = f"--- {main_ticker} 估值分析 ---\n\n"
-
-        # (新增) 获取格雷厄姆公式所需的Y值
-        current_yield_Y = self.fetcher.get_current_yield("^TNX")
+        self.valuation_output.insert(tk.END, report)
 
-        # --- DCF 估值 ---
-        # (代码无变化, 保持原样)
-        output += "### 1. 折现现金流 (DCF) 估值 ###\n"
-        # ... (此处省略未改变的DCF代码) ...
-        try:
-            beta = main_data['info'].get('beta')
-            market_cap = main_data['info'].get('marketCap')
-            shares_outstanding = main_data['info'].get('sharesOutstanding')
-            current_fcf = main_data['fcf'].iloc[-1] if not main_data['fcf'].empty else None
-            total_debt = main_data['total_debt'].iloc[-1] if not main_data['total_debt'].empty else None
-            cash_equivalents = main_data['cash_equivalents'].iloc[-1] if not main_data[
-                'cash_equivalents'].empty else None
-            required_data_map = {'Beta值': beta, '市值': market_cap, '流通股数': shares_outstanding,
-                                 '最新自由现金流': current_fcf, '总负债': total_debt, '现金及等价物': cash_equivalents}
-            missing_items = [name for name, value in required_data_map.items() if value is None]
-            if not missing_items:
-                if len(main_data['fcf']) > 1:
-                    hist_growth = main_data['fcf'].pct_change().mean()
-                    growth_rates_high = [max(min(hist_growth * (1 - 0.1 * i), 0.3), 0.05) for i in range(5)]
-                else:
-                    growth_rates_high = [0.15, 0.12, 0.10, 0.08, 0.05]
-                terminal_growth_rate = 0.025;
-                cost_of_debt = 0.055
-                cost_of_equity = self.valuation_model.calculate_cost_of_equity(beta);
-                wacc = self.valuation_model.calculate_wacc(market_cap, total_debt, cost_of_equity, cost_of_debt)
-                output += f"  - WACC 计算参数: Beta={beta:.2f}, 股权成本={cost_of_equity:.2%}, WACC={wacc:.2%}\n"
-                output += f"  - FCF 增长假设 (5年): {[f'{g:.2%}' for g in growth_rates_high]}\n"
-                dcf_value = self.valuation_model.dcf_valuation(current_fcf, growth_rates_high, terminal_growth_rate,
-                                                               wacc, shares_outstanding, total_debt, cash_equivalents)
-                output += f"  >>> DCF 每股内在价值: ${dcf_value:.2f}\n"
-            else:
-                output += f"  - 关键数据不足，无法进行DCF估值。\n";
-                output += f"  - 缺失的项目: {', '.join(missing_items)}\n"
-        except Exception as e:
-            output += f"  - DCF 估值计算出错: {e}\n"
-
-        # --- (新增) 本杰明·格雷厄姆估值 ---
-        output += "\n### 2. 本杰明·格雷厄姆估值 ###\n"
-        try:
-            eps = main_data['info'].get('trailingEps')
-            eps_history = main_data.get('eps_history')
-            g = None
-            if eps_history is not None and len(eps_history) > 2:
-                # 计算3年复合年均增长率(CAGR)作为g的代理
-                # 过滤负值或零值以避免计算错误
-                eps_history_positive = eps_history[eps_history > 0]
-                if len(eps_history_positive) > 2:
-                    end_value = eps_history_positive.iloc[-1]
-                    start_value = eps_history_positive.iloc[-3]
-                    cagr = ((end_value / start_value) ** (1 / 2)) - 1
-                    g = cagr * 100  # 转换为百分比
-
-            if all([eps, g is not None, current_yield_Y]):
-                output += f"  - 计算参数: EPS=${eps:.2f}, 历史EPS增长率g={g:.2f}%, 债券收益率Y={current_yield_Y:.2f}%\n"
-                graham_value = self.valuation_model.benjamin_graham_valuation(eps, g, current_yield_Y)
-                output += f"  >>> 格雷厄姆内在价值: ${graham_value:.2f}\n"
-            else:
-                output += "  - 关键数据不足 (如 EPS, EPS历史增长率, 或债券收益率)，无法进行估值。\n"
-        except Exception as e:
-            output += f"  - 格雷厄姆估值计算出错: {e}\n"
-
-        # --- 相对估值 ---
-        output += "\n### 3. 相对估值 ###\n"
-        # (代码无变化, 保持原样)
-        try:
-            pe_list, ps_list, pb_list = [], [], []
-            for ticker in competitor_tickers:
-                if ticker in self.fetched_data:
-                    info = self.fetched_data[ticker]['info']
-                    if info.get('trailingPE'): pe_list.append(info['trailingPE'])
-                    if info.get('priceToSalesTrailing12Months'): ps_list.append(info['priceToSalesTrailing12Months'])
-                    if info.get('priceToBook'): pb_list.append(info['priceToBook'])
-            avg_pe = np.mean(pe_list) if pe_list else None;
-            avg_ps = np.mean(ps_list) if ps_list else None;
-            avg_pb = np.mean(pb_list) if pb_list else None
-            pe_str = f"{avg_pe:.2f}" if avg_pe is not None else "N/A";
-            ps_str = f"{avg_ps:.2f}" if avg_ps is not None else "N/A";
-            pb_str = f"{avg_pb:.2f}" if avg_pb is not None else "N/A"
-            output += f"  - 竞争对手平均倍数: P/E={pe_str}, P/S={ps_str}, P/B={pb_str}\n"
-            target_eps = main_data['info'].get('trailingEps')
-            total_revenue = main_data['annual_income'].loc['Total Revenue'].iloc[-1] if 'Total Revenue' in main_data[
-                'annual_income'].index else None
-            total_equity = main_data['total_equity'].iloc[-1] if not main_data['total_equity'].empty else None
-            shares_outstanding = main_data['info'].get('sharesOutstanding')
-            target_sps = total_revenue / shares_outstanding if total_revenue and shares_outstanding else None;
-            target_bps = total_equity / shares_outstanding if total_equity and shares_outstanding else None
-            relative_values = self.valuation_model.relative_valuation(target_eps, target_sps, target_bps, avg_pe,
-                                                                      avg_ps, avg_pb)
-            if not relative_values:
-                output += "  - 关键数据不足 (如 EPS, 股东权益等)，无法进行相对估值。\n"
-            else:
-                for method, value in relative_values.items(): output += f"  >>> 基于 {method} 的估值: ${value:.2f}\n"
-        except Exception as e:
-            output += f"  - 相对估值计算出错: {e}\n"
 
-        output += f"\n### 当前市场价格 ###\n  - {main_ticker} 当前股价: ${main_data['history']['Close'].iloc[-1]:.2f}\n"
-        self.valuation_output.insert(tk.END, output)
+def _report_first_window(root):
+    """启动基准测试探针: 窗口首次可见时输出标记并退出 (见 benchmarks/startup_benchmark.py)"""
+    root.wait_visibility(root)
+    root.update_idletasks()
+    print("FIRST_WINDOW", flush=True)
+    root.destroy()
 
 
 if __name__ == "__main__":
     root = tk.Tk()
     app = StockAnalysisApp(root)
-    root.mainloop()
\ No newline at end of file
+    if os.environ.get("STOCKAPP_STARTUP_PROBE"):
+        root.after(0, _report_first_window, root)
+    root.mainloop()
+    app.shutdown()
+    sys.exit(0)
\ No newline at end of file
@@ -0,0 +1,114 @@
+import threading
+import time
+import weakref
+
+# 收益率曲线输入 (Yahoo 报价单位为百分比)
+RATE_SYMBOLS = {
+    '^IRX': "13周国库券",
+    '^TNX': "10年期国债",
+    '^TYX': "30年期国债",
+}
+CORPORATE_PROXY = 'CORP'
+# Yahoo 没有公司债收益率的报价, 用10年期国债加固定利差近似 AAA 级公司债收益率 (百分点)
+DEFAULT_CORPORATE_SPREAD = 0.9
+
+
+class _Flight:
+    """一次进行中的获取; 同一代码的并发请求等待同一个结果"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+
+
+class MarketRatesService:
+    """
+    进程内共享的利率服务。
+    每个代码在 TTL 内只获取一次; 同一代码的并发请求合并为一次获取 (single-flight)，
+    其余线程等待其结果。同时为 CAPM 提供无风险利率，为格雷厄姆公式提供债券收益率 Y。
+    """
+
+    def __init__(self, fetch_func, ttl=15 * 60, corporate_spread=DEFAULT_CORPORATE_SPREAD,
+                 risk_free_symbol='^TNX', graham_symbol='^TNX'):
+        """
+        :param fetch_func: fetch_func(代码) -> 收益率 (百分比) 或 None, 例如 fetcher.get_current_yield
+        :param graham_symbol: 格雷厄姆公式 Y 所用的代码, 可设为 CORPORATE_PROXY 使用公司债近似值
+        """
+        self.fetch_func = fetch_func
+        self.ttl = ttl
+        self.corporate_spread = corporate_spread
+        self.risk_free_symbol = risk_free_symbol
+        self.graham_symbol = graham_symbol
+        self._values = {}
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.fetch_count = 0
+
+    def get(self, symbol):
+        """返回代码的最新收益率 (百分比), 获取失败时返回 None; 失败结果不缓存"""
+        if symbol == CORPORATE_PROXY:
+            base = self.get('^TNX')
+            return base + self.corporate_spread if base is not None else None
+
+        with self._lock:
+            cached = self._values.get(symbol)
+            if cached is not None and time.monotonic() - cached[1] < self.ttl:
+                return cached[0]
+            flight = self._flights.get(symbol)
+            leader = flight is None
+            if leader:
+                flight = self._flights[symbol] = _Flight()
+                self.fetch_count += 1
+
+        if not leader:
+            flight.done.wait()
+            return flight.value
+
+        try:
+            value = self.fetch_func(symbol)
+            flight.value = float(value) if value is not None else None
+        except Exception as e:
+            print(f"获取利率 {symbol} 时出错: {e}")
+        finally:
+            with self._lock:
+                if flight.value is not None:
+                    self._values[symbol] = (flight.value, time.monotonic())
+                del self._flights[symbol]
+            flight.done.set()
+        return flight.value
+
+    def snapshot(self):
+        """收益率曲线快照 {代码: 百分比}, 包括公司债近似值"""
+        rates = {symbol: self.get(symbol) for symbol in RATE_SYMBOLS}
+        rates[CORPORATE_PROXY] = self.get(CORPORATE_PROXY)
+        return rates
+
+    def risk_free_rate(self, default=None):
+        """CAPM 使用的无风险利率 (小数); 获取失败时返回 default"""
+        value = self.get(self.risk_free_symbol)
+        return value / 100 if value is not None else default
+
+    def graham_yield(self):
+        """格雷厄姆公式中的债券收益率 Y (百分比)"""
+        return self.get(self.graham_symbol)
+
+    def invalidate(self):
+        with self._lock:
+            self._values.clear()
+
+
+_shared_services = weakref.WeakKeyDictionary()
+_shared_lock = threading.Lock()
+
+
+def shared_rates_service(fetcher):
+    """
+    与 fetcher 对应的共享利率服务; 同一 fetcher 的所有调用者共用一个, 不同的 fetcher (如回放与录制后端) 各有一个。
+    服务只弱引用 fetcher, fetcher 被回收后对应的服务随之释放。
+    """
+    with _shared_lock:
+        service = _shared_services.get(fetcher)
+        if service is None:
+            method = weakref.WeakMethod(fetcher.get_current_yield)
+            service = _shared_services[fetcher] = MarketRatesService(lambda symbol: method()(symbol))
+        return service
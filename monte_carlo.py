@@ -0,0 +1,300 @@
+import argparse
+import json
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+import numpy as np
+
+from valuation_model import StockValuationModel
+
+# 以当前股价的倍数划分直方图区间: [-20x, 20x] 内每 0.5% 一个区间, 超出范围计入两端的溢出桶。
+# 分位数由直方图插值得到, 精度约为股价的 0.5%, 而内存占用与模拟路径数无关。
+_RATIO_EDGES = np.linspace(-20.0, 20.0, 8001)
+_PERCENTILES = (5, 25, 50, 75, 95)
+
+
+class Distribution:
+    """
+    用户指定的参数分布。
+    支持: constant(value), normal(mean, std), lognormal(mean, sigma),
+          uniform(low, high), triangular(left, mode, right)
+    """
+
+    def __init__(self, kind, **params):
+        if kind not in ('constant', 'normal', 'lognormal', 'uniform', 'triangular'):
+            raise ValueError(f"不支持的分布类型: {kind}")
+        self.kind = kind
+        self.params = params
+
+    def sample(self, rng, size):
+        p = self.params
+        if self.kind == 'constant':
+            return np.full(size, float(p['value']))
+        if self.kind == 'normal':
+            return rng.normal(p['mean'], p['std'], size)
+        if self.kind == 'lognormal':
+            return rng.lognormal(p['mean'], p['sigma'], size)
+        if self.kind == 'uniform':
+            return rng.uniform(p['low'], p['high'], size)
+        return rng.triangular(p['left'], p['mode'], p['right'], size)
+
+    def __repr__(self):
+        args = ', '.join(f"{k}={v}" for k, v in self.params.items())
+        return f"Distribution('{self.kind}', {args})"
+
+
+def default_spec(beta, base_growth):
+    """以当前估值假设为中心的默认参数分布"""
+    return {
+        'beta': Distribution('normal', mean=beta, std=0.2),
+        'growth': Distribution('normal', mean=base_growth, std=0.05),
+        'terminal_growth': Distribution('uniform', low=0.015, high=0.035),
+        'cost_of_debt': Distribution('uniform', low=0.045, high=0.065),
+    }
+
+
+class _StreamingHistogram:
+    """按股价倍数分桶的流式直方图, 用于在不保存全部样本的情况下估计分位数"""
+
+    def __init__(self, price):
+        self.price = price
+        self.counts = np.zeros(len(_RATIO_EDGES) + 1, dtype=np.int64)  # 含两端溢出桶
+        self.total = 0
+        self.above_price = 0
+        self.sum = 0.0
+        self.sum_sq = 0.0
+
+    def add(self, values):
+        values = values[np.isfinite(values)]
+        self.counts += np.bincount(np.searchsorted(_RATIO_EDGES, values / self.price),
+                                   minlength=len(self.counts))
+        self.total += len(values)
+        self.above_price += int(np.count_nonzero(values > self.price))
+        self.sum += float(values.sum())
+        self.sum_sq += float(np.square(values).sum())
+
+    def merge(self, other):
+        self.counts += other.counts
+        self.total += other.total
+        self.above_price += other.above_price
+        self.sum += other.sum
+        self.sum_sq += other.sum_sq
+
+    def percentile(self, q):
+        if self.total == 0:
+            return None
+        rank = q / 100 * self.total
+        cumulative = np.cumsum(self.counts)
+        bucket = int(np.searchsorted(cumulative, rank))
+        if bucket == 0:
+            return float(_RATIO_EDGES[0] * self.price)
+        if bucket >= len(_RATIO_EDGES):
+            return float(_RATIO_EDGES[-1] * self.price)
+        lo, hi = _RATIO_EDGES[bucket - 1], _RATIO_EDGES[bucket]
+        before = cumulative[bucket - 1]
+        fraction = (rank - before) / self.counts[bucket] if self.counts[bucket] else 0.0
+        return float((lo + (hi - lo) * fraction) * self.price)
+
+    def summary(self):
+        if self.total == 0:
+            return None
+        mean = self.sum / self.total
+        result = {'mean': mean, 'std': float(np.sqrt(max(self.sum_sq / self.total - mean ** 2, 0.0))),
+                  'valid_paths': self.total, 'prob_above_price': self.above_price / self.total}
+        for q in _PERCENTILES:
+            result[f'p{q}'] = self.percentile(q)
+        return result
+
+
+def _chunk_seed(seed, ticker, chunk_index):
+    """每个 (代码, 块) 使用独立且可复现的随机数流, 结果与进程数和调度顺序无关"""
+    return np.random.SeedSequence(seed, spawn_key=(zlib.crc32(ticker.encode('utf-8')), chunk_index))
+
+
+def _simulate_chunk(task):
+    """
+    在工作进程中模拟一个块的路径。
+    样本写入输出目录中的独立文件, 只把直方图返回给主进程, 以保持主进程内存平稳。
+    """
+    ticker, chunk_index, n_paths, inputs, spec, model_params, seed, years, fade, output_dir = task
+    rng = np.random.default_rng(_chunk_seed(seed, ticker, chunk_index))
+    model = StockValuationModel(**model_params)
+
+    beta = spec['beta'].sample(rng, n_paths)
+    cost_of_debt = spec['cost_of_debt'].sample(rng, n_paths)
+    terminal_growth = spec['terminal_growth'].sample(rng, n_paths)
+    initial_growth = spec['growth'].sample(rng, n_paths)
+    growth_paths = initial_growth[:, None] * (1 - fade * np.arange(years))
+
+    cost_of_equity = model.calculate_cost_of_equity(beta)
+    wacc = model.calculate_wacc(inputs['market_cap'], inputs['total_debt'], cost_of_equity, cost_of_debt)
+    dcf_values = model.dcf_valuation_batch(inputs['current_fcf'], growth_paths, terminal_growth, wacc,
+                                           inputs['shares_outstanding'], inputs['total_debt'],
+                                           inputs['cash_equivalents'])
+    results = {'dcf': dcf_values}
+    if inputs.get('eps') and inputs.get('bond_yield'):
+        results['graham'] = np.asarray(
+            model.benjamin_graham_valuation(inputs['eps'], growth_paths.mean(axis=1) * 100, inputs['bond_yield']),
+            dtype=float)
+
+    histograms = {}
+    for name, values in results.items():
+        if output_dir:
+            np.save(os.path.join(output_dir, ticker, f"{name}_chunk{chunk_index:05d}.npy"), values.astype(np.float32))
+        histogram = _StreamingHistogram(inputs['current_price'])
+        histogram.add(values)
+        histograms[name] = histogram
+    return ticker, histograms
+
+
+class MonteCarloValuation:
+    """
+    蒙特卡洛内在价值模拟。
+    对 Beta、FCF增长路径、永续增长率和债务成本按指定分布抽样，
+    代入 CAPM / WACC / DCF / 格雷厄姆公式，输出每股价值的分位数和 P(价值 > 股价)。
+    路径按块拆分并分发到进程池，每块使用可复现的独立随机数流。
+    """
+
+    def __init__(self, valuation_model=None, n_paths=100_000, chunk_size=50_000, seed=0,
+                 max_workers=None, output_dir=None, years=5, fade=0.1):
+        model = valuation_model or StockValuationModel()
+        self.model_params = {'risk_free_rate': model.risk_free_rate, 'market_return': model.market_return,
+                             'corporate_tax_rate': model.corporate_tax_rate}
+        self.n_paths = n_paths
+        self.chunk_size = chunk_size
+        self.seed = seed
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.output_dir = output_dir
+        self.years = years
+        self.fade = fade
+
+    def simulate_watchlist(self, inputs_by_ticker, specs_by_ticker, on_result=None):
+        """
+        :param inputs_by_ticker: {代码: 估值输入字典}, 字段包括 current_fcf, market_cap, total_debt,
+                                 cash_equivalents, shares_outstanding, current_price, 以及可选的 eps, bond_yield
+        :param specs_by_ticker: {代码: 参数分布字典}, 参见 default_spec
+        :param on_result: 每只股票完成时的回调 on_result(ticker, summary)
+        :return: {代码: 汇总结果}
+        """
+        if self.output_dir:
+            for ticker in inputs_by_ticker:
+                os.makedirs(os.path.join(self.output_dir, ticker), exist_ok=True)
+        tasks = iter(self._tasks(inputs_by_ticker, specs_by_ticker))
+        remaining = {ticker: -(-self.n_paths // self.chunk_size) for ticker in inputs_by_ticker}
+        merged = {ticker: {} for ticker in inputs_by_ticker}
+        summaries = {}
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            # 限制在途任务数量, 避免一次性提交全部块
+            pending = set()
+            for task in tasks:
+                pending.add(executor.submit(_simulate_chunk, task))
+                if len(pending) >= self.max_workers * 2:
+                    break
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    ticker, histograms = future.result()
+                    for name, histogram in histograms.items():
+                        if name in merged[ticker]:
+                            merged[ticker][name].merge(histogram)
+                        else:
+                            merged[ticker][name] = histogram
+                    remaining[ticker] -= 1
+                    if remaining[ticker] == 0:
+                        summaries[ticker] = self._summarize(ticker, inputs_by_ticker[ticker], merged.pop(ticker))
+                        self._write_summary(summaries[ticker])
+                        if on_result:
+                            on_result(ticker, summaries[ticker])
+                    next_task = next(tasks, None)
+                    if next_task is not None:
+                        pending.add(executor.submit(_simulate_chunk, next_task))
+        return summaries
+
+    def _tasks(self, inputs_by_ticker, specs_by_ticker):
+        for ticker, inputs in inputs_by_ticker.items():
+            for chunk_index, start in enumerate(range(0, self.n_paths, self.chunk_size)):
+                n = min(self.chunk_size, self.n_paths - start)
+                yield (ticker, chunk_index, n, inputs, specs_by_ticker[ticker], self.model_params, self.seed,
+                       self.years, self.fade, self.output_dir)
+
+    def _summarize(self, ticker, inputs, histograms):
+        summary = {'ticker': ticker, 'paths': self.n_paths, 'seed': self.seed, 'price': inputs['current_price']}
+        for name, histogram in histograms.items():
+            summary[name] = histogram.summary()
+        return summary
+
+    def _write_summary(self, summary):
+        if not self.output_dir:
+            return
+        with open(os.path.join(self.output_dir, 'summary.jsonl'), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(summary, ensure_ascii=False) + "\n")
+
+
+def format_summary(summary):
+    lines = [f"--- {summary['ticker']} 蒙特卡洛估值 ({summary['paths']:,} 条路径, 当前股价 ${summary['price']:.2f}) ---"]
+    for name, label in (('dcf', 'DCF'), ('graham', '格雷厄姆')):
+        stats = summary.get(name)
+        if not stats:
+            continue
+        percentiles = ', '.join(f"P{q}=${stats[f'p{q}']:.2f}" for q in _PERCENTILES)
+        lines.append(f"  {label}: 均值=${stats['mean']:.2f}, {percentiles}, "
+                     f"P(价值>股价)={stats['prob_above_price']:.1%}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="对关注列表进行蒙特卡洛内在价值模拟")
+    parser.add_argument('tickers', nargs='+')
+    parser.add_argument('--paths', type=int, default=100_000)
+    parser.add_argument('--chunk-size', type=int, default=50_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--out', default=None, help="样本与汇总结果的输出目录")
+    args = parser.parse_args()
+
+    from data_cache import MarketDataCache
+    from data_fetcher import YahooFinanceDataFetcher
+    from http_client import FetchError
+    from data_processor import StockDataProcessor
+    from market_rates import shared_rates_service
+
+    fetcher = YahooFinanceDataFetcher(cache=MarketDataCache())
+    processor = StockDataProcessor()
+    rates = shared_rates_service(fetcher)
+    bond_yield = rates.graham_yield()
+    inputs_by_ticker, specs_by_ticker = {}, {}
+    for ticker in (t.upper() for t in args.tickers):
+        try:
+            info = fetcher.get_company_info(ticker)
+            financials = fetcher.get_financials(ticker)
+            history = fetcher.get_stock_history(ticker, period="5d")
+        except FetchError as e:
+            print(f"警告: 获取 {ticker} 的数据失败 ({e})，跳过。")
+            continue
+        statements = processor.normalize_statements(financials, ticker=ticker)
+        fcf = statements.series('free_cash_flow')
+        inputs = {'current_fcf': statements.latest('free_cash_flow'), 'market_cap': info.get('marketCap'),
+                  'total_debt': statements.latest('total_liabilities'),
+                  'cash_equivalents': statements.latest('cash_and_equivalents'),
+                  'shares_outstanding': info.get('sharesOutstanding'),
+                  'current_price': history['Close'].iloc[-1] if not history.empty else None,
+                  'eps': info.get('trailingEps'), 'bond_yield': bond_yield}
+        missing = [k for k, v in inputs.items() if v is None and k not in ('eps', 'bond_yield')]
+        if missing or info.get('beta') is None:
+            print(f"警告: {ticker} 关键数据不足 ({', '.join(missing) or 'beta'})，跳过。")
+            continue
+        base_growth = max(min(fcf.pct_change().mean(), 0.3), 0.05) if len(fcf) > 1 else 0.15
+        inputs_by_ticker[ticker] = inputs
+        specs_by_ticker[ticker] = default_spec(info['beta'], base_growth)
+
+    model = StockValuationModel(risk_free_rate=rates.risk_free_rate(default=0.04))
+    simulation = MonteCarloValuation(valuation_model=model, n_paths=args.paths, chunk_size=args.chunk_size,
+                                     seed=args.seed, max_workers=args.workers, output_dir=args.out)
+    simulation.simulate_watchlist(inputs_by_ticker, specs_by_ticker,
+                                  on_result=lambda ticker, summary: print(format_summary(summary)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,206 @@
+import os
+import threading
+import time
+
+import numpy as np
+
+# 估值倍数: 结构化结果中的字段名 -> info 中的字段
+MULTIPLES = {'pe': 'trailingPE', 'ps': 'priceToSalesTrailing12Months', 'pb': 'priceToBook'}
+STATISTICS = ('mean', 'median', 'trimmed_mean', 'percentile')
+
+
+def _aggregate(values, statistic, trim=0.1, q=50.0):
+    """对一列倍数做汇总; 只使用有限的正值, 没有有效值时返回 None"""
+    values = values[np.isfinite(values) & (values > 0)]
+    if not len(values):
+        return None
+    if statistic == 'mean':
+        return float(values.mean())
+    if statistic == 'median':
+        return float(np.median(values))
+    if statistic == 'trimmed_mean':
+        values = np.sort(values)
+        cut = int(len(values) * trim)
+        return float(values[cut:len(values) - cut].mean()) if len(values) > 2 * cut else float(values.mean())
+    if statistic == 'percentile':
+        return float(np.percentile(values, q))
+    raise ValueError(f"不支持的统计方法: {statistic} (可选 {', '.join(STATISTICS)})")
+
+
+class PeerMultipleIndex:
+    """
+    全股票池的估值倍数列式索引。
+    每只股票一行: 行业/板块编码、市值、P/E、P/S、P/B 和更新时间都存放在 NumPy 数组中，
+    按行业 (不足时按板块) 自动选择可比公司，中位数、截尾均值、分位数等查询都是对内存数组的切片运算，
+    不再需要为每个竞争对手单独请求 info。
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.tickers = []
+        self._rows = {}
+        self._categories = {'sector': [], 'industry': []}
+        self._category_codes = {'sector': {}, 'industry': {}}
+        self._sector = np.zeros(0, dtype=np.int32)
+        self._industry = np.zeros(0, dtype=np.int32)
+        self._market_cap = np.zeros(0)
+        self._multiples = np.zeros((0, len(MULTIPLES)))
+        self._updated = np.zeros(0)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.tickers)
+
+    def __contains__(self, ticker):
+        return ticker in self._rows
+
+    def _code(self, kind, name):
+        codes = self._category_codes[kind]
+        if name not in codes:
+            codes[name] = len(self._categories[kind])
+            self._categories[kind].append(name)
+        return codes[name]
+
+    def _row(self, ticker):
+        row = self._rows.get(ticker)
+        if row is None:
+            row = len(self.tickers)
+            if row == len(self._updated):
+                # 按倍数扩容
+                capacity = max(64, 2 * row)
+                self._sector = np.resize(self._sector, capacity)
+                self._industry = np.resize(self._industry, capacity)
+                self._market_cap = np.resize(self._market_cap, capacity)
+                self._multiples = np.resize(self._multiples, (capacity, len(MULTIPLES)))
+                self._updated = np.resize(self._updated, capacity)
+            self.tickers.append(ticker)
+            self._rows[ticker] = row
+        return row
+
+    def update(self, ticker, info, updated=None):
+        """用 info 字典写入或覆盖一只股票的行; 空 info 被忽略"""
+        if not info:
+            return
+        with self._lock:
+            row = self._row(ticker)
+            self._sector[row] = self._code('sector', info.get('sector') or "")
+            self._industry[row] = self._code('industry', info.get('industry') or "")
+            self._market_cap[row] = info.get('marketCap') or np.nan
+            self._multiples[row] = [info.get(field) or np.nan for field in MULTIPLES.values()]
+            self._updated[row] = time.time() if updated is None else updated
+
+    def update_many(self, infos_by_ticker):
+        for ticker, info in infos_by_ticker.items():
+            self.update(ticker, info)
+
+    def is_fresh(self, ticker, max_age=24 * 3600):
+        with self._lock:
+            row = self._rows.get(ticker)
+            return row is not None and time.time() - self._updated[row] < max_age
+
+    def stale(self, max_age=24 * 3600):
+        """更新时间早于 max_age 秒前的股票"""
+        with self._lock:
+            n = len(self.tickers)
+            rows = np.flatnonzero(time.time() - self._updated[:n] >= max_age)
+            return [self.tickers[row] for row in rows]
+
+    def refresh(self, fetch_info, max_age=24 * 3600, tickers=None):
+        """重新获取过期股票的 info (fetch_info(代码) -> info), 返回刷新的数量"""
+        tickers = self.stale(max_age) if tickers is None else tickers
+        for ticker in tickers:
+            self.update(ticker, fetch_info(ticker))
+        return len(tickers)
+
+    def peers(self, ticker, min_peers=5, limit=None):
+        """
+        自动选择可比公司: 同一行业的股票, 少于 min_peers 只时改用同一板块。
+        指定 limit 时只保留市值 (对数) 最接近的 limit 只。
+        :return: (可比公司代码列表, 分组名称)
+        """
+        with self._lock:
+            row = self._rows.get(ticker)
+            if row is None:
+                return [], None
+            rows, group = self._peer_rows(row, min_peers)
+            if limit is not None and len(rows) > limit:
+                distance = np.abs(np.log(self._market_cap[rows]) - np.log(self._market_cap[row]))
+                rows = rows[np.argsort(np.where(np.isfinite(distance), distance, np.inf), kind='stable')[:limit]]
+            return [self.tickers[r] for r in rows], group
+
+    def _peer_rows(self, row, min_peers):
+        n = len(self.tickers)
+        others = np.arange(n) != row
+        industry = self._industry[row]
+        if self._categories['industry'][industry]:
+            rows = np.flatnonzero(others & (self._industry[:n] == industry))
+            if len(rows) >= min_peers:
+                return rows, self._categories['industry'][industry]
+        sector = self._sector[row]
+        if self._categories['sector'][sector]:
+            return np.flatnonzero(others & (self._sector[:n] == sector)), self._categories['sector'][sector]
+        return np.zeros(0, dtype=np.int64), None
+
+    def multiples(self, tickers, statistic='median', trim=0.1, q=50.0):
+        """对给定股票的 P/E、P/S、P/B 分别汇总, 返回 {'pe': ..., 'ps': ..., 'pb': ...}"""
+        with self._lock:
+            rows = [self._rows[t] for t in tickers if t in self._rows]
+            values = self._multiples[rows]
+        return {key: _aggregate(values[:, i], statistic, trim, q) for i, key in enumerate(MULTIPLES)}
+
+    def percentile_rank(self, ticker, multiple, peers):
+        """ticker 的某个倍数在可比公司中的百分位 (0-100); 数据不足时返回 None"""
+        column = list(MULTIPLES).index(multiple)
+        with self._lock:
+            if ticker not in self._rows:
+                return None
+            value = self._multiples[self._rows[ticker], column]
+            values = self._multiples[[self._rows[t] for t in peers if t in self._rows], column]
+        values = values[np.isfinite(values) & (values > 0)]
+        if not np.isfinite(value) or not len(values):
+            return None
+        return float((values < value).mean() * 100)
+
+    def save(self, path=None):
+        """原子地写入 .npz 文件"""
+        path = path or self.path
+        with self._lock:
+            n = len(self.tickers)
+            arrays = {
+                'tickers': np.array(self.tickers, dtype=str),
+                'sectors': np.array(self._categories['sector'], dtype=str),
+                'industries': np.array(self._categories['industry'], dtype=str),
+                'sector': self._sector[:n], 'industry': self._industry[:n], 'market_cap': self._market_cap[:n],
+                'multiples': self._multiples[:n], 'updated': self._updated[:n],
+            }
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = path + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """读取索引; 文件不存在或损坏时返回空索引 (之后 save 会写到同一路径)"""
+        index = cls(path)
+        if not os.path.exists(path):
+            return index
+        try:
+            with np.load(path) as data:
+                index.tickers = [str(t) for t in data['tickers']]
+                index._rows = {t: i for i, t in enumerate(index.tickers)}
+                for kind, key in (('sector', 'sectors'), ('industry', 'industries')):
+                    index._categories[kind] = [str(name) for name in data[key]]
+                    index._category_codes[kind] = {name: i for i, name in enumerate(index._categories[kind])}
+                index._sector = data['sector'].astype(np.int32)
+                index._industry = data['industry'].astype(np.int32)
+                index._market_cap = data['market_cap'].astype(float)
+                index._multiples = data['multiples'].astype(float).reshape(-1, len(MULTIPLES))
+                index._updated = data['updated'].astype(float)
+        except Exception as e:
+            print(f"读取可比公司索引 {path} 时出错, 将重新建立: {e}")
+            return cls(path)
+        return index
+
+
+def default_index_path():
+    return os.path.join(os.path.expanduser('~'), '.stock_analysis_cache', 'peer_index.npz')
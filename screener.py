@@ -0,0 +1,199 @@
+import csv
+import json
+import math
+import os
+import shutil
+
+from analysis_pipeline import flatten_valuation
+from data_fetcher import YAHOO_API_HOST
+from http_client import FetchError
+
+# 输出文件的列; 除以下文本列外均为浮点数
+OUTPUT_COLUMNS = [
+    'ticker', 'status', 'error', 'price',
+    'dcf_value', 'dcf_wacc', 'dcf_cost_of_equity', 'dcf_beta', 'dcf_fcf_basis', 'dcf_missing', 'dcf_error',
+    'graham_value', 'graham_eps', 'graham_g', 'graham_bond_yield', 'graham_error',
+    'peer_group', 'peer_count', 'peer_avg_pe', 'peer_avg_ps', 'peer_avg_pb',
+    'relative_pe_value', 'relative_ps_value', 'relative_pb_value', 'relative_error',
+]
+TEXT_COLUMNS = {'ticker', 'status', 'error', 'dcf_fcf_basis', 'dcf_missing', 'dcf_error', 'graham_error',
+                'peer_group', 'relative_error'}
+
+
+def read_universe(path):
+    """
+    读取股票池文件: 每行一个代码，可在空白后附加逗号分隔的竞争对手，# 开头为注释。
+    例如: "NVDA AMD,INTC"
+    """
+    universe = []
+    seen = set()
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            parts = line.split(None, 1)
+            ticker = parts[0].upper()
+            if ticker in seen:
+                continue
+            seen.add(ticker)
+            peers = [p.strip().upper() for p in parts[1].split(',') if p.strip()] if len(parts) > 1 else []
+            universe.append((ticker, peers))
+    return universe
+
+
+def _clean_value(value):
+    """将 NumPy 标量转换为原生类型, NaN/inf 转换为 None"""
+    if value is None or isinstance(value, str):
+        return value
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+class BatchScreener:
+    """
+    无界面的批量估值筛选。
+    复用 GUI 的获取/处理/估值流水线，按批次并发抓取数据，每完成一只股票就把结果追加到检查点文件中，
+    因此中途崩溃后重新运行会跳过已完成的股票，而不是从头开始。
+    """
+
+    def __init__(self, pipeline, scheduler, batch_size=200, period="5y", peer_max_age=24 * 3600):
+        self.pipeline = pipeline
+        self.scheduler = scheduler
+        self.batch_size = batch_size
+        self.period = period
+        # 可比公司索引中不超过该时长的倍数直接使用, 不再请求该竞争对手的 info
+        self.peer_max_age = peer_max_age
+
+    def screen(self, universe, out_path, resume=True, retry_failed=False):
+        """
+        :param universe: [(代码, [竞争对手...]), ...]
+        :param out_path: 输出文件，按扩展名选择格式 (.parquet / .csv / .jsonl)
+        :return: 本次运行处理的股票数量
+        """
+        checkpoint_path = out_path + '.checkpoint.jsonl'
+        completed = self._load_checkpoint(checkpoint_path, retry_failed) if resume else set()
+        if not resume and os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        todo = [(ticker, peers) for ticker, peers in universe if ticker not in completed]
+        print(f"股票池共 {len(universe)} 只, 已完成 {len(universe) - len(todo)} 只, 本次处理 {len(todo)} 只。")
+
+        processed = 0
+        with open(checkpoint_path, 'a', encoding='utf-8') as checkpoint:
+            for start in range(0, len(todo), self.batch_size):
+                batch = dict(todo[start:start + self.batch_size])
+                # 先提交本批中可比公司索引里没有 (或已过期) 的竞争对手的信息请求, 使其与主股票的数据并行获取
+                index = self.pipeline.peer_index
+                peer_futures = {peer: self.scheduler.submit(self.pipeline.fetcher.get_company_info, peer,
+                                                            host=YAHOO_API_HOST)
+                                for peer in dict.fromkeys(p for peers in batch.values() for p in peers)
+                                if not index.is_fresh(peer, self.peer_max_age)}
+                # 本批历史行情通过 yf.download 分组批量获取, 而不是每只股票一个请求
+                for ticker, raw_data in self.scheduler.fetch_stocks(self.pipeline.fetcher, list(batch),
+                                                                    period=self.period, host=YAHOO_API_HOST,
+                                                                    bulk_history=True):
+                    row = self._evaluate(ticker, raw_data, batch[ticker], peer_futures)
+                    checkpoint.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    checkpoint.flush()
+                    processed += 1
+                os.fsync(checkpoint.fileno())
+                if index.path:
+                    index.save()
+                print(f"进度: {len(universe) - len(todo) + processed}/{len(universe)}")
+
+        self._write_output(checkpoint_path, out_path)
+        return processed
+
+    def _evaluate(self, ticker, raw_data, peers, peer_futures):
+        try:
+            errors = raw_data.get('errors') or {}
+            if errors:
+                # 限流/网络故障与"确实没有数据"分开记录, --retry-failed 时会重新处理
+                row = {'ticker': ticker, 'status': 'fetch_error',
+                       'error': "; ".join(f"{name}: {error}" for name, error in errors.items())}
+                return {column: row.get(column) for column in OUTPUT_COLUMNS}
+            data = self.pipeline.process(raw_data, ticker)
+            if not data['info'] or data['history'].empty:
+                row = {'ticker': ticker, 'status': 'no_data', 'error': "无法获取公司信息或历史行情"}
+                return {column: row.get(column) for column in OUTPUT_COLUMNS}
+            peer_infos = [info for info in (self._peer_info(peer_futures[p]) for p in peers if p in peer_futures)
+                          if info]
+            indexed_peers = [p for p in peers if p not in peer_futures and p in self.pipeline.peer_index]
+            row = flatten_valuation(self.pipeline.evaluate(ticker, data, peer_infos, peers=indexed_peers))
+            row.update(status='ok', error=None)
+        except Exception as e:
+            row = {'ticker': ticker, 'status': 'error', 'error': str(e)}
+        return {column: (_clean_value(row.get(column)) if column not in TEXT_COLUMNS else row.get(column))
+                for column in OUTPUT_COLUMNS}
+
+    @staticmethod
+    def _peer_info(future):
+        """竞争对手的信息获取失败时只是少一个可比公司, 不影响主股票的估值"""
+        try:
+            return future.result()
+        except FetchError as e:
+            print(f"获取竞争对手信息时出错: {e}")
+            return None
+
+    def _load_checkpoint(self, checkpoint_path, retry_failed):
+        completed = set()
+        if not os.path.exists(checkpoint_path):
+            return completed
+        for row in self._iter_checkpoint(checkpoint_path):
+            if row['status'] == 'ok' or not retry_failed:
+                completed.add(row['ticker'])
+            else:
+                completed.discard(row['ticker'])
+        return completed
+
+    def _iter_checkpoint(self, checkpoint_path):
+        with open(checkpoint_path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    # 崩溃时可能留下不完整的最后一行, 忽略即可
+                    continue
+
+    def _iter_final_rows(self, checkpoint_path):
+        """同一代码出现多次时 (例如重试失败的股票) 只保留最后一条"""
+        last_index = {}
+        for i, row in enumerate(self._iter_checkpoint(checkpoint_path)):
+            last_index[row['ticker']] = i
+        for i, row in enumerate(self._iter_checkpoint(checkpoint_path)):
+            if last_index[row['ticker']] == i:
+                yield row
+
+    def _write_output(self, checkpoint_path, out_path, row_group_size=10000):
+        extension = os.path.splitext(out_path)[1].lower()
+        if extension == '.jsonl':
+            tmp_path = out_path + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for row in self._iter_final_rows(checkpoint_path):
+                    f.write(json.dumps(row, ensure_ascii=False) + "\n")
+            shutil.move(tmp_path, out_path)
+        elif extension == '.csv':
+            with open(out_path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=OUTPUT_COLUMNS)
+                writer.writeheader()
+                for row in self._iter_final_rows(checkpoint_path):
+                    writer.writerow(row)
+        elif extension == '.parquet':
+            try:
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+            except ImportError:
+                raise RuntimeError("输出 Parquet 文件需要安装 pyarrow，或改用 .csv / .jsonl 输出。")
+            schema = pa.schema([(c, pa.string() if c in TEXT_COLUMNS else pa.float64()) for c in OUTPUT_COLUMNS])
+            with pq.ParquetWriter(out_path, schema) as writer:
+                rows = []
+                for row in self._iter_final_rows(checkpoint_path):
+                    rows.append(row)
+                    if len(rows) >= row_group_size:
+                        writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+                        rows = []
+                if rows:
+                    writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+        else:
+            raise ValueError(f"不支持的输出格式: {extension} (可选 .parquet / .csv / .jsonl)")
+        print(f"结果已写入 {out_path}")
@@ -0,0 +1,179 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# 标准项目: (所在报表, 按优先级排列的别名)。报表名与 get_financials 返回的键一致 (季度报表加 quarterly_ 前缀)
+LINE_ITEMS = {
+    'operating_cash_flow': ('cash_flow', ['Total Cash From Operating Activities', 'Operating Cash Flow']),
+    'capital_expenditure': ('cash_flow', ['Capital Expenditures', 'Capital Expenditure']),
+    'total_liabilities': ('balance_sheet', ['Total Liab', 'Total Liabilities',
+                                            'Total Liabilities Net Minority Interest', 'Total Debt']),
+    'current_liabilities': ('balance_sheet', ['Total Current Liabilities', 'Current Liabilities']),
+    'non_current_liabilities': ('balance_sheet', ['Total Non Current Liabilities',
+                                                  'Total Non Current Liabilities Net Minority Interest']),
+    'cash_and_equivalents': ('balance_sheet', ['Total Cash', 'Cash And Cash Equivalents',
+                                               'Cash Cash Equivalents And Short Term Investments']),
+    'stockholder_equity': ('balance_sheet', ['Total Stockholder Equity', 'Stockholders Equity', 'Total Equity',
+                                             'Common Stock Equity']),
+    'total_revenue': ('income_stmt', ['Total Revenue']),
+    'diluted_eps': ('income_stmt', ['Diluted EPS']),
+}
+
+# 由其他项目相加得到的项目: 项目 -> (组成项目, 是否仅在直接项目缺失时使用)
+COMPUTED_ITEMS = {
+    'free_cash_flow': (('operating_cash_flow', 'capital_expenditure'), False),
+    'total_liabilities': (('current_liabilities', 'non_current_liabilities'), True),
+}
+
+STATEMENTS = ['income_stmt', 'balance_sheet', 'cash_flow']
+ITEMS = list(LINE_ITEMS) + [item for item in COMPUTED_ITEMS if item not in LINE_ITEMS]
+_ITEM_ROWS = {item: row for row, item in enumerate(ITEMS)}
+
+
+class NormalizedStatements:
+    """
+    一只股票标准化后的报表记录。
+    每张报表保存按日期升序排列的日期数组与 (项目数 × 日期数) 的 float64 矩阵，
+    未找到的项目整行为 NaN，sources 记录每个项目来自哪个原始科目 (或由哪些项目计算得到)。
+    """
+
+    __slots__ = ('ticker', 'dates', 'values', 'sources')
+
+    def __init__(self, ticker, dates, values, sources):
+        self.ticker = ticker
+        self.dates = dates
+        self.values = values
+        self.sources = sources
+
+    def has(self, item):
+        return self.sources.get(item) is not None
+
+    def array(self, item):
+        """返回 (日期数组, 数值数组); 项目缺失时两者均为空"""
+        if not self.has(item):
+            return np.array([], dtype='datetime64[ns]'), np.array([], dtype=float)
+        statement = _item_statement(item)
+        return self.dates[statement], self.values[statement][_ITEM_ROWS[item]]
+
+    def series(self, item):
+        """按日期升序排列的 pd.Series; 项目缺失时返回空 Series"""
+        if not self.has(item):
+            return pd.Series(dtype=float)
+        dates, values = self.array(item)
+        return pd.Series(values, index=pd.DatetimeIndex(dates), name=item)
+
+    def latest(self, item):
+        """最近一期的值; 项目缺失时返回 None"""
+        dates, values = self.array(item)
+        return float(values[-1]) if len(values) else None
+
+
+def _item_statement(item):
+    if item in LINE_ITEMS:
+        return LINE_ITEMS[item][0]
+    return LINE_ITEMS[COMPUTED_ITEMS[item][0][0]][0]
+
+
+class StatementNormalizer:
+    """
+    一次遍历解析所有标准项目。
+    构造时把全部别名编译为 {原始科目名: (项目行号, 优先级)} 的索引，
+    解析一张报表时只需遍历一次其行索引并做字典查找; 同一组科目名的解析结果会被缓存，
+    之后用一次 NumPy 取行和一次按日期排序得到整张报表的标准化矩阵。
+    """
+
+    MAX_CACHED_LAYOUTS = 4096
+
+    def __init__(self, line_items=None, computed_items=None):
+        self.line_items = line_items or LINE_ITEMS
+        self.computed_items = computed_items or COMPUTED_ITEMS
+        self._alias_index = {statement: {} for statement in STATEMENTS}
+        for row, item in enumerate(ITEMS):
+            if item not in self.line_items:
+                continue
+            statement, aliases = self.line_items[item]
+            for priority, alias in enumerate(aliases):
+                self._alias_index[statement][alias] = (row, priority)
+        self._layouts = {}
+
+    @tracing.traced('statements', 'process', ticker='ticker')
+    def normalize(self, financials, ticker=None, quarterly=False):
+        """
+        :param financials: get_financials 返回的字典
+        :param quarterly: 为 True 时使用季度报表
+        :return: NormalizedStatements
+        """
+        prefix = 'quarterly_' if quarterly else ''
+        dates, values, sources = {}, {}, {}
+        for statement in STATEMENTS:
+            df = (financials or {}).get(prefix + statement)
+            if df is not None:
+                tracing.count('rows', len(df))
+            dates[statement], values[statement] = self._normalize_statement(statement, df, sources)
+
+        for item, (parts, fallback_only) in self.computed_items.items():
+            if fallback_only and sources.get(item) is not None:
+                continue
+            if all(sources.get(part) is not None for part in parts):
+                statement = _item_statement(item)
+                rows = [_ITEM_ROWS[part] for part in parts]
+                values[statement][_ITEM_ROWS[item]] = values[statement][rows].sum(axis=0)
+                sources[item] = " + ".join(sources[part] for part in parts)
+                logger.debug("statement item computed: ticker=%s item=%s source=%s", ticker, item, sources[item])
+            elif item not in sources:
+                sources[item] = None
+
+        missing = [item for item in ITEMS if sources.get(item) is None]
+        if missing:
+            logger.debug("statement items missing: ticker=%s quarterly=%s items=%s", ticker, quarterly,
+                         ",".join(missing))
+        return NormalizedStatements(ticker, dates, values, sources)
+
+    def _resolve_rows(self, statement, labels):
+        """返回 (标准项目行号, 原始行号, 原始科目名) 列表; 同一组科目名只解析一次"""
+        key = (statement, labels)
+        resolved = self._layouts.get(key)
+        if resolved is not None:
+            return resolved
+        alias_index = self._alias_index[statement]
+        best = {}
+        for position, label in enumerate(labels):
+            match = alias_index.get(label)
+            if match is not None and (match[0] not in best or match[1] < best[match[0]][0]):
+                best[match[0]] = (match[1], position, label)
+        resolved = [(row, position, label) for row, (_, position, label) in best.items()]
+        if len(self._layouts) >= self.MAX_CACHED_LAYOUTS:
+            self._layouts.clear()
+        self._layouts[key] = resolved
+        return resolved
+
+    def _normalize_statement(self, statement, df, sources):
+        if df is None or df.empty:
+            return np.array([], dtype='datetime64[ns]'), np.full((len(ITEMS), 0), np.nan)
+        resolved = self._resolve_rows(statement, tuple(df.index))
+        columns = df.columns
+        dates = (columns if isinstance(columns, pd.DatetimeIndex) else pd.to_datetime(columns)).values
+        order = np.argsort(dates, kind='stable')
+        matrix = np.full((len(ITEMS), len(dates)), np.nan)
+        if resolved:
+            targets = [row for row, _, _ in resolved]
+            positions = [position for _, position, _ in resolved]
+            raw = df.values[positions]
+            if raw.dtype == object:
+                raw = pd.to_numeric(pd.Series(raw.ravel()), errors='coerce').to_numpy(dtype=float).reshape(raw.shape)
+            matrix[targets] = raw
+            matrix = matrix[:, order]
+        for row, _, label in resolved:
+            sources[ITEMS[row]] = label
+        for item, (item_statement, _) in self.line_items.items():
+            if item_statement == statement:
+                sources.setdefault(item, None)
+        return dates[order], matrix
+
+
+default_normalizer = StatementNormalizer()
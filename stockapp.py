@@ -0,0 +1,306 @@
+"""
+无界面的命令行入口。
+
+    python -m stockapp screen universe.txt --out results.parquet
+    python -m stockapp history universe.txt --store ./history_store
+    python -m stockapp record universe.txt --fixtures ./fixtures
+    python -m stockapp screen universe.txt --out results.parquet --replay ./fixtures
+    python -m stockapp serve --port 8765
+    python -m stockapp loadtest --replay ./fixtures --clients 200
+    python -m stockapp backtest universe.txt --store ./history_store
+"""
+import argparse
+import sys
+
+from analysis_pipeline import StockAnalysisPipeline
+from data_cache import MarketDataCache
+from data_fetcher import YahooFinanceDataFetcher
+from data_processor import StockDataProcessor
+from fetch_scheduler import FetchScheduler
+from peer_index import PeerMultipleIndex, STATISTICS, default_index_path
+import tracing
+from valuation_model import StockValuationModel
+
+
+def build_backend(args):
+    """--replay 指定时返回回放录制响应的后端 (此时不使用本地缓存), 否则返回 None 即直接访问 Yahoo"""
+    if not getattr(args, 'replay', None):
+        return None
+    from data_backend import ReplayBackend
+
+    return ReplayBackend(args.replay, latency=args.latency)
+
+
+def build_pipeline(use_cache=True, peer_index_path=None, peer_statistic='mean', backend=None):
+    fetcher = YahooFinanceDataFetcher(cache=MarketDataCache() if use_cache and backend is None else None,
+                                      backend=backend)
+    return StockAnalysisPipeline(fetcher, StockDataProcessor(),
+                                 StockValuationModel(risk_free_rate=0.04, market_return=0.09),
+                                 peer_index=PeerMultipleIndex.load(peer_index_path or default_index_path()),
+                                 peer_statistic=peer_statistic)
+
+
+def run_screen(args):
+    from screener import BatchScreener, read_universe
+
+    pipeline = build_pipeline(use_cache=not args.no_cache, peer_index_path=args.peer_index,
+                              peer_statistic=args.peer_stat, backend=build_backend(args))
+    scheduler = FetchScheduler(max_workers=args.workers, requests_per_second=args.rps)
+    try:
+        screener = BatchScreener(pipeline, scheduler, batch_size=args.batch_size)
+        screener.screen(read_universe(args.universe), args.out, resume=not args.no_resume,
+                        retry_failed=args.retry_failed)
+    finally:
+        scheduler.shutdown()
+    return 0
+
+
+def run_history(args):
+    from history_store import HistoryStore
+    from screener import read_universe
+
+    fetcher = YahooFinanceDataFetcher(cache=MarketDataCache() if not args.no_cache else None)
+    store = HistoryStore.open_or_create(args.store)
+    tickers = [ticker for ticker, _ in read_universe(args.universe)]
+    failed = {}
+    for start in range(0, len(tickers), args.batch_size):
+        histories, errors = fetcher.get_stock_histories(tickers[start:start + args.batch_size], period=args.period)
+        store.write_many(histories)
+        failed.update(errors)
+        print(f"进度: {min(start + args.batch_size, len(tickers))}/{len(tickers)}")
+    for ticker, message in failed.items():
+        print(f"获取 {ticker} 历史数据失败: {message}")
+    print(f"行情存储 {args.store}: {len(store)} 只股票, {len(store.dates)} 个交易日, {store.nbytes() / 1e6:.0f} MB")
+    return 0
+
+
+def run_record(args):
+    """把股票池 (含竞争对手) 的公司信息、日线行情、财务报表和利率录制为回放用的响应文件"""
+    from data_backend import RecordingBackend
+    from data_fetcher import YAHOO_API_HOST
+    from http_client import FetchError
+    from market_rates import RATE_SYMBOLS
+    from screener import read_universe
+
+    fetcher = YahooFinanceDataFetcher(backend=RecordingBackend(args.fixtures))
+    universe = read_universe(args.universe)
+    tickers = list(dict.fromkeys([ticker for ticker, _ in universe] + [p for _, peers in universe for p in peers]))
+    scheduler = FetchScheduler(max_workers=args.workers, requests_per_second=args.rps)
+    failed = 0
+    try:
+        for ticker, raw_data in scheduler.fetch_stocks(fetcher, tickers, period=args.period, host=YAHOO_API_HOST,
+                                                       bulk_history=True):
+            failed += bool(raw_data['errors'])
+        for symbol in RATE_SYMBOLS:
+            try:
+                fetcher.get_current_yield(symbol)
+            except FetchError as e:
+                print(f"获取利率 {symbol} 时出错: {e}")
+    finally:
+        scheduler.shutdown()
+    print(f"已录制 {len(tickers) - failed}/{len(tickers)} 只股票的响应到 {args.fixtures}")
+    return 0
+
+
+def run_serve(args):
+    import asyncio
+    from valuation_service import ValuationService
+
+    pipeline = build_pipeline(use_cache=not args.no_cache, peer_index_path=args.peer_index,
+                              peer_statistic=args.peer_stat, backend=build_backend(args))
+    service = ValuationService(pipeline, workers=args.workers, input_ttl=args.input_ttl)
+    try:
+        asyncio.run(service.serve_forever(args.host, args.port))
+    except KeyboardInterrupt:
+        print("估值服务已停止。")
+    finally:
+        service.shutdown()
+        if pipeline.peer_index.path:
+            pipeline.peer_index.save()
+    return 0
+
+
+def run_loadtest(args):
+    """对运行中的估值服务 (--target) 或在进程内基于回放数据启动的服务 (--replay) 进行压力测试"""
+    import asyncio
+    from valuation_service import ValuationService, format_load_test, load_test
+
+    if not args.target and not args.replay:
+        print("需要 --target 指定运行中的服务, 或 --replay 在进程内启动基于回放数据的服务")
+        return 2
+    if args.universe:
+        from screener import read_universe
+
+        tickers = [ticker for ticker, _ in read_universe(args.universe)]
+    elif args.replay:
+        from data_backend import FixtureStore
+
+        tickers = FixtureStore(args.replay).tickers()
+    else:
+        print("使用 --target 时需要指定股票池文件")
+        return 2
+    if not tickers:
+        print("没有可请求的股票")
+        return 2
+
+    async def run():
+        if args.target:
+            host, _, port = args.target.rpartition(':')
+            return await load_test(host or '127.0.0.1', int(port), tickers, args.clients, args.requests), None
+        pipeline = build_pipeline(peer_statistic=args.peer_stat, backend=build_backend(args))
+        service = ValuationService(pipeline, workers=args.workers, input_ttl=args.input_ttl)
+        try:
+            host, port = await service.start('127.0.0.1', 0)
+            return await load_test(host, port, tickers, args.clients, args.requests), service.stats()
+        finally:
+            await service.stop()
+            service.shutdown()
+
+    summary, service_stats = asyncio.run(run())
+    print(format_load_test(summary))
+    if service_stats:
+        print("服务统计: " + ", ".join(f"{key}={value}" for key, value in sorted(service_stats.items())))
+    return 0 if summary['requests'] else 1
+
+
+def run_backtest(args):
+    """回测 DCF / 格雷厄姆 "估值 > 价格" 信号的远期收益与胜率"""
+    from backtest import ValuationBacktest, load_inputs
+    from http_client import FetchError
+    from screener import read_universe
+
+    backend = build_backend(args)
+    fetcher = YahooFinanceDataFetcher(cache=MarketDataCache() if not args.no_cache and backend is None else None,
+                                      backend=backend)
+    store = None
+    if args.store:
+        from history_store import HistoryStore
+
+        store = HistoryStore(args.store)
+    tickers = [ticker for ticker, _ in read_universe(args.universe)]
+    scheduler = FetchScheduler(max_workers=args.workers, requests_per_second=args.rps)
+    try:
+        closes, financials_by_ticker, shares = load_inputs(fetcher, scheduler, tickers, period=args.period,
+                                                           store=store)
+    finally:
+        scheduler.shutdown()
+    yields = None
+    if args.yields_symbol:
+        try:
+            yields = fetcher.get_stock_history(args.yields_symbol, period=args.period)['Close']
+        except (FetchError, KeyError) as e:
+            print(f"获取 {args.yields_symbol} 历史收益率失败, 使用固定利率: {e}")
+    if closes.empty:
+        print("没有可用的历史行情")
+        return 1
+
+    backtest = ValuationBacktest(StockValuationModel(risk_free_rate=0.04, market_return=0.09),
+                                 horizons=[int(h) for h in args.horizons.split(',')], rebalance=args.rebalance,
+                                 report_lag_days=args.report_lag, processes=args.processes)
+    result = backtest.run(closes, financials_by_ticker, shares, yields=yields)
+    print(result.format_summary(margin=args.margin, events_only=args.events_only))
+    if args.out:
+        frame = result.frame()
+        if args.out.endswith('.parquet'):
+            frame.to_parquet(args.out, index=False)
+        else:
+            frame.to_csv(args.out, index=False)
+        print(f"逐只股票的估值与远期收益已写入 {args.out}")
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='stockapp', description="股票估值工具命令行")
+    parser.add_argument('--trace', metavar='PATH',
+                        help="记录各阶段耗时, 结束时打印汇总并导出 (.jsonl 为 JSON Lines, 其余为 Chrome trace)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    screen = subparsers.add_parser('screen', help="对股票池批量进行 DCF / 格雷厄姆 / 相对估值")
+    screen.add_argument('universe', help="股票池文件, 每行一个代码, 可附加逗号分隔的竞争对手")
+    screen.add_argument('--out', required=True, help="输出文件 (.parquet / .csv / .jsonl)")
+    screen.add_argument('--workers', type=int, default=8, help="并发抓取线程数")
+    screen.add_argument('--rps', type=float, default=5.0, help="每秒最多请求数")
+    screen.add_argument('--batch-size', type=int, default=200, help="每批并发处理的股票数")
+    screen.add_argument('--no-resume', action='store_true', help="忽略检查点, 从头开始")
+    screen.add_argument('--retry-failed', action='store_true', help="断点续跑时重新处理失败的股票")
+    screen.add_argument('--no-cache', action='store_true', help="不使用本地行情缓存")
+    screen.add_argument('--peer-index', help="可比公司倍数索引文件 (默认 ~/.stock_analysis_cache/peer_index.npz)")
+    screen.add_argument('--peer-stat', choices=STATISTICS[:3], default='mean',
+                        help="可比公司倍数的汇总方式; 未指定竞争对手的股票按行业自动选择可比公司")
+    screen.add_argument('--replay', help="离线回放 record 录制的响应目录, 不访问网络")
+    screen.add_argument('--latency', type=float, default=0.0, help="回放时每个请求模拟的网络延迟 (秒)")
+    screen.set_defaults(func=run_screen)
+
+    history = subparsers.add_parser('history', help="把股票池的日线行情写入内存映射的列式存储")
+    history.add_argument('universe', help="股票池文件, 格式同 screen")
+    history.add_argument('--store', required=True, help="存储目录; 已存在时增量更新")
+    history.add_argument('--period', default="5y", help="行情区间")
+    history.add_argument('--batch-size', type=int, default=100, help="每次批量下载并写入的股票数")
+    history.add_argument('--no-cache', action='store_true', help="不使用本地行情缓存")
+    history.set_defaults(func=run_history)
+
+    record = subparsers.add_parser('record', help="录制股票池的真实响应, 供离线回放和性能基准使用")
+    record.add_argument('universe', help="股票池文件, 格式同 screen (竞争对手也会被录制)")
+    record.add_argument('--fixtures', required=True, help="响应文件目录")
+    record.add_argument('--period', default="5y", help="行情区间")
+    record.add_argument('--workers', type=int, default=8, help="并发抓取线程数")
+    record.add_argument('--rps', type=float, default=5.0, help="每秒最多请求数")
+    record.set_defaults(func=run_record)
+
+    serve = subparsers.add_parser('serve', help="启动本地估值 HTTP/JSON 服务 (GET /valuation/<代码>)")
+    serve.add_argument('--host', default='127.0.0.1', help="监听地址")
+    serve.add_argument('--port', type=int, default=8765, help="监听端口")
+    serve.add_argument('--workers', type=int, default=8, help="获取和估值线程数")
+    serve.add_argument('--input-ttl', type=float, default=60.0, help="估值输入视为最新的秒数, 期间重复查询直接返回缓存结果")
+    serve.add_argument('--no-cache', action='store_true', help="不使用本地行情缓存")
+    serve.add_argument('--peer-index', help="可比公司倍数索引文件 (默认 ~/.stock_analysis_cache/peer_index.npz)")
+    serve.add_argument('--peer-stat', choices=STATISTICS[:3], default='mean', help="可比公司倍数的汇总方式")
+    serve.add_argument('--replay', help="离线回放 record 录制的响应目录, 不访问网络")
+    serve.add_argument('--latency', type=float, default=0.0, help="回放时每个请求模拟的网络延迟 (秒)")
+    serve.set_defaults(func=run_serve)
+
+    loadtest = subparsers.add_parser('loadtest', help="对估值服务进行并发压力测试")
+    loadtest.add_argument('universe', nargs='?', help="股票池文件; 省略时使用 --replay 目录中录制的全部股票")
+    loadtest.add_argument('--target', metavar='HOST:PORT', help="运行中的估值服务; 省略时在进程内启动基于回放数据的服务")
+    loadtest.add_argument('--replay', help="回放的响应目录")
+    loadtest.add_argument('--latency', type=float, default=0.0, help="回放时每个请求模拟的网络延迟 (秒)")
+    loadtest.add_argument('--clients', type=int, default=100, help="并发连接数")
+    loadtest.add_argument('--requests', type=int, default=20, help="每个连接发送的请求数")
+    loadtest.add_argument('--workers', type=int, default=8, help="进程内服务的获取和估值线程数")
+    loadtest.add_argument('--input-ttl', type=float, default=60.0, help="进程内服务的估值输入有效期 (秒)")
+    loadtest.add_argument('--peer-stat', choices=STATISTICS[:3], default='mean', help="可比公司倍数的汇总方式")
+    loadtest.set_defaults(func=run_loadtest)
+
+    backtest = subparsers.add_parser('backtest', help="回测 DCF / 格雷厄姆估值信号的远期收益与胜率")
+    backtest.add_argument('universe', help="股票池文件, 格式同 screen")
+    backtest.add_argument('--store', help="history 命令生成的行情存储目录; 省略时下载行情")
+    backtest.add_argument('--period', default="10y", help="行情区间")
+    backtest.add_argument('--horizons', default="21,63,126,252", help="远期收益的持有期 (交易日), 逗号分隔")
+    backtest.add_argument('--rebalance', choices=['D', 'W', 'M', 'Y'], default='M', help="调仓频率")
+    backtest.add_argument('--report-lag', type=int, default=90, help="报表期末日到公开日的天数")
+    backtest.add_argument('--margin', type=float, default=0.0, help="安全边际: 估值超过价格的比例达到该值才发出信号")
+    backtest.add_argument('--events-only', action='store_true', help="只评估每份报表公开后的第一个调仓日")
+    backtest.add_argument('--yields-symbol', default='^TNX', help="历史债券收益率代码; 设为空字符串时使用固定利率")
+    backtest.add_argument('--processes', type=int, default=1, help="按股票分片解析报表的进程数")
+    backtest.add_argument('--out', help="可选, 逐只股票的估值与远期收益输出文件 (.csv / .parquet)")
+    backtest.add_argument('--workers', type=int, default=8, help="并发抓取线程数")
+    backtest.add_argument('--rps', type=float, default=5.0, help="每秒最多请求数")
+    backtest.add_argument('--no-cache', action='store_true', help="不使用本地行情缓存")
+    backtest.add_argument('--replay', help="离线回放 record 录制的响应目录, 不访问网络")
+    backtest.add_argument('--latency', type=float, default=0.0, help="回放时每个请求模拟的网络延迟 (秒)")
+    backtest.set_defaults(func=run_backtest)
+
+    args = parser.parse_args(argv)
+    if not args.trace:
+        return args.func(args)
+    tracing.tracer.enable()
+    try:
+        return args.func(args)
+    finally:
+        print(tracing.tracer.format_summary())
+        tracing.tracer.export(args.trace)
+        print(f"追踪已导出到 {args.trace}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
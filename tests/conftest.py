@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 各模块位于仓库根目录, 与 benchmarks 中的脚本一样把根目录加入导入路径
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,75 @@
+import time
+
+import pandas as pd
+import requests
+
+from data_cache import MarketDataCache
+from data_fetcher import YAHOO_API_HOST, YahooFinanceDataFetcher
+from http_client import FetchError, HttpClient, RateLimitedError
+
+
+def _bars(start, periods):
+    index = pd.bdate_range(start, periods=periods, tz='America/New_York', name='Date')
+    return pd.DataFrame({'Close': range(1, periods + 1), 'Dividends': 0.0, 'Stock Splits': 0.0},
+                        index=index, dtype=float)
+
+
+def _fetcher(cache=None, sleeps=None):
+    http = HttpClient(session=requests.Session(), sleep=(sleeps if sleeps is not None else []).append)
+    return YahooFinanceDataFetcher(cache=cache, http=http)
+
+
+def _scripted(fetcher, rounds):
+    """用预设的 ({代码: DataFrame}, {代码: FetchError}) 序列代替 yf.download, 返回每轮请求的代码列表"""
+    calls = []
+
+    def download_batch(tickers, **kwargs):
+        calls.append(list(tickers))
+        frames, errors = rounds.pop(0)
+        return ({t: df for t, df in frames.items() if t in tickers},
+                {t: e for t, e in errors.items() if t in tickers})
+
+    fetcher._download_batch = download_batch
+    return calls
+
+
+def test_non_retryable_error_survives_retry_round():
+    sleeps = []
+    fetcher = _fetcher(sleeps=sleeps)
+    bars = _bars('2024-01-02', 30)
+    calls = _scripted(fetcher, [
+        ({}, {'GONE': FetchError("未返回任何行情数据", YAHOO_API_HOST),
+              'BUSY': RateLimitedError("HTTP 429", YAHOO_API_HOST, 429, 1.0)}),
+        ({'BUSY': bars}, {}),
+    ])
+    histories, errors = fetcher.get_stock_histories(['GONE', 'BUSY'], period='1mo')
+    assert calls == [['GONE', 'BUSY'], ['BUSY']]
+    assert set(histories) == {'BUSY'}
+    assert set(errors) == {'GONE'} and not errors['GONE'].retryable
+    assert sleeps == [1.0]
+
+
+def test_retryable_error_kept_when_retries_run_out():
+    fetcher = _fetcher()
+    busy = RateLimitedError("HTTP 429", YAHOO_API_HOST, 429, 0.0)
+    _scripted(fetcher, [({}, {'GONE': FetchError("未返回任何行情数据"), 'BUSY': busy}), ({}, {'BUSY': busy})])
+    histories, errors = fetcher.get_stock_histories(['GONE', 'BUSY'], period='1mo', max_retries=1)
+    assert histories == {}
+    assert set(errors) == {'GONE', 'BUSY'}
+
+
+def test_stale_cache_falls_back_for_symbol_with_final_error(tmp_path):
+    cache = MarketDataCache(cache_dir=str(tmp_path))
+    fetcher = _fetcher(cache=cache)
+    saved = _bars('2024-01-02', 40)
+    for ticker in ('GONE', 'BUSY'):
+        cache.set('bars', f"bars|{ticker}|1d", {'bars': saved, 'coverage_start': None, 'checked': time.time() - 1e6})
+    gap = saved.iloc[-2:]
+    _scripted(fetcher, [
+        ({}, {'GONE': FetchError("未返回任何行情数据"), 'BUSY': RateLimitedError("HTTP 429", status=429)}),
+        ({'BUSY': gap}, {}),
+    ])
+    histories, errors = fetcher.get_stock_histories(['GONE', 'BUSY'], period='max')
+    assert set(histories) == {'GONE', 'BUSY'}
+    assert histories['GONE'].index[-1] == saved.index[-1]
+    assert errors == {}
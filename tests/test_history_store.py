@@ -0,0 +1,39 @@
+import numpy as np
+import pandas as pd
+
+from analysis_pipeline import StockAnalysisPipeline
+from data_processor import StockDataProcessor
+from history_store import HistoryStore
+
+
+def _bars(start, periods, freq='B'):
+    index = pd.date_range(start, periods=periods, freq=freq, tz='America/New_York', name='Date')
+    close = np.linspace(10.0, 20.0, periods)
+    return pd.DataFrame({'Open': close, 'High': close + 1, 'Low': close - 1, 'Close': close,
+                         'Volume': np.arange(periods) * 100, 'Dividends': 0.0}, index=index)
+
+
+def _pipeline(store):
+    return StockAnalysisPipeline(None, StockDataProcessor(), None, rates=object(), history_store=store)
+
+
+def test_stored_history_is_view_on_store(tmp_path):
+    store = HistoryStore.create(str(tmp_path))
+    pipeline = _pipeline(store)
+    data = pipeline.process({'info': {'symbol': 'AAPL'}, 'history': _bars('2024-01-02', 80), 'financials': {}})
+    history = data['history']
+    assert list(history.columns) == ['Open', 'High', 'Low', 'Close', 'Volume']
+    assert np.shares_memory(history['Close'].to_numpy(), store.column('AAPL', 'Close'))
+
+    indicators = pipeline.indicators(data)
+    expected = StockDataProcessor().calculate_technical_indicators(_bars('2024-01-02', 80)[['Close']].astype(np.float32))
+    np.testing.assert_allclose(indicators['SMA_50'].to_numpy(), expected['SMA_50'].to_numpy(), rtol=1e-5)
+
+
+def test_frame_skips_dates_of_other_tickers(tmp_path):
+    store = HistoryStore.create(str(tmp_path))
+    store.write('DAILY', _bars('2024-01-01', 14, freq='D'))
+    store.write('WEEKDAY', _bars('2024-01-01', 10))
+    frame = store.frame('WEEKDAY')
+    assert len(frame) == 10 and not frame['Close'].isna().any()
+    assert (frame.index.dayofweek < 5).all()
@@ -0,0 +1,221 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pandas as pd
+import pytest
+import requests
+
+from data_cache import MarketDataCache
+from data_fetcher import YAHOO_API_HOST, YahooFinanceDataFetcher
+from http_client import CircuitBreaker, CircuitOpenError, EmptyResponseError, HTTPStatusError, HttpClient, \
+    NetworkError, RateLimitedError
+
+
+class _StubServer:
+    """本地桩服务器: 按顺序返回预设的 (状态码, 响应头, JSON) 响应, 用完后一律返回 200"""
+
+    def __init__(self):
+        self.responses = []
+        self.hits = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                stub.hits += 1
+                status, headers, body = stub.responses.pop(0) if stub.responses else (200, {}, {'quotes': []})
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.host = f"127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def stub():
+    server = _StubServer()
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def clock():
+    return _Clock()
+
+
+def _client(clock, sleeps, **kwargs):
+    kwargs.setdefault('max_retries', 3)
+    return HttpClient(session=requests.Session(), timeout=(2.0, 5.0), sleep=sleeps.append, clock=clock, **kwargs)
+
+
+def test_retry_after_is_honoured(stub, clock):
+    sleeps = []
+    client = _client(clock, sleeps)
+    stub.responses = [(429, {'Retry-After': '2'}, {}), (200, {}, {'ok': True})]
+    assert client.get_json(f"{stub.url}/v1/finance/search") == {'ok': True}
+    assert sleeps == [2.0]
+    assert stub.hits == 2
+    assert client.stats()['retries'] == 1
+
+
+def test_retry_after_longer_than_backoff_max_gives_up(stub, clock):
+    sleeps = []
+    client = _client(clock, sleeps, backoff_max=5.0)
+    stub.responses = [(429, {'Retry-After': '60'}, {})]
+    with pytest.raises(RateLimitedError) as info:
+        client.get_json(stub.url)
+    assert info.value.retry_after == 60.0
+    assert sleeps == []
+
+
+def test_server_errors_back_off_with_jitter(stub, clock):
+    sleeps = []
+    client = _client(clock, sleeps, backoff_base=0.5)
+    stub.responses = [(503, {}, {}), (502, {}, {}), (500, {}, {}), (200, {}, {'ok': True})]
+    assert client.get_json(stub.url) == {'ok': True}
+    assert len(sleeps) == 3
+    for attempt, delay in enumerate(sleeps):
+        assert 0 <= delay <= 0.5 * 2 ** attempt
+
+
+def test_client_errors_are_not_retried(stub, clock):
+    sleeps = []
+    client = _client(clock, sleeps)
+    stub.responses = [(404, {}, {})]
+    with pytest.raises(HTTPStatusError) as info:
+        client.get_json(stub.url)
+    assert info.value.status == 404 and not info.value.retryable
+    assert sleeps == [] and stub.hits == 1
+    assert client.breaker(stub.host).state == CircuitBreaker.CLOSED
+
+
+def test_breaker_opens_then_half_open_probe_closes_it(stub, clock):
+    sleeps = []
+    client = _client(clock, sleeps, max_retries=0, failure_threshold=2, reset_timeout=30.0)
+    stub.responses = [(503, {}, {}), (503, {}, {})]
+    for _ in range(2):
+        with pytest.raises(HTTPStatusError):
+            client.get_json(stub.url)
+    breaker = client.breaker(stub.host)
+    assert breaker.state == CircuitBreaker.OPEN
+
+    # 打开期间请求不发出
+    with pytest.raises(CircuitOpenError) as info:
+        client.get_json(stub.url)
+    assert stub.hits == 2
+    assert info.value.retry_after == pytest.approx(30.0)
+
+    # reset_timeout 之后只放行一个探测请求, 成功则关闭
+    clock.now = 31.0
+    assert client.get_json(stub.url) == {'quotes': []}
+    assert stub.hits == 3
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_failed_half_open_probe_reopens_breaker(stub, clock):
+    sleeps = []
+    client = _client(clock, sleeps, max_retries=0, failure_threshold=1, reset_timeout=10.0)
+    stub.responses = [(503, {}, {}), (503, {}, {})]
+    with pytest.raises(HTTPStatusError):
+        client.get_json(stub.url)
+    clock.now = 11.0
+    with pytest.raises(HTTPStatusError):
+        client.get_json(stub.url)
+    breaker = client.breaker(stub.host)
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenError):
+        client.get_json(stub.url)
+    assert stub.hits == 2
+
+
+def test_search_ticker_retries_through_stub(stub, clock):
+    sleeps = []
+    fetcher = YahooFinanceDataFetcher(http=_client(clock, sleeps), search_url=stub.url)
+    stub.responses = [(429, {'Retry-After': '1'}, {}), (200, {}, {'quotes': [{'symbol': 'AAPL'}]})]
+    assert fetcher.search_ticker('Apple') == 'AAPL'
+    assert sleeps == [1.0]
+
+
+def _swallowing_call(client, url):
+    """模拟 yfinance: 经由会话发请求, 失败时吞掉真实错误, 抛出无关异常或返回空结果"""
+    def history():
+        try:
+            client.session.get(url, timeout=5)
+        except requests.RequestException:
+            pass
+        raise TypeError("argument of type 'NoneType' is not iterable")
+
+    def statement():
+        client.session.get(url, timeout=5)
+        return pd.DataFrame()
+
+    return history, statement
+
+
+def test_swallowed_errors_are_classified_from_session(stub, clock):
+    sleeps = []
+    client = _client(clock, sleeps, max_retries=1)
+    history, statement = _swallowing_call(client, stub.url)
+
+    stub.responses = [(503, {}, {}), (429, {'Retry-After': '3'}, {})]
+    with pytest.raises(RateLimitedError) as info:
+        client.call(YAHOO_API_HOST, history)
+    # 第一次 503 按抖动退避重试, 第二次 429 用尽重试次数, 抛出的错误带有服务器给出的等待时间
+    assert info.value.retry_after == 3.0
+    assert len(sleeps) == 1
+
+    stub.responses = [(503, {}, {}), (503, {}, {})]
+    with pytest.raises(HTTPStatusError) as info:
+        client.call(YAHOO_API_HOST, statement)
+    assert info.value.status == 503
+
+    # 没有网络错误时空结果照常返回
+    assert client.call(YAHOO_API_HOST, statement).empty
+
+
+def test_connection_failure_is_network_error(clock):
+    sleeps = []
+    client = _client(clock, sleeps, max_retries=1)
+    history, _ = _swallowing_call(client, 'http://127.0.0.1:9/')
+    with pytest.raises(NetworkError):
+        client.call(YAHOO_API_HOST, history)
+    assert len(sleeps) == 1
+
+
+class _EmptyStatements:
+    def __getattr__(self, name):
+        return pd.DataFrame()
+
+
+def test_all_empty_statements_raise_and_are_not_cached(tmp_path, clock):
+    cache = MarketDataCache(cache_dir=str(tmp_path))
+    fetcher = YahooFinanceDataFetcher(cache=cache, http=_client(clock, []))
+    fetcher._tickers['ETF'] = _EmptyStatements()
+    with pytest.raises(EmptyResponseError) as info:
+        fetcher.get_financials('ETF')
+    assert info.value.retryable
+    assert cache.get('statements', 'financials|ETF') is None
@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_processor import IncrementalIndicatorEngine, IncrementalIndicatorState, StockDataProcessor
+
+COLUMNS = ['SMA_20', 'SMA_50', 'RSI_14', 'BB_Mid', 'BB_Upper', 'BB_Lower']
+
+
+def _random_closes(rng, n):
+    """随机游走的收盘价, 其中夹杂一段价格不变的K线 (方差为0、RSI 无涨跌的边界情况)"""
+    closes = 50 * np.exp(np.cumsum(rng.normal(0, rng.uniform(0.005, 0.05), n)))
+    if n > 40:
+        start = int(rng.integers(0, n - 30))
+        closes[start:start + int(rng.integers(15, 30))] = closes[start]
+    return closes
+
+
+def _assert_matches(rows, closes):
+    batch = StockDataProcessor().calculate_technical_indicators(pd.DataFrame({'Close': closes}))
+    incremental = pd.DataFrame(rows, columns=COLUMNS)
+    for column in COLUMNS:
+        np.testing.assert_allclose(incremental[column].to_numpy(), batch[column].to_numpy(),
+                                   rtol=1e-7, atol=1e-6, equal_nan=True, err_msg=column)
+
+
+@pytest.mark.parametrize('seed', range(25))
+def test_bar_by_bar_matches_batch(seed):
+    rng = np.random.default_rng(seed)
+    closes = _random_closes(rng, int(rng.integers(1, 400)))
+    state = IncrementalIndicatorState()
+    _assert_matches([state.update(close) for close in closes], closes)
+
+
+@pytest.mark.parametrize('seed', range(10))
+def test_save_load_round_trip_midway(seed, tmp_path):
+    rng = np.random.default_rng(1000 + seed)
+    closes = _random_closes(rng, int(rng.integers(60, 400)))
+    split = int(rng.integers(1, len(closes)))
+    path = tmp_path / 'indicator_state.json'
+
+    engine = IncrementalIndicatorEngine()
+    rows = [engine.update('TEST', close) for close in closes[:split]]
+    engine.save(str(path))
+    engine = IncrementalIndicatorEngine.load(str(path))
+    rows += [engine.update('TEST', close) for close in closes[split:]]
+    _assert_matches(rows, closes)
+
+
+def test_long_run_resync_keeps_precision():
+    rng = np.random.default_rng(7)
+    closes = 1e4 + np.cumsum(rng.normal(0, 5, 3 * IncrementalIndicatorState.RESYNC_INTERVAL + 17))
+    state = IncrementalIndicatorState()
+    _assert_matches([state.update(close) for close in closes], closes)
@@ -0,0 +1,32 @@
+import gc
+
+from market_rates import _shared_services, shared_rates_service
+
+
+class _Fetcher:
+    def __init__(self, value):
+        self.value = value
+        self.calls = 0
+
+    def get_current_yield(self, symbol):
+        self.calls += 1
+        return self.value
+
+
+def test_each_fetcher_gets_its_own_shared_service():
+    recording, replay = _Fetcher(4.5), _Fetcher(3.0)
+    assert shared_rates_service(recording) is shared_rates_service(recording)
+    assert shared_rates_service(replay) is not shared_rates_service(recording)
+    assert shared_rates_service(recording).graham_yield() == 4.5
+    assert shared_rates_service(replay).graham_yield() == 3.0
+    assert shared_rates_service(replay).graham_yield() == 3.0
+    assert (recording.calls, replay.calls) == (1, 1)
+
+
+def test_service_is_released_with_its_fetcher():
+    fetcher = _Fetcher(4.0)
+    shared_rates_service(fetcher)
+    count = len(_shared_services)
+    del fetcher
+    gc.collect()
+    assert len(_shared_services) == count - 1
@@ -0,0 +1,50 @@
+import pandas as pd
+import pytest
+
+import tracing
+from data_processor import StockDataProcessor
+from statement_normalizer import default_normalizer
+
+
+@pytest.fixture
+def tracer():
+    tracing.tracer.clear()
+    tracing.tracer.enable()
+    yield tracing.tracer
+    tracing.tracer.disable()
+    tracing.tracer.clear()
+
+
+@tracing.traced('double', 'test', ticker='code', measure=True)
+def _double(frame, code=None):
+    return frame * 2
+
+
+def test_traced_records_ticker_argument_and_size(tracer):
+    frame = pd.DataFrame({'Close': [1.0, 2.0, 3.0]})
+    assert _double(frame, code='AAPL').equals(frame * 2)
+    [span] = tracer.spans()
+    assert (span.name, span.category, span.ticker) == ('double', 'test', 'AAPL')
+    assert span.attrs['rows'] == 3
+
+
+def test_traced_inherits_ticker_from_enclosing_span(tracer):
+    with tracing.span('outer', 'test', ticker='MSFT'):
+        _double(pd.DataFrame({'Close': [1.0]}))
+        StockDataProcessor().calculate_free_cash_flow(pd.DataFrame())
+    tickers = {span.name: span.ticker for span in tracer.spans()}
+    assert tickers == {'double': 'MSFT', 'statements': 'MSFT', 'outer': 'MSFT'}
+
+
+def test_indicators_span_carries_ticker(tracer):
+    StockDataProcessor().calculate_technical_indicators(pd.DataFrame({'Close': range(60)}, dtype=float),
+                                                        ticker='NVDA')
+    [span] = tracer.spans()
+    assert (span.name, span.ticker, span.attrs['rows']) == ('indicators', 'NVDA', 60)
+
+
+def test_traced_is_transparent_when_disabled():
+    tracing.tracer.clear()
+    assert not tracing.tracer.enabled
+    assert default_normalizer.normalize({}, ticker='AAPL').ticker == 'AAPL'
+    assert tracing.tracer.spans() == []
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+from statement_normalizer import default_normalizer
+from ttm_engine import TTMEngine
+
+
+def _quarterly(n_quarters, missing_cash_flow_for=None):
+    """最近 n_quarters 个季度的季度报表 (列为报告期, 最新在前, 与 yfinance 一致)"""
+    dates = pd.date_range('2022-03-31', periods=n_quarters, freq='QE')[::-1]
+    base = np.arange(n_quarters, 0, -1, dtype=float)
+    income = pd.DataFrame([base * 100, base * 0.5], index=['Total Revenue', 'Diluted EPS'], columns=dates)
+    balance = pd.DataFrame([base * 40, base * 7, base * 30],
+                           index=['Total Liabilities Net Minority Interest', 'Cash And Cash Equivalents',
+                                  'Stockholders Equity'], columns=dates)
+    cash_flow = pd.DataFrame([base * 20, -base * 5], index=['Operating Cash Flow', 'Capital Expenditure'],
+                             columns=dates)
+    if missing_cash_flow_for is not None:
+        cash_flow = cash_flow.drop(columns=dates[missing_cash_flow_for])
+    financials = {'quarterly_income_stmt': income, 'quarterly_balance_sheet': balance,
+                  'quarterly_cash_flow': cash_flow}
+    return default_normalizer.normalize(financials, quarterly=True)
+
+
+def _full_load(statements):
+    engine = TTMEngine()
+    engine.load('AAPL', statements)
+    return engine.values('AAPL')
+
+
+def test_one_new_quarter_is_added_and_matches_full_load():
+    engine = TTMEngine()
+    assert engine.update('AAPL', _quarterly(5)) == 'loaded'
+    assert engine.update('AAPL', _quarterly(6)) == 'added'
+    assert engine.values('AAPL') == _full_load(_quarterly(6))
+
+
+def test_partial_window_grows_by_one_quarter():
+    engine = TTMEngine()
+    engine.update('AAPL', _quarterly(2))
+    assert engine.update('AAPL', _quarterly(3)) == 'added'
+    assert engine.values('AAPL') == _full_load(_quarterly(3))
+
+
+def test_missing_item_in_new_quarter_matches_full_load():
+    engine = TTMEngine()
+    engine.update('AAPL', _quarterly(5))
+    new = _quarterly(6, missing_cash_flow_for=0)
+    assert engine.update('AAPL', new) == 'added'
+    assert engine.values('AAPL') == _full_load(new)
+    assert engine.values('AAPL')['free_cash_flow'] is None
+
+
+def test_other_changes_reload():
+    engine = TTMEngine()
+    engine.update('AAPL', _quarterly(5))
+    assert engine.update('AAPL', _quarterly(5)) == 'loaded'
+    assert engine.update('AAPL', _quarterly(7)) == 'loaded'
+    assert engine.values('AAPL') == _full_load(_quarterly(7))
@@ -0,0 +1,99 @@
+import asyncio
+import threading
+
+import pytest
+
+from valuation_service import NoDataError, ValuationService
+
+
+class _BlockingService(ValuationService):
+    """_valuate 阻塞到 release 被设置, 用于在计算进行中发出和取消请求"""
+
+    def __init__(self, error=None):
+        super().__init__(pipeline=None, workers=2)
+        self.release = threading.Event()
+        self.calls = 0
+        self.error = error
+
+    def _valuate(self, ticker, peers):
+        self.calls += 1
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return f"fp-{ticker}", f"body-{ticker}".encode(), 'computed'
+
+
+async def _until(condition):
+    for _ in range(200):
+        if condition():
+            return
+        await asyncio.sleep(0.005)
+    raise AssertionError("等待超时")
+
+
+def _run(coro):
+    return asyncio.run(asyncio.wait_for(coro, 10))
+
+
+def test_cancelled_leader_does_not_strand_waiters():
+    service = _BlockingService()
+
+    async def scenario():
+        leader = asyncio.ensure_future(service.valuation('AAPL'))
+        await _until(lambda: service.calls == 1)
+        waiter = asyncio.ensure_future(service.valuation('AAPL'))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        service.release.set()
+        return await waiter
+
+    try:
+        assert _run(scenario()) == (b'body-AAPL', 'coalesced')
+        assert service.calls == 1
+        assert service.counts['computed'] == 1 and service.counts['coalesced'] == 1
+        assert service._inflight == {}
+    finally:
+        service.shutdown()
+
+
+def test_request_after_cancelled_leader_joins_running_computation():
+    service = _BlockingService()
+
+    async def scenario():
+        leader = asyncio.ensure_future(service.valuation('MSFT'))
+        await _until(lambda: service.calls == 1)
+        leader.cancel()
+        await asyncio.sleep(0)
+        follower = asyncio.ensure_future(service.valuation('MSFT'))
+        await asyncio.sleep(0)
+        service.release.set()
+        return await follower
+
+    try:
+        assert _run(scenario()) == (b'body-MSFT', 'coalesced')
+        assert service.calls == 1
+        assert service._inflight == {}
+    finally:
+        service.shutdown()
+
+
+def test_errors_reach_every_waiter_and_clear_flight():
+    service = _BlockingService(error=NoDataError("没有数据"))
+
+    async def scenario():
+        first = asyncio.ensure_future(service.valuation('ZZZZ'))
+        await _until(lambda: service.calls == 1)
+        second = asyncio.ensure_future(service.valuation('ZZZZ'))
+        await asyncio.sleep(0)
+        service.release.set()
+        return await asyncio.gather(first, second, return_exceptions=True)
+
+    try:
+        results = _run(scenario())
+        assert all(isinstance(result, NoDataError) for result in results)
+        assert service.counts['errors'] == 1
+        assert service._inflight == {}
+    finally:
+        service.shutdown()
@@ -0,0 +1,264 @@
+import functools
+import inspect
+import json
+import os
+import threading
+import time
+
+# 环境变量 STOCKAPP_TRACE 非空时在导入时即启用追踪
+TRACE_ENV = 'STOCKAPP_TRACE'
+
+
+class _NullSpan:
+    """追踪关闭时返回的空 span: 所有操作都是空操作, 不分配任何对象"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attrs):
+        pass
+
+    def add(self, key, amount=1):
+        pass
+
+    def measure(self, value):
+        return value
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Span:
+    """
+    一段计时: 名称、类别 (fetch / process / value / render 等)、股票代码和附加属性。
+    attrs 中的数值 (rows、bytes、cache_hits、retries ...) 在汇总时按名称求和。
+    """
+
+    __slots__ = ('tracer', 'name', 'category', 'ticker', 'attrs', 'start', 'duration', 'thread', 'error')
+
+    def __init__(self, tracer, name, category, ticker, attrs):
+        self.tracer = tracer
+        self.name = name
+        self.category = category
+        self.ticker = ticker
+        self.attrs = attrs
+        self.start = 0.0
+        self.duration = 0.0
+        self.thread = threading.get_ident()
+        self.error = None
+
+    def __enter__(self):
+        self.tracer._push(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        self.tracer._pop(self)
+        return False
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def add(self, key, amount=1):
+        self.attrs[key] = self.attrs.get(key, 0) + amount
+
+    def measure(self, value):
+        """把结果的行数与字节数 (DataFrame, 或由 DataFrame 组成的字典) 计入 rows / bytes, 原样返回结果"""
+        frames = value.values() if isinstance(value, dict) else [value]
+        for frame in frames:
+            if hasattr(frame, 'memory_usage'):
+                rows, size = frame_size(frame)
+                self.add('rows', rows)
+                self.add('bytes', size)
+        if isinstance(value, dict) and not any(hasattr(v, 'memory_usage') for v in value.values()):
+            self.add('rows', 1 if value else 0)
+        return value
+
+    def to_dict(self, origin=0.0):
+        record = {'name': self.name, 'category': self.category, 'ticker': self.ticker,
+                  'start_ms': (self.start - origin) * 1000, 'duration_ms': self.duration * 1000,
+                  'thread': self.thread}
+        if self.error:
+            record['error'] = self.error
+        record.update(self.attrs)
+        return record
+
+
+class Tracer:
+    """
+    进程内的轻量追踪器。
+    span() 在关闭时返回共享的 NULL_SPAN, 开销只是一次属性判断; 开启时记录每个 span 的起止时间与属性，
+    count() 把计数 (缓存命中、重试等) 累加到当前线程最内层的 span 上。
+    结果可导出为 JSON Lines 或 Chrome trace (chrome://tracing / Perfetto), 也可按 (类别, 名称) 汇总。
+    """
+
+    def __init__(self, enabled=False, max_spans=200000):
+        self.enabled = enabled
+        self.max_spans = max_spans
+        self._spans = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._origin = time.perf_counter()
+        self.dropped = 0
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def clear(self):
+        with self._lock:
+            self._spans = []
+            self.dropped = 0
+            self._origin = time.perf_counter()
+
+    def span(self, name, category='', ticker=None, **attrs):
+        """with tracer.span('indicators', 'process', ticker='AAPL', rows=n) as span: ..."""
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self, name, category, ticker, attrs)
+
+    def count(self, key, amount=1):
+        """给当前线程正在进行的最内层 span 的计数加 amount (没有进行中的 span 时忽略)"""
+        if not self.enabled:
+            return
+        stack = getattr(self._local, 'stack', None)
+        if stack:
+            stack[-1].add(key, amount)
+
+    def current(self):
+        stack = getattr(self._local, 'stack', None) if self.enabled else None
+        return stack[-1] if stack else NULL_SPAN
+
+    def _push(self, span):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        stack.append(span)
+
+    def _pop(self, span):
+        stack = self._local.stack
+        if stack and stack[-1] is span:
+            stack.pop()
+        with self._lock:
+            if len(self._spans) < self.max_spans:
+                self._spans.append(span)
+            else:
+                self.dropped += 1
+
+    def spans(self):
+        with self._lock:
+            return list(self._spans)
+
+    def summary(self):
+        """按 (类别, 名称) 汇总: 次数、总耗时、平均、最大 (毫秒) 以及各数值属性之和, 按总耗时降序"""
+        groups = {}
+        for span in self.spans():
+            group = groups.setdefault((span.category, span.name),
+                                      {'category': span.category, 'name': span.name, 'count': 0, 'errors': 0,
+                                       'total_ms': 0.0, 'max_ms': 0.0, 'tickers': set(), 'totals': {}})
+            duration = span.duration * 1000
+            group['count'] += 1
+            group['errors'] += span.error is not None
+            group['total_ms'] += duration
+            group['max_ms'] = max(group['max_ms'], duration)
+            if span.ticker:
+                group['tickers'].add(span.ticker)
+            for key, value in span.attrs.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    group['totals'][key] = group['totals'].get(key, 0) + value
+        rows = sorted(groups.values(), key=lambda g: g['total_ms'], reverse=True)
+        for row in rows:
+            row['mean_ms'] = row['total_ms'] / row['count']
+            row['tickers'] = len(row['tickers'])
+        return rows
+
+    def format_summary(self):
+        rows = self.summary()
+        if not rows:
+            return "没有追踪数据 (追踪未启用或尚未运行分析)。"
+        lines = [f"{'类别':<8} {'名称':<28} {'次数':>6} {'总计ms':>10} {'平均ms':>9} {'最大ms':>9}  计数"]
+        for row in rows:
+            totals = ", ".join(f"{key}={value:,.0f}" for key, value in sorted(row['totals'].items()))
+            lines.append(f"{row['category']:<8} {row['name']:<28} {row['count']:>6} {row['total_ms']:>10.1f} "
+                         f"{row['mean_ms']:>9.1f} {row['max_ms']:>9.1f}  {totals}")
+        if self.dropped:
+            lines.append(f"(超过 {self.max_spans} 个 span, 另有 {self.dropped} 个未记录)")
+        return "\n".join(lines)
+
+    def export_jsonl(self, path):
+        """每行一个 span; 时间相对于追踪开始 (或上次 clear) 的毫秒数"""
+        with open(path, 'w', encoding='utf-8') as f:
+            for span in self.spans():
+                f.write(json.dumps(span.to_dict(self._origin), ensure_ascii=False, default=str) + "\n")
+
+    def export_chrome(self, path):
+        """Chrome trace 格式 (完整事件 ph='X', 微秒), 可在 chrome://tracing 或 Perfetto 中打开"""
+        pid = os.getpid()
+        events = []
+        for span in self.spans():
+            args = dict(span.attrs)
+            if span.ticker:
+                args['ticker'] = span.ticker
+            if span.error:
+                args['error'] = span.error
+            name = f"{span.name} {span.ticker}" if span.ticker else span.name
+            events.append({'name': name, 'cat': span.category, 'ph': 'X', 'pid': pid, 'tid': span.thread,
+                           'ts': (span.start - self._origin) * 1e6, 'dur': span.duration * 1e6, 'args': args})
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False, default=str)
+
+    def export(self, path):
+        """按扩展名选择格式: .jsonl 为 JSON Lines, 其余为 Chrome trace"""
+        if path.endswith('.jsonl'):
+            self.export_jsonl(path)
+        else:
+            self.export_chrome(path)
+
+
+def frame_size(df):
+    """DataFrame 的 (行数, 字节数), 用作 span 的 rows / bytes 属性"""
+    if df is None:
+        return 0, 0
+    return len(df), int(df.memory_usage(index=True, deep=False).sum())
+
+
+tracer = Tracer(enabled=bool(os.environ.get(TRACE_ENV)))
+span = tracer.span
+count = tracer.count
+
+
+def traced(name, category='', ticker=None, measure=False):
+    """
+    装饰器形式的 span, 函数体无需缩进到 with 语句之下:
+
+        @tracing.traced('indicators', 'process', ticker='ticker', measure=True)
+        def calculate_technical_indicators(self, hist_df, ticker=None): ...
+
+    ticker 为参数名, 取该参数的值作为 span 的股票代码; 值为空时沿用外层 span 的代码。
+    measure 为 True 时把返回值的行数与字节数计入 rows / bytes。追踪关闭时只多一次属性判断。
+    """
+    def decorate(func):
+        signature = inspect.signature(func) if ticker else None
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not tracer.enabled:
+                return func(*args, **kwargs)
+            code = signature.bind(*args, **kwargs).arguments.get(ticker) if ticker else None
+            with tracer.span(name, category, ticker=code or getattr(tracer.current(), 'ticker', None)) as span:
+                result = func(*args, **kwargs)
+                return span.measure(result) if measure else result
+
+        return wrapper
+
+    return decorate
@@ -0,0 +1,150 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+# 流量项目取最近4个季度之和, 存量项目取最近一个季度末的值
+FLOW_ITEMS = ['free_cash_flow', 'operating_cash_flow', 'capital_expenditure', 'total_revenue', 'diluted_eps']
+STOCK_ITEMS = ['total_liabilities', 'cash_and_equivalents', 'stockholder_equity']
+TTM_ITEMS = FLOW_ITEMS + STOCK_ITEMS
+WINDOW = 4
+
+
+def _compute(window_values):
+    """
+    对 (股票数 × 项目数 × 4) 的季度窗口做向量化计算。
+    流量项目: 4个季度之和, 任一季度缺失则为 NaN; 存量项目: 窗口内最近一个非空值。
+    """
+    n_flows = len(FLOW_ITEMS)
+    flows = window_values[:, :n_flows, :].sum(axis=2)
+    stocks = window_values[:, n_flows:, :]
+    valid = ~np.isnan(stocks)
+    latest = WINDOW - 1 - np.argmax(valid[:, :, ::-1], axis=2)
+    stocks = np.take_along_axis(stocks, latest[:, :, None], axis=2)[:, :, 0]
+    stocks[~valid.any(axis=2)] = np.nan
+    return np.concatenate([flows, stocks], axis=1)
+
+
+def _quarters(statements):
+    """三张季度报表报告期的并集中最近的 WINDOW 个, 按日期升序"""
+    all_dates = [dates for dates in statements.dates.values() if len(dates)]
+    if not all_dates:
+        return np.array([], dtype='datetime64[ns]')
+    return np.unique(np.concatenate(all_dates))[-WINDOW:]
+
+
+def _window(statements, quarters):
+    """(项目数 × 季度数) 的数值; 某张报表缺少某一季度时该季度对应项目为 NaN"""
+    window = np.full((len(TTM_ITEMS), len(quarters)), np.nan)
+    for i, item in enumerate(TTM_ITEMS):
+        dates, values = statements.array(item)
+        if not len(dates):
+            continue
+        positions = np.searchsorted(dates, quarters)
+        found = positions < len(dates)
+        found[found] = dates[positions[found]] == quarters[found]
+        window[i][found] = values[positions[found]]
+    return window
+
+
+class TTMEngine:
+    """
+    滚动12个月 (TTM) 基本面引擎, 使用 get_financials 已经下载的季度报表, 不产生额外的网络请求。
+    所有股票最近4个季度的数据保存在一个 (股票数 × 项目数 × 4) 的数组中;
+    已加载的股票新增一个季度时, update 只取出这个季度的数据并平移该股票的窗口 (add_quarter)。
+    """
+
+    def __init__(self):
+        self.tickers = []
+        self._rows = {}
+        self._values = np.full((0, len(TTM_ITEMS), WINDOW), np.nan)
+        self._dates = np.full((0, WINDOW), np.datetime64('NaT'), dtype='datetime64[ns]')
+        self._lock = threading.Lock()
+
+    def _row(self, ticker):
+        row = self._rows.get(ticker)
+        if row is None:
+            row = len(self.tickers)
+            if row == len(self._values):
+                # 按倍数扩容, 避免逐只追加时反复复制整个数组
+                capacity = max(16, 2 * len(self._values))
+                values = np.full((capacity, len(TTM_ITEMS), WINDOW), np.nan)
+                values[:row] = self._values
+                dates = np.full((capacity, WINDOW), np.datetime64('NaT'), dtype='datetime64[ns]')
+                dates[:row] = self._dates
+                self._values, self._dates = values, dates
+            self.tickers.append(ticker)
+            self._rows[ticker] = row
+        return row
+
+    def load(self, ticker, statements):
+        """
+        用一只股票的季度 NormalizedStatements (重新) 填充其最近4个季度的窗口。
+        三张季度报表按报告期对齐, 某张报表缺少某一季度时该季度对应项目为 NaN。
+        """
+        quarters = _quarters(statements)
+        offset = WINDOW - len(quarters)
+        window = np.full((len(TTM_ITEMS), WINDOW), np.nan)
+        window[:, offset:] = _window(statements, quarters)
+        with self._lock:
+            row = self._row(ticker)
+            self._values[row] = window
+            self._dates[row] = np.datetime64('NaT')
+            self._dates[row, offset:] = quarters
+
+    def update(self, ticker, statements):
+        """
+        用一只股票最新的季度报表更新窗口。
+        已加载的股票只多出一个更新的季度、其余季度与窗口中的一致时, 只加入这个季度 (add_quarter);
+        其他情况 (首次加载、报告期有变化、一次多出几个季度) 整体 load。
+        窗口中已有季度的数值沿用加载时的值, 不检查此后的重述。
+        :return: 'added' 或 'loaded'
+        """
+        quarters = _quarters(statements)
+        with self._lock:
+            row = self._rows.get(ticker)
+            known = None if row is None else self._dates[row][~np.isnat(self._dates[row])]
+        previous = quarters[:-1]
+        if known is not None and len(known) and len(quarters) and quarters[-1] > known[-1] \
+                and len(previous) <= len(known) and np.array_equal(previous, known[len(known) - len(previous):]):
+            column = _window(statements, quarters[-1:])[:, 0]
+            self.add_quarter(ticker, quarters[-1], dict(zip(TTM_ITEMS, column)))
+            return 'added'
+        self.load(ticker, statements)
+        return 'loaded'
+
+    def add_quarter(self, ticker, date, values):
+        """
+        增量加入一个季度: values 为 {项目: 数值}。
+        新于窗口内所有季度时窗口左移一格; 与窗口内已有季度同期时视为重述并覆盖; 更早的季度忽略。
+        :return: 是否更新了窗口
+        """
+        date = np.datetime64(pd.Timestamp(date).tz_localize(None), 'ns')
+        column = np.array([values.get(item, np.nan) for item in TTM_ITEMS], dtype=float)
+        with self._lock:
+            row = self._row(ticker)
+            dates = self._dates[row]
+            latest = dates[-1]
+            if np.isnat(latest) or date > latest:
+                self._values[row, :, :-1] = self._values[row, :, 1:]
+                self._dates[row, :-1] = dates[1:].copy()
+                self._values[row, :, -1] = column
+                self._dates[row, -1] = date
+                return True
+            matches = np.flatnonzero(dates == date)
+            if len(matches):
+                self._values[row, :, matches[0]] = column
+                return True
+            return False
+
+    def values(self, ticker):
+        """单只股票的 TTM 值 {项目: 数值或 None, 'as_of': 最近季度末}; 未加载时返回 None"""
+        with self._lock:
+            row = self._rows.get(ticker)
+            if row is None:
+                return None
+            computed = _compute(self._values[row:row + 1])[0]
+            as_of = self._dates[row, -1]
+        result = {item: (float(v) if np.isfinite(v) else None) for item, v in zip(TTM_ITEMS, computed)}
+        result['as_of'] = None if np.isnat(as_of) else pd.Timestamp(as_of)
+        return result
@@ -7,9 +7,10 @@ class StockValuationModel:
         self.market_return = market_return
         self.corporate_tax_rate = corporate_tax_rate
 
-    def calculate_cost_of_equity(self, beta):
-        """使用CAPM模型计算股权成本 (Re)"""
-        return self.risk_free_rate + beta * (self.market_return - self.risk_free_rate)
+    def calculate_cost_of_equity(self, beta, risk_free_rate=None):
+        """使用CAPM模型计算股权成本 (Re); risk_free_rate 为空时使用构造时给定的无风险利率"""
+        rf = self.risk_free_rate if risk_free_rate is None else risk_free_rate
+        return rf + beta * (self.market_return - rf)
 
     def calculate_wacc(self, market_cap, total_debt, cost_of_equity, cost_of_debt):
         """计算加权平均资本成本 (WACC)"""
@@ -45,6 +46,56 @@ class StockValuationModel:
         per_share_value = equity_value / shares_outstanding
         return per_share_value
 
+    def dcf_valuation_batch(self, current_fcf, growth_rates_high, terminal_growth_rate,
+                            wacc, shares_outstanding, total_debt, cash_equivalents):
+        """
+        向量化的 DCF 估值模型，公式与 dcf_valuation 相同。
+        growth_rates_high 的最后一维为预测年份，其余维度与其他参数 (标量或数组) 按 NumPy 规则广播。
+        WACC <= 永续增长率 或流通股数为0的单元格返回 NaN，而不是抛出异常。
+        """
+        growth = np.asarray(growth_rates_high, dtype=float)
+        wacc = np.asarray(wacc, dtype=float)
+        terminal_growth_rate = np.asarray(terminal_growth_rate, dtype=float)
+        shares_outstanding = np.asarray(shares_outstanding, dtype=float)
+        years = np.arange(1, growth.shape[-1] + 1)
+
+        fcf_path = np.asarray(current_fcf, dtype=float)[..., None] * np.cumprod(1 + growth, axis=-1)
+        discount = (1 + wacc[..., None]) ** years
+        with np.errstate(divide='ignore', invalid='ignore'):
+            explicit_value = (fcf_path / discount).sum(axis=-1)
+            terminal_value = fcf_path[..., -1] * (1 + terminal_growth_rate) / (wacc - terminal_growth_rate)
+            discounted_terminal_value = terminal_value / (1 + wacc) ** len(years)
+            equity_value = explicit_value + discounted_terminal_value - total_debt + cash_equivalents
+            per_share_value = equity_value / shares_outstanding
+        return np.where((wacc > terminal_growth_rate) & (shares_outstanding != 0), per_share_value, np.nan)
+
+    def dcf_sensitivity_grid(self, current_fcf, growth_paths, terminal_growth_rates, waccs,
+                             shares_outstanding, total_debt, cash_equivalents):
+        """
+        计算 WACC × 永续增长率 × 增长路径 的 DCF 敏感性表。
+        :param growth_paths: 形状为 (路径数, 年数) 的增长率矩阵，单条路径也可直接传入一维列表
+        :return: 形状为 (len(waccs), len(terminal_growth_rates), 路径数) 的每股价值数组，
+                 WACC <= 永续增长率 的单元格为 NaN
+        """
+        growth_paths = np.atleast_2d(np.asarray(growth_paths, dtype=float))
+        waccs = np.asarray(waccs, dtype=float).reshape(-1)
+        terminal_growth_rates = np.asarray(terminal_growth_rates, dtype=float).reshape(-1)
+        years = np.arange(1, growth_paths.shape[1] + 1)
+
+        # 预测期现金流与增长率无关于WACC, 先按路径计算一次, 再用矩阵乘法一次性折现到所有WACC
+        fcf_paths = current_fcf * np.cumprod(1 + growth_paths, axis=1)            # (P, Y)
+        discount_factors = (1 + waccs[:, None]) ** -years                         # (W, Y)
+        explicit_value = discount_factors @ fcf_paths.T                           # (W, P)
+
+        w = waccs[:, None, None]
+        g = terminal_growth_rates[None, :, None]
+        last_fcf = fcf_paths[:, -1][None, None, :]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            terminal_value = last_fcf * (1 + g) / (w - g) / (1 + w) ** len(years)  # (W, T, P)
+            equity_value = explicit_value[:, None, :] + terminal_value - total_debt + cash_equivalents
+            per_share_value = equity_value / shares_outstanding if shares_outstanding else np.nan
+        return np.where(w > g, per_share_value, np.nan)
+
     def relative_valuation(self, target_eps, target_sales_per_share, target_book_value_per_share,
                            competitor_avg_pe=None, competitor_avg_ps=None, competitor_avg_pb=None):
         """相对估值模型"""
@@ -70,6 +121,6 @@ class StockValuationModel:
         if Y is None or Y == 0:
             return None
         # 为了防止对超高增长公司给出不切实际的估值，格雷厄姆建议对增长率g进行限制
-        g = min(g, 20.0) # 将增长率的上限设为20%
+        g = np.minimum(g, 20.0) # 将增长率的上限设为20% (同时支持数组输入)
         value = (eps * (8.5 + 2 * g) * 4.4) / Y
         return value
\ No newline at end of file
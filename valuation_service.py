@@ -0,0 +1,355 @@
+import asyncio
+import hashlib
+import json
+import math
+import numbers
+import random
+import threading
+import time
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+
+import tracing
+from analysis_pipeline import flatten_valuation
+from http_client import FetchError
+
+# 估值用到的公司信息字段; 只有这些字段变化时才需要重新估值
+VALUATION_INFO_FIELDS = ('beta', 'marketCap', 'sharesOutstanding', 'trailingEps')
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                500: 'Internal Server Error', 502: 'Bad Gateway', 503: 'Service Unavailable'}
+
+
+class NoDataError(Exception):
+    """没有公司信息或历史行情, 无法估值"""
+
+
+def _json_safe(value):
+    """把估值结果中的 NumPy 标量、时间戳等转换为 JSON 可表示的类型, NaN/inf 转换为 null"""
+    if isinstance(value, dict):
+        return {str(key): _json_safe(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_json_safe(item) for item in value]
+    if value is None or isinstance(value, (str, bool)):
+        return value
+    if isinstance(value, numbers.Integral):
+        return int(value)
+    if isinstance(value, numbers.Real):
+        value = float(value)
+        return value if math.isfinite(value) else None
+    return str(value)
+
+
+def _json_response(payload):
+    return json.dumps(payload, ensure_ascii=False).encode('utf-8')
+
+
+class ValuationService:
+    """
+    本地估值 HTTP/JSON 服务, 对外提供与 GUI 相同的 获取 → 处理 → 估值 流水线。
+
+        GET /valuation/AAPL                 DCF、格雷厄姆和相对估值 (自动选择可比公司)
+        GET /valuation/NVDA?peers=AMD,INTC  指定竞争对手
+        GET /health                         请求、缓存和合并的统计
+
+    连接由 asyncio 事件循环处理, 上百个并发客户端不需要各占一个线程; 获取和估值在有限大小的线程池中执行。
+    结果按输入指纹 (报表日期、最新价格、估值所用的公司信息、利率、可比公司倍数和模型参数) 缓存为序列化好的响应,
+    只有输入变化时才重新估值。每个请求的指纹在 input_ttl 秒内直接复用, 重复查询不访问数据源;
+    超过 input_ttl 后重新获取输入 (通常命中本地缓存) 并计算指纹。
+    同一请求的并发调用合并为一次计算, 其余调用等待其结果。
+    """
+
+    def __init__(self, pipeline, workers=8, period="5y", input_ttl=60.0, memo_size=10000,
+                 peer_max_age=24 * 3600):
+        """
+        :param pipeline: StockAnalysisPipeline
+        :param workers: 获取和估值线程数, 即同时计算的请求数上限
+        :param input_ttl: 估值输入视为最新的秒数; 为 0 时每个请求都重新获取输入并计算指纹
+        :param memo_size: 最多缓存的估值结果数 (按最近使用淘汰)
+        :param peer_max_age: 可比公司索引中不超过该时长的竞争对手倍数直接使用
+        """
+        self.pipeline = pipeline
+        self.period = period
+        self.input_ttl = input_ttl
+        self.memo_size = memo_size
+        self.peer_max_age = peer_max_age
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='valuation')
+        # 指纹 -> 序列化好的响应体; 由工作线程写入, 事件循环读取
+        self._memo = OrderedDict()
+        self._memo_lock = threading.Lock()
+        # 以下两项只在事件循环线程中访问: 请求 -> (指纹, 过期时间), 请求 -> 进行中的计算
+        self._fresh = {}
+        self._inflight = {}
+        self.counts = Counter()
+        self._server = None
+
+    # --- 估值与缓存 ---
+
+    def _memo_get(self, fingerprint):
+        with self._memo_lock:
+            body = self._memo.get(fingerprint)
+            if body is not None:
+                self._memo.move_to_end(fingerprint)
+            return body
+
+    def _memo_put(self, fingerprint, body):
+        with self._memo_lock:
+            self._memo[fingerprint] = body
+            self._memo.move_to_end(fingerprint)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+
+    async def valuation(self, ticker, peers=()):
+        """
+        返回 (响应体, 来源); 来源为 fresh (输入未过期, 直接复用)、memo (输入未变化)、computed (重新估值)
+        或 coalesced (与进行中的相同请求合并)。
+        :raises NoDataError: 没有公司信息或历史行情
+        :raises FetchError: 获取数据失败
+        """
+        key = (ticker, tuple(peers))
+        self.counts['requests'] += 1
+        fresh = self._fresh.get(key)
+        if fresh is not None and fresh[1] > time.monotonic():
+            body = self._memo_get(fresh[0])
+            if body is not None:
+                self.counts['fresh'] += 1
+                return body, 'fresh'
+
+        flight = self._inflight.get(key)
+        if flight is not None:
+            self.counts['coalesced'] += 1
+            body, _ = await asyncio.shield(flight)
+            return body, 'coalesced'
+
+        flight = self._inflight[key] = asyncio.ensure_future(self._compute(key, ticker, peers))
+        # 发起者和等待者都经由 shield 等待: 任何一个请求断开连接被取消都不会取消计算本身, 其余等待者照常得到结果
+        return await asyncio.shield(flight)
+
+    async def _compute(self, key, ticker, peers):
+        """在线程池中估值一个请求; 作为独立的任务运行, 结束时 (无论成功与否) 从进行中的计算里移除"""
+        loop = asyncio.get_running_loop()
+        try:
+            fingerprint, body, source = await loop.run_in_executor(self._executor, self._valuate, ticker, peers)
+        except Exception:
+            self.counts['errors'] += 1
+            # 所有请求都已取消时没有人取得异常, 避免 "exception was never retrieved" 警告
+            asyncio.current_task().add_done_callback(lambda task: task.exception())
+            raise
+        finally:
+            del self._inflight[key]
+        self.counts[source] += 1
+        self._remember(key, fingerprint)
+        return body, source
+
+    def _remember(self, key, fingerprint):
+        now = time.monotonic()
+        if len(self._fresh) >= self.memo_size:
+            self._fresh = {k: v for k, v in self._fresh.items() if v[1] > now}
+        self._fresh[key] = (fingerprint, now + self.input_ttl)
+
+    def _valuate(self, ticker, peers):
+        """在工作线程中获取输入并计算指纹; 指纹已有缓存时直接返回, 否则运行处理和估值"""
+        fetcher, pipeline = self.pipeline.fetcher, self.pipeline
+        with tracing.span('valuation', 'service', ticker=ticker):
+            data = {'info': fetcher.get_company_info(ticker),
+                    'history': fetcher.get_stock_history(ticker, period=self.period),
+                    'financials': fetcher.get_financials(ticker)}
+            if not data['info'] or data['history'] is None or data['history'].empty:
+                raise NoDataError(f"无法获取 {ticker} 的公司信息或历史行情")
+            self._refresh_peers(peers)
+            fingerprint = self.fingerprint(ticker, data, peers)
+            body = self._memo_get(fingerprint)
+            if body is not None:
+                return fingerprint, body, 'memo'
+
+            data = pipeline.process(data, ticker)
+            result = pipeline.evaluate(ticker, data, peers=[p for p in peers if p in pipeline.peer_index])
+            body = _json_response({'ticker': ticker, 'fingerprint': fingerprint,
+                                   'price_date': str(data['history'].index[-1].date()),
+                                   'summary': _json_safe(flatten_valuation(result)),
+                                   'valuation': _json_safe(result)})
+            self._memo_put(fingerprint, body)
+            return fingerprint, body, 'computed'
+
+    def _refresh_peers(self, peers):
+        """竞争对手不在可比公司索引中或已过期时获取其信息; 获取失败只是少一个可比公司"""
+        index = self.pipeline.peer_index
+        for peer in peers:
+            if index.is_fresh(peer, self.peer_max_age):
+                continue
+            try:
+                info = self.pipeline.fetcher.get_company_info(peer)
+            except FetchError as e:
+                print(f"获取竞争对手 {peer} 信息时出错: {e}")
+                continue
+            if info:
+                index.update(peer, info)
+
+    def fingerprint(self, ticker, data, peers=()):
+        """
+        估值输入的指纹。
+        包括各报表的日期、最新交易日与收盘价、VALUATION_INFO_FIELDS、无风险利率与债券收益率、
+        可比公司及其倍数, 以及模型参数; 任何一项变化都会得到不同的指纹。
+        """
+        pipeline, model = self.pipeline, self.pipeline.valuation_model
+        info, history = data['info'], data['history']
+        # 先把本股票写入可比公司索引, 使自动选择的可比公司与 evaluate 中一致
+        pipeline.peer_index.update(ticker, info)
+        peer_list = list(peers) or pipeline.peer_index.peers(ticker, limit=pipeline.max_auto_peers)[0]
+        inputs = {
+            'ticker': ticker,
+            'statements': {name: [str(date) for date in frame.columns]
+                           for name, frame in sorted((data['financials'] or {}).items()) if frame is not None},
+            'price': [str(history.index[-1]), float(history['Close'].iloc[-1])],
+            'info': {field: info.get(field) for field in VALUATION_INFO_FIELDS},
+            'rates': [pipeline.rates.risk_free_rate(default=model.risk_free_rate), pipeline.rates.graham_yield()],
+            'peers': [peer_list, pipeline.peer_index.multiples(peer_list, pipeline.peer_statistic)],
+            'model': [model.risk_free_rate, model.market_return, model.corporate_tax_rate,
+                      pipeline.peer_statistic, pipeline.max_auto_peers, self.period],
+        }
+        return hashlib.sha1(json.dumps(inputs, sort_keys=True, default=str).encode('utf-8')).hexdigest()[:16]
+
+    def stats(self):
+        with self._memo_lock:
+            memo_size = len(self._memo)
+        return dict(self.counts, memo_entries=memo_size, inflight=len(self._inflight))
+
+    # --- HTTP ---
+
+    async def _route(self, method, target):
+        """返回 (状态码, 响应体, 附加响应头)"""
+        if method != 'GET':
+            return 405, _json_response({'error': "只支持 GET 请求"}), {}
+        url = urlsplit(target)
+        path = url.path.rstrip('/')
+        if path == '/health':
+            return 200, _json_response(self.stats()), {}
+        if not path.startswith('/valuation/'):
+            return 404, _json_response({'error': f"未知路径: {url.path}"}), {}
+
+        ticker = unquote(path[len('/valuation/'):]).strip().upper()
+        if not ticker or '/' in ticker:
+            return 400, _json_response({'error': "缺少股票代码"}), {}
+        peers = tuple(dict.fromkeys(peer.strip().upper() for value in parse_qs(url.query).get('peers', [])
+                                    for peer in value.split(',') if peer.strip()))
+        try:
+            body, source = await self.valuation(ticker, peers)
+        except NoDataError as e:
+            return 404, _json_response({'ticker': ticker, 'error': str(e)}), {}
+        except FetchError as e:
+            # 限流或网络故障 (可重试) 与数据源返回的错误分开, 客户端可据此决定是否稍后重试
+            headers = {'Retry-After': str(math.ceil(e.retry_after))} if e.retry_after else {}
+            return (503 if e.retryable else 502), _json_response({'ticker': ticker, 'error': str(e)}), headers
+        except Exception as e:
+            print(f"估值 {ticker} 时出错: {e}")
+            return 500, _json_response({'ticker': ticker, 'error': str(e)}), {}
+        return 200, body, {'X-Valuation-Cache': source}
+
+    async def handle(self, reader, writer):
+        """处理一个连接; 支持 HTTP/1.1 keep-alive, 同一连接上的请求依次处理"""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b'\r\n\r\n')
+                except (asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+                    break
+                lines = head.decode('latin-1').split('\r\n')
+                request_line = lines[0].split()
+                headers = {name.strip().lower(): value.strip()
+                           for name, _, value in (line.partition(':') for line in lines[1:] if line)}
+                if headers.get('content-length'):
+                    await reader.readexactly(int(headers['content-length']))
+                keep_alive = (len(request_line) == 3 and request_line[2] == 'HTTP/1.1'
+                              and headers.get('connection', '').lower() != 'close')
+                if len(request_line) != 3:
+                    status, body, extra = 400, _json_response({'error': "无法解析的请求"}), {}
+                else:
+                    status, body, extra = await self._route(request_line[0], request_line[1])
+                extra['Connection'] = 'keep-alive' if keep_alive else 'close'
+                response = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}",
+                            "Content-Type: application/json; charset=utf-8", f"Content-Length: {len(body)}"]
+                response += [f"{name}: {value}" for name, value in extra.items()]
+                writer.write(("\r\n".join(response) + "\r\n\r\n").encode('latin-1') + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host='127.0.0.1', port=8765):
+        """开始监听 (port 为 0 时由系统分配端口); 返回实际的 (主机, 端口)"""
+        self._server = await asyncio.start_server(self.handle, host, port, backlog=1024)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self, host='127.0.0.1', port=8765):
+        host, port = await self.start(host, port)
+        print(f"估值服务已启动: http://{host}:{port}/valuation/<代码>")
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+async def _load_client(host, port, paths, latencies, statuses, sources):
+    """一个保持连接的客户端, 依次发送 paths 中的请求"""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for path in paths:
+            start = time.perf_counter()
+            writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode('latin-1'))
+            await writer.drain()
+            head = (await reader.readuntil(b'\r\n\r\n')).decode('latin-1').split('\r\n')
+            headers = {name.strip().lower(): value.strip()
+                       for name, _, value in (line.partition(':') for line in head[1:] if line)}
+            await reader.readexactly(int(headers.get('content-length', 0)))
+            latencies.append(time.perf_counter() - start)
+            statuses[int(head[0].split()[1])] += 1
+            sources[headers.get('x-valuation-cache', '-')] += 1
+    finally:
+        writer.close()
+
+
+async def load_test(host, port, tickers, clients=100, requests_per_client=20, seed=0):
+    """
+    向估值服务发起 clients 个并发连接, 每个连接依次请求 requests_per_client 个随机选取的股票。
+    :return: 汇总字典 (请求数、耗时、吞吐量、延迟分位数、状态码和缓存来源的分布)
+    """
+    rng = random.Random(seed)
+    plans = [[f"/valuation/{rng.choice(tickers)}" for _ in range(requests_per_client)] for _ in range(clients)]
+    latencies, statuses, sources = [], Counter(), Counter()
+    start = time.perf_counter()
+    results = await asyncio.gather(*(_load_client(host, port, paths, latencies, statuses, sources)
+                                     for paths in plans), return_exceptions=True)
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+
+    def percentile(q):
+        return latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000 if latencies else None
+
+    return {'requests': len(latencies), 'elapsed': elapsed, 'throughput': len(latencies) / elapsed if elapsed else 0,
+            'p50_ms': percentile(0.50), 'p95_ms': percentile(0.95), 'p99_ms': percentile(0.99),
+            'max_ms': latencies[-1] * 1000 if latencies else None,
+            'statuses': dict(statuses), 'sources': dict(sources),
+            'client_errors': [str(r) for r in results if isinstance(r, Exception)]}
+
+
+def format_load_test(summary):
+    if not summary['requests']:
+        return "没有完成任何请求: " + "; ".join(summary['client_errors'][:3])
+    lines = [f"请求 {summary['requests']} 个, 耗时 {summary['elapsed']:.2f} 秒, 吞吐量 {summary['throughput']:.0f} 个/秒",
+             f"延迟 p50={summary['p50_ms']:.2f}ms p95={summary['p95_ms']:.2f}ms p99={summary['p99_ms']:.2f}ms "
+             f"max={summary['max_ms']:.2f}ms",
+             "状态码: " + ", ".join(f"{k}={v}" for k, v in sorted(summary['statuses'].items())),
+             "来源: " + ", ".join(f"{k}={v}" for k, v in sorted(summary['sources'].items()))]
+    if summary['client_errors']:
+        lines.append(f"{len(summary['client_errors'])} 个客户端连接出错, 例如: {summary['client_errors'][0]}")
+    return "\n".join(lines)
@@ -1,33 +1,83 @@
+import matplotlib.dates as mdates
 import matplotlib.pyplot as plt
+import numpy as np
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 import tkinter as tk
 
+import tracing
+
 # --- 问题修复代码块 [开始] ---
 
-# 1. 解决中文显示问题：设置Matplotlib使用支持中文的字体
-#    程序会依次尝试使用 'SimHei' (Windows常用), 'PingFang SC' (macOS常用)。
-#    如果都没有，你需要自行安装一个中文字体, 例如 'Source Han Sans' (思源黑体)。
-try:
-    plt.rcParams['font.sans-serif'] = ['SimHei']
-except:
+_matplotlib_configured = False
+
+
+def _configure_matplotlib():
+    """在首次创建图表时设置字体 (而不是导入模块时), 只执行一次"""
+    global _matplotlib_configured
+    if _matplotlib_configured:
+        return
+    _matplotlib_configured = True
+
+    # 1. 解决中文显示问题：设置Matplotlib使用支持中文的字体
+    #    程序会依次尝试使用 'SimHei' (Windows常用), 'PingFang SC' (macOS常用)。
+    #    如果都没有，你需要自行安装一个中文字体, 例如 'Source Han Sans' (思源黑体)。
     try:
-        plt.rcParams['font.sans-serif'] = ['PingFang SC']
+        plt.rcParams['font.sans-serif'] = ['SimHei']
     except:
-        print("警告：未找到 'SimHei' 或 'PingFang SC' 字体。中文可能无法正确显示。")
-        print("请考虑安装支持中文的字体，如 'Source Han Sans'。")
-        plt.rcParams['font.sans-serif'] = ['sans-serif']
+        try:
+            plt.rcParams['font.sans-serif'] = ['PingFang SC']
+        except:
+            print("警告：未找到 'SimHei' 或 'PingFang SC' 字体。中文可能无法正确显示。")
+            print("请考虑安装支持中文的字体，如 'Source Han Sans'。")
+            plt.rcParams['font.sans-serif'] = ['sans-serif']
 
-# 2. 解决负号显示问题：在使用中文字体后，负号有时也会显示为方框。
-plt.rcParams['axes.unicode_minus'] = False
+    # 2. 解决负号显示问题：在使用中文字体后，负号有时也会显示为方框。
+    plt.rcParams['axes.unicode_minus'] = False
 
 
 # --- 问题修复代码块 [结束] ---
 
 
+def _decimate(x, y, x_min, x_max, n_buckets):
+    """
+    视口感知的最小/最大值抽稀: 只保留可见范围 (两侧各多留一个点) 内的数据，
+    并把它等分为 n_buckets 段，每段只保留最小值和最大值所在的点。
+    这样绘制的点数不超过像素宽度的两倍，同时保留价格的尖峰形状。
+    """
+    lo = max(int(np.searchsorted(x, x_min, side='left')) - 1, 0)
+    hi = min(int(np.searchsorted(x, x_max, side='right')) + 1, len(x))
+    x, y = x[lo:hi], y[lo:hi]
+    n = len(x)
+    if n <= 2 * n_buckets:
+        return x, y
+    per_bucket = -(-n // n_buckets)
+    padded = np.full(n_buckets * per_bucket, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(n_buckets, per_bucket)
+    nan_mask = np.isnan(padded)
+    base = np.arange(n_buckets) * per_bucket
+    idx_min = base + np.where(nan_mask, np.inf, padded).argmin(axis=1)
+    idx_max = base + np.where(nan_mask, -np.inf, padded).argmax(axis=1)
+    idx = np.unique(np.concatenate([idx_min, idx_max, [0, n - 1]]))
+    idx = idx[idx < n]
+    return x[idx], y[idx]
+
+
 class StockVisualizer:
-    def __init__(self, master=None):
+    def __init__(self, master=None, figsize=(10, 6)):
         """初始化Visualizer，创建图布和坐标轴"""
-        self.fig, self.ax = plt.subplots(figsize=(10, 6))
+        _configure_matplotlib()
+        self.fig, self.ax = plt.subplots(figsize=figsize)
+        self._colorbar = None
+        # 可复用的折线: {图例标签: Line2D}, 以及对应的完整分辨率数据 {图例标签: (x, y)}
+        self._lines = {}
+        self._series = {}
+        self._layout_key = None
+        self._data_bounds = None
+        self._background = None
+        self._user_view = False
+        self._updating_limits = False
+        self._saving = False
         # 如果在Tkinter主窗口中，则嵌入图表
         if master:
             self.canvas = FigureCanvasTkAgg(self.fig, master=master)
@@ -36,24 +86,197 @@ class StockVisualizer:
             toolbar = NavigationToolbar2Tk(self.canvas, master)
             toolbar.update()
             self.canvas_widget.pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+            self.canvas.mpl_connect('draw_event', self._on_draw)
+            # 工具栏的保存按钮调用 figure.savefig; 保存期间折线需作为普通图元绘制才会出现在导出文件中
+            self._figure_savefig = self.fig.savefig
+            self.fig.savefig = self._savefig
+
+    def _savefig(self, *args, **kwargs):
+        """导出图片 (PNG/SVG/PDF 等) 时暂时取消折线的 animated, 导出后重绘画布以恢复 blit 背景"""
+        lines = list(self._lines.values())
+        self._saving = True
+        for line in lines:
+            line.set_animated(False)
+        try:
+            return self._figure_savefig(*args, **kwargs)
+        finally:
+            for line in lines:
+                line.set_animated(True)
+            self._saving = False
+            self.canvas.draw_idle()
 
+    @tracing.traced('render.price_history', 'render')
     def plot_price_history(self, df_dict, title="股票价格历史", indicator_col=None):
         """绘制股价历史和可选指标"""
-        self.ax.clear()
+        series = {}
         for ticker, df in df_dict.items():
             if not df.empty:
-                self.ax.plot(df.index, df['Close'], label=f'{ticker} 收盘价')
+                series[f'{ticker} 收盘价'] = (df.index, df['Close'], {})
                 if indicator_col and indicator_col in df.columns:
-                    self.ax.plot(df.index, df[indicator_col], label=f'{ticker} {indicator_col}', linestyle='--')
-        self._format_plot(title, "日期", "价格")
+                    series[f'{ticker} {indicator_col}'] = (df.index, df[indicator_col], {'linestyle': '--'})
+        self._render_series(series, title, "日期", "价格")
 
+    @tracing.traced('render.comparison', 'render')
     def plot_multi_stock_comparison(self, df_dict, metric="Close", title="股票比较"):
         """比较多只股票的同一指标"""
-        self.ax.clear()
+        series = {}
         for ticker, df in df_dict.items():
             if not df.empty and metric in df.columns:
-                self.ax.plot(df.index, df[metric], label=f'{ticker} {metric}')
-        self._format_plot(title, "日期", metric)
+                series[f'{ticker} {metric}'] = (df.index, df[metric], {})
+        self._render_series(series, title, "日期", metric)
+
+    def _render_series(self, series, title, xlabel, ylabel):
+        """
+        若图中已有相同的一组折线，则只用 set_data 更新数据 (仅追加新数据时使用 blit 局部刷新)；
+        否则才清空坐标轴、重建折线并重新排版。
+        """
+        self._series = {label: (mdates.date2num(index), np.asarray(values, dtype=float))
+                        for label, (index, values, _) in series.items()}
+        layout_key = (title, xlabel, ylabel, tuple(series))
+        if layout_key == self._layout_key and self._lines:
+            self._refresh_lines()
+            return
+
+        self.ax.clear()
+        self._lines = {}
+        self._layout_key = layout_key
+        self._user_view = False
+        self._background = None
+        # ax.clear() 会重置坐标轴的回调, 需要重新注册缩放/平移时的重采样
+        self.ax.callbacks.connect('xlim_changed', self._on_xlim_changed)
+        self.ax.xaxis_date()
+        bounds = self._bounds()
+        for label, (_, _, style) in series.items():
+            x, y = self._series[label]
+            if bounds is not None:
+                x, y = _decimate(x, y, bounds[0], bounds[1], self._pixel_width())
+            line, = self.ax.plot(x, y, label=label, animated=hasattr(self, 'canvas'), **style)
+            self._lines[label] = line
+        # 立即完成自动缩放, 避免绘制时延迟触发的 xlim_changed 被误认为用户缩放
+        self._updating_limits = True
+        try:
+            self.ax.relim()
+            self.ax.autoscale_view()
+            self.ax.get_xlim()
+        finally:
+            self._updating_limits = False
+        self._data_bounds = bounds
+        self._format_plot(title, xlabel, ylabel)
+
+    def _refresh_lines(self):
+        bounds = self._bounds()
+        if bounds is None:
+            return
+        x_min, x_max = self.ax.get_xlim()
+        y_min, y_max = self.ax.get_ylim()
+        appended = self._data_bounds is not None and bounds[0] == self._data_bounds[0]
+        fits = bounds[1] <= x_max and y_min <= bounds[2] and bounds[3] <= y_max
+        if appended and (fits or self._user_view) and self._background is not None:
+            # 只是在现有视图内追加了数据: 恢复背景并只重绘折线
+            self._set_line_data()
+            self.canvas.restore_region(self._background)
+            for line in self._lines.values():
+                self.ax.draw_artist(line)
+            self.canvas.blit(self.ax.bbox)
+            return
+
+        self._updating_limits = True
+        try:
+            self._set_line_data(bounds[0], bounds[1])
+            self.ax.relim()
+            self.ax.autoscale_view()
+            self._set_line_data()
+        finally:
+            self._updating_limits = False
+        self._user_view = False
+        self._data_bounds = bounds
+        self._draw()
+
+    def _set_line_data(self, x_min=None, x_max=None):
+        """按当前视口 (或指定范围) 抽稀后更新各折线的数据"""
+        if x_min is None:
+            x_min, x_max = self.ax.get_xlim()
+        width = self._pixel_width()
+        for label, line in self._lines.items():
+            x, y = self._series[label]
+            line.set_data(*_decimate(x, y, x_min, x_max, width))
+
+    def _bounds(self):
+        """所有序列的 (x最小, x最大, y最小, y最大), 没有数据时返回 None"""
+        xs = [x for x, _ in self._series.values() if len(x)]
+        ys = [y[~np.isnan(y)] for _, y in self._series.values()]
+        ys = [y for y in ys if len(y)]
+        if not xs or not ys:
+            return None
+        return (min(x[0] for x in xs), max(x[-1] for x in xs),
+                min(y.min() for y in ys), max(y.max() for y in ys))
+
+    def _pixel_width(self):
+        return max(int(self.ax.bbox.width), 100)
+
+    def _on_xlim_changed(self, ax):
+        """工具栏缩放/平移后按新的视口重新抽稀"""
+        if self._updating_limits or not self._lines:
+            return
+        self._user_view = True
+        self._set_line_data()
+        if hasattr(self, 'canvas'):
+            self.canvas.draw_idle()
+
+    def _on_draw(self, event):
+        """完整重绘后保存不含折线的背景, 再画出折线 (折线为 animated, 供 blit 局部刷新)"""
+        # 保存为 SVG/PDF 时 draw_event 来自矢量后端的画布, 它不支持 copy_from_bbox / draw_artist
+        if not self._lines or self._saving or event.canvas is not self.canvas:
+            return
+        self._background = self.canvas.copy_from_bbox(self.ax.bbox)
+        for line in self._lines.values():
+            self.ax.draw_artist(line)
+
+    def _draw(self):
+        if hasattr(self, 'canvas'):
+            self.canvas.draw_idle()
+        else:
+            plt.show()
+
+    @tracing.traced('render.sensitivity', 'render')
+    def plot_sensitivity_heatmap(self, values, waccs, terminal_growth_rates, title="DCF 敏感性分析",
+                                 base_point=None, current_price=None):
+        """
+        绘制 WACC × 永续增长率 的每股价值热力图。
+        :param values: 形状为 (len(waccs), len(terminal_growth_rates)) 的数组，NaN 单元格 (WACC <= g) 留白
+        :param base_point: 可选的 (wacc, g) 基准假设，在图中标记
+        :param current_price: 可选的当前股价，绘制 "估值 = 股价" 的等值线
+        """
+        if self._colorbar is not None:
+            self._colorbar.remove()
+            self._colorbar = None
+        self.ax.clear()
+        self._lines = {}
+        self._layout_key = None
+
+        waccs = np.asarray(waccs) * 100
+        growths = np.asarray(terminal_growth_rates) * 100
+        masked = np.ma.masked_invalid(values)
+        extent = [growths[0], growths[-1], waccs[0], waccs[-1]]
+        image = self.ax.imshow(masked, origin='lower', aspect='auto', cmap='RdYlGn', extent=extent,
+                               interpolation='nearest')
+        self._colorbar = self.fig.colorbar(image, ax=self.ax)
+        self._colorbar.set_label("每股价值 ($)", fontsize=12)
+
+        if current_price is not None and masked.count() > 0 and masked.min() < current_price < masked.max():
+            self.ax.contour(growths, waccs, masked, levels=[current_price], colors='black', linewidths=1.5)
+        if base_point is not None:
+            self.ax.plot(base_point[1] * 100, base_point[0] * 100, marker='x', color='black', markersize=12)
+
+        self.ax.set_title(title, fontsize=16, weight='bold')
+        self.ax.set_xlabel("永续增长率 (%)", fontsize=12)
+        self.ax.set_ylabel("WACC (%)", fontsize=12)
+        self.ax.tick_params(axis='both', which='major', labelsize=10)
+        self.fig.tight_layout()
+        if hasattr(self, 'canvas'):
+            self.canvas.draw()
+        else:
+            plt.show()
 
     def _format_plot(self, title, xlabel, ylabel):
         """